@@ -0,0 +1,367 @@
+# aidcare_pipeline/cache_backends.py
+# Storage behind rate_limiter's response cache and request counters.
+#
+#   memory  - per-process dicts (default); lost on restart, not shared by workers
+#   sqlite  - one WAL-mode SQLite file shared by every process on the host;
+#             survives restarts and deploys that keep the file
+#   redis   - any Redis-compatible server (Redis, Valkey, KeyDB); shared across
+#             hosts; needs the `redis` package
+#
+# Selected with CACHE_BACKEND. The rate-limit check and the recording of the
+# request happen in one transaction (SQLite) or one Lua script (Redis), so
+# concurrent workers cannot both take the last slot of a window. Cached values
+# are stored as JSON in the shared backends.
+
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import defaultdict
+from typing import Any, Dict, Optional, Tuple
+
+_PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_PIPELINE_DIR)
+
+CACHE_BACKEND = os.getenv("CACHE_BACKEND", "memory").lower()
+CACHE_BACKENDS = ("memory", "sqlite", "redis")
+CACHE_SQLITE_PATH = os.getenv("CACHE_SQLITE_PATH", os.path.join(_PROJECT_ROOT, "data", "cache", "rate_limiter.sqlite3"))
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0")
+CACHE_KEY_PREFIX = os.getenv("CACHE_KEY_PREFIX", "aidcare:")
+# Short socket timeouts so an unreachable Redis fails fast and the callers fail open
+CACHE_REDIS_CONNECT_TIMEOUT_SECONDS = float(os.getenv("CACHE_REDIS_CONNECT_TIMEOUT_SECONDS", "0.5"))
+CACHE_REDIS_TIMEOUT_SECONDS = float(os.getenv("CACHE_REDIS_TIMEOUT_SECONDS", "1.0"))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1000"))
+
+# Request timestamps older than this are never needed (the per-day window)
+_DAY_SECONDS = 86400
+_MINUTE_SECONDS = 60
+
+
+class MemoryCacheBackend:
+    """Module-local dicts, as rate_limiter has always used."""
+
+    name = "memory"
+
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._cache: Dict[str, Tuple[Any, float]] = {}
+        self._request_counts: Dict[str, list] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Tuple[Optional[Any], bool]:
+        """Returns (value, expired); value is None on a miss or when expired."""
+        with self._lock:
+            if key not in self._cache:
+                return None, False
+            value, expiry = self._cache[key]
+            if time.time() < expiry:
+                return value, False
+            del self._cache[key]
+            return None, True
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        with self._lock:
+            self._cache[key] = (value, time.time() + ttl)
+            # Basic cache size management
+            if len(self._cache) > self.max_entries:
+                # Remove the soonest-expiring 10% when the cache gets too large
+                sorted_items = sorted(self._cache.items(), key=lambda x: x[1][1])
+                for k, _ in sorted_items[:max(1, self.max_entries // 10)]:
+                    del self._cache[k]
+
+    def _recent(self, identifier: str, now: float) -> list:
+        self._request_counts[identifier] = [t for t in self._request_counts[identifier] if now - t < _DAY_SECONDS]
+        return self._request_counts[identifier]
+
+    def acquire(self, identifier: str, per_minute: int, per_day: int) -> Optional[float]:
+        """Record a request unless a limit is reached; returns the seconds to wait, or None."""
+        now = time.time()
+        with self._lock:
+            day = self._recent(identifier, now)
+            minute = [t for t in day if now - t < _MINUTE_SECONDS]
+            if len(minute) >= per_minute:
+                return _MINUTE_SECONDS - (now - minute[0])
+            if len(day) >= per_day:
+                return _DAY_SECONDS - (now - day[0])
+            day.append(now)
+            return None
+
+    def request_counts(self, identifier: str) -> Tuple[int, int]:
+        """(requests in the last minute, requests in the last day)."""
+        now = time.time()
+        with self._lock:
+            day = self._recent(identifier, now)
+            return sum(1 for t in day if now - t < _MINUTE_SECONDS), len(day)
+
+    def size(self) -> int:
+        return len(self._cache)
+
+    def clear(self) -> int:
+        with self._lock:
+            count = len(self._cache)
+            self._cache.clear()
+            return count
+
+    def clear_rate_limits(self, identifier: Optional[str] = None) -> None:
+        with self._lock:
+            if identifier:
+                self._request_counts.pop(identifier, None)
+            else:
+                self._request_counts.clear()
+
+
+class SQLiteCacheBackend:
+    """
+    WAL-mode SQLite file shared by the worker processes on one host. Each
+    thread gets its own connection; writers wait up to busy_timeout for the lock.
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path: str = CACHE_SQLITE_PATH, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS response_cache ("
+            " key TEXT PRIMARY KEY,"
+            " value TEXT NOT NULL,"
+            " expires_at REAL NOT NULL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_expiry ON response_cache (expires_at)")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS rate_limit_requests ("
+            " identifier TEXT NOT NULL,"
+            " requested_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_rate_limit_requests ON rate_limit_requests (identifier, requested_at)"
+        )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Autocommit; multi-statement updates open their own transaction
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> Tuple[Optional[Any], bool]:
+        row = self._conn().execute(
+            "SELECT value, expires_at FROM response_cache WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None, False
+        if time.time() < row[1]:
+            return json.loads(row[0]), False
+        self._conn().execute("DELETE FROM response_cache WHERE key = ? AND expires_at = ?", (key, row[1]))
+        return None, True
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        payload = json.dumps(value)
+        now = time.time()
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO response_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                (key, payload, now + ttl),
+            )
+            conn.execute("DELETE FROM response_cache WHERE expires_at <= ?", (now,))
+            # Keep the newest-expiring max_entries rows
+            conn.execute(
+                "DELETE FROM response_cache WHERE key IN ("
+                " SELECT key FROM response_cache ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def acquire(self, identifier: str, per_minute: int, per_day: int) -> Optional[float]:
+        now = time.time()
+        conn = self._conn()
+        # The write lock is taken up front so the count and the insert are atomic across processes
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "DELETE FROM rate_limit_requests WHERE identifier = ? AND requested_at <= ?",
+                (identifier, now - _DAY_SECONDS),
+            )
+            minute_count, oldest_in_minute = conn.execute(
+                "SELECT COUNT(*), MIN(requested_at) FROM rate_limit_requests WHERE identifier = ? AND requested_at > ?",
+                (identifier, now - _MINUTE_SECONDS),
+            ).fetchone()
+            day_count, oldest_in_day = conn.execute(
+                "SELECT COUNT(*), MIN(requested_at) FROM rate_limit_requests WHERE identifier = ?",
+                (identifier,),
+            ).fetchone()
+            retry_after = None
+            if minute_count >= per_minute:
+                retry_after = _MINUTE_SECONDS - (now - oldest_in_minute)
+            elif day_count >= per_day:
+                retry_after = _DAY_SECONDS - (now - oldest_in_day)
+            else:
+                conn.execute(
+                    "INSERT INTO rate_limit_requests (identifier, requested_at) VALUES (?, ?)", (identifier, now)
+                )
+            conn.execute("COMMIT")
+            return retry_after
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def request_counts(self, identifier: str) -> Tuple[int, int]:
+        now = time.time()
+        minute_count, day_count = self._conn().execute(
+            "SELECT COALESCE(SUM(requested_at > ?), 0), COUNT(*) FROM rate_limit_requests "
+            "WHERE identifier = ? AND requested_at > ?",
+            (now - _MINUTE_SECONDS, identifier, now - _DAY_SECONDS),
+        ).fetchone()
+        return int(minute_count), int(day_count)
+
+    def size(self) -> int:
+        return self._conn().execute(
+            "SELECT COUNT(*) FROM response_cache WHERE expires_at > ?", (time.time(),)
+        ).fetchone()[0]
+
+    def clear(self) -> int:
+        return self._conn().execute("DELETE FROM response_cache").rowcount
+
+    def clear_rate_limits(self, identifier: Optional[str] = None) -> None:
+        if identifier:
+            self._conn().execute("DELETE FROM rate_limit_requests WHERE identifier = ?", (identifier,))
+        else:
+            self._conn().execute("DELETE FROM rate_limit_requests")
+
+
+# KEYS[1] = sorted set of request times; ARGV = now, per_minute, per_day, member.
+# Returns the seconds to wait as a string, or nil once the request is recorded.
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - 86400)
+local minute_count = redis.call('ZCOUNT', KEYS[1], '(' .. (now - 60), '+inf')
+if minute_count >= tonumber(ARGV[2]) then
+    local oldest = redis.call('ZRANGEBYSCORE', KEYS[1], '(' .. (now - 60), '+inf', 'WITHSCORES', 'LIMIT', 0, 1)
+    return tostring(60 - (now - tonumber(oldest[2])))
+end
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    local oldest = redis.call('ZRANGE', KEYS[1], 0, 0, 'WITHSCORES')
+    return tostring(86400 - (now - tonumber(oldest[2])))
+end
+redis.call('ZADD', KEYS[1], now, ARGV[4])
+redis.call('EXPIRE', KEYS[1], 86400)
+return nil
+"""
+
+
+class RedisCacheBackend:
+    """
+    Redis-compatible server shared by every worker and host. Cached values
+    expire through Redis TTLs; request times are kept in one sorted set per
+    identifier.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str = CACHE_REDIS_URL, prefix: str = CACHE_KEY_PREFIX):
+        try:
+            import redis
+        except ImportError as e:
+            raise RuntimeError("CACHE_BACKEND=redis requires the 'redis' package (pip install redis).") from e
+        self.url = url
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(
+            url, decode_responses=True,
+            socket_connect_timeout=CACHE_REDIS_CONNECT_TIMEOUT_SECONDS,
+            socket_timeout=CACHE_REDIS_TIMEOUT_SECONDS,
+        )
+        self._acquire = self._client.register_script(_ACQUIRE_SCRIPT)
+
+    def _cache_key(self, key: str) -> str:
+        return f"{self.prefix}cache:{key}"
+
+    def _requests_key(self, identifier: str) -> str:
+        return f"{self.prefix}requests:{identifier}"
+
+    def get(self, key: str) -> Tuple[Optional[Any], bool]:
+        # Redis drops expired keys itself, so an expiry looks like a miss
+        raw = self._client.get(self._cache_key(key))
+        return (json.loads(raw) if raw is not None else None), False
+
+    def set(self, key: str, value: Any, ttl: int) -> None:
+        self._client.set(self._cache_key(key), json.dumps(value), ex=max(1, int(ttl)))
+
+    def acquire(self, identifier: str, per_minute: int, per_day: int) -> Optional[float]:
+        retry_after = self._acquire(
+            keys=[self._requests_key(identifier)],
+            args=[time.time(), per_minute, per_day, uuid.uuid4().hex],
+        )
+        return float(retry_after) if retry_after is not None else None
+
+    def request_counts(self, identifier: str) -> Tuple[int, int]:
+        now = time.time()
+        key = self._requests_key(identifier)
+        pipe = self._client.pipeline()
+        pipe.zcount(key, f"({now - _MINUTE_SECONDS}", "+inf")
+        pipe.zcount(key, f"({now - _DAY_SECONDS}", "+inf")
+        minute_count, day_count = pipe.execute()
+        return int(minute_count), int(day_count)
+
+    def _scan(self, pattern: str) -> list:
+        return list(self._client.scan_iter(match=f"{self.prefix}{pattern}", count=500))
+
+    def size(self) -> int:
+        return len(self._scan("cache:*"))
+
+    def clear(self) -> int:
+        keys = self._scan("cache:*")
+        return self._client.delete(*keys) if keys else 0
+
+    def clear_rate_limits(self, identifier: Optional[str] = None) -> None:
+        keys = [self._requests_key(identifier)] if identifier else self._scan("requests:*")
+        if keys:
+            self._client.delete(*keys)
+
+
+def create_cache_backend(kind: str = CACHE_BACKEND):
+    """
+    Args:
+        kind: 'memory', 'sqlite' or 'redis'
+
+    Raises:
+        ValueError: If kind is not a known backend
+        RuntimeError: If the redis backend is chosen without the redis package
+    """
+    if kind == "memory":
+        return MemoryCacheBackend()
+    if kind == "sqlite":
+        return SQLiteCacheBackend()
+    if kind == "redis":
+        return RedisCacheBackend()
+    raise ValueError(f"Unknown cache backend '{kind}'. Expected one of: {', '.join(CACHE_BACKENDS)}")
+
+
+# --- Global instance ---
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_cache_backend():
+    """The process-wide backend chosen by CACHE_BACKEND, created on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_cache_backend()
+                print(f"CacheBackend: Using '{_backend.name}' backend for the response cache and rate limits.")
+    return _backend
@@ -3,6 +3,8 @@ import google.generativeai as genai
 import json
 import os
 import time
+from .context_packing import ContextBlock, field_lines, pack_blocks, truncate_to_tokens
+from .kb_partitions import merged_variants
 
 GEMINI_MODEL_CLINICAL_SUPPORT = os.getenv("GEMINI_MODEL_CLINICAL_SUPPORT", "gemini-3-pro-preview")
 # GOOGLE_API_KEY is expected to be loaded by main.py and genai configured there,
@@ -11,6 +13,42 @@ GEMINI_MODEL_CLINICAL_SUPPORT = os.getenv("GEMINI_MODEL_CLINICAL_SUPPORT", "gemi
 
 _MODERN_GEMINI_PREFIXES = ("gemini-1.5", "gemini-2", "gemini-3")
 
+# Token budget for patient + knowledge context in the prompt (0 = unlimited)
+CLINICAL_SUPPORT_CONTEXT_BUDGET_TOKENS = int(os.getenv("CLINICAL_SUPPORT_CONTEXT_BUDGET_TOKENS", "2500"))
+# Per-excerpt cap for the patient's past documents (~500 characters)
+PATIENT_DOCUMENT_EXCERPT_TOKENS = int(os.getenv("PATIENT_DOCUMENT_EXCERPT_TOKENS", "125"))
+
+
+def _knowledge_entry_text(i: int, entry: dict) -> str:
+    score = entry.get('retrieval_score (distance)')
+    score_str = f"{score:.4f}" if isinstance(score, (int, float)) else "N/A"
+    lines = [f"\n--- Knowledge Entry {i+1} (Retrieval Score/Distance: {score_str}) ---"]
+    lines += field_lines([
+        ("Source Type", entry.get('source_type')),
+        ("Source Name", entry.get('source_document_name')),
+    ])
+    if entry.get('source_type') == "Textbook" and entry.get('disease_info'):
+        disease = entry['disease_info']
+        lines += field_lines([
+            ("Disease", disease.get('disease')),
+            ("Textbook Symptoms", ', '.join(disease.get('symptoms', []))),
+            ("Textbook Investigations", ', '.join(disease.get('diagnosis', {}).get('investigations', []))),
+            ("Textbook Treatment (First-line)", ', '.join(disease.get('treatment', {}).get('first_line', []))),
+            ("Textbook Triage Alert", disease.get('contextual_notes', {}).get('triage_alert')),
+        ])
+    elif entry.get('source_type') == "Guideline":
+        lines += field_lines([
+            ("Guideline Case", entry.get('case')),
+            ("Guideline Clinical Judgement", entry.get('clinical_judgement')),
+            ("Guideline Actions", ', '.join(entry.get('action', [])) if isinstance(entry.get('action', []), list) else entry.get('action', '')),
+        ])
+        for label, fields in merged_variants(entry):
+            lines += field_lines([
+                (f"Guideline Clinical Judgement ({label})", fields.get('clinical_judgement')),
+                (f"Guideline Actions ({label})", fields.get('action')),
+            ])
+    return "\n".join(lines)
+
 def generate_clinical_support_details(
     extracted_clinical_info: dict, 
     retrieved_knowledge_entries: list,
@@ -36,61 +74,55 @@ def generate_clinical_support_details(
 
     model = genai.GenerativeModel(GEMINI_MODEL_CLINICAL_SUPPORT)
 
-    # --- Prepare context from extracted_clinical_info ---
-    patient_context_str = "Patient's Current Presentation & Information (from live consultation transcript):\n"
+    # --- Prepare context blocks; pack_blocks() fits them into the token budget ---
+    blocks = []
+    presentation = ["Patient's Current Presentation & Information (from live consultation transcript):"]
     if extracted_clinical_info.get('presenting_symptoms'):
-        patient_context_str += f"- Presenting Symptoms: {', '.join(extracted_clinical_info['presenting_symptoms'])}\n"
+        presentation.append(f"- Presenting Symptoms: {', '.join(extracted_clinical_info['presenting_symptoms'])}")
     else:
-        patient_context_str += "- Presenting Symptoms: None explicitly extracted from transcript.\n"
-    
+        presentation.append("- Presenting Symptoms: None explicitly extracted from transcript.")
     if extracted_clinical_info.get('symptom_details'):
-        patient_context_str += "- Symptom Details (from transcript):\n"
+        presentation.append("- Symptom Details (from transcript):")
         for symptom, detail in extracted_clinical_info.get('symptom_details', {}).items():
-            patient_context_str += f"  - {symptom}: {detail}\n"
-    if extracted_clinical_info.get('relevant_medical_history'):
-        patient_context_str += f"- Relevant Medical History (from transcript): {', '.join(extracted_clinical_info['relevant_medical_history'])}\n"
-    if extracted_clinical_info.get('allergies_mentioned'):
-        patient_context_str += f"- Known Allergies (from transcript): {', '.join(extracted_clinical_info['allergies_mentioned'])}\n"
+            presentation.append(f"  - {symptom}: {detail}")
+    presentation += field_lines([
+        ("- Relevant Medical History (from transcript)", extracted_clinical_info.get('relevant_medical_history')),
+        # Allergies stay in the required block: they gate medication suggestions
+        ("- Known Allergies (from transcript)", extracted_clinical_info.get('allergies_mentioned')),
+    ])
     # You can add more from extracted_clinical_info here, like family history, social, exam findings etc.
-    # Example:
-    # if extracted_clinical_info.get('key_examination_findings_verbalized'):
-    #     patient_context_str += f"- Key Examination Findings (from transcript): {', '.join(extracted_clinical_info['key_examination_findings_verbalized'])}\n"
-
+    blocks.append(ContextBlock("presentation", "\n".join(presentation), required=True))
 
+    # The doctor's own input is never trimmed; retrieved knowledge gives way first
     if manual_context_supplement and manual_context_supplement.strip():
-        patient_context_str += f"\nAdditional Manually Entered Context by Doctor:\n{manual_context_supplement.strip()}\n"
-    
+        blocks.append(ContextBlock(
+            "manual_context",
+            f"\nAdditional Manually Entered Context by Doctor:\n{manual_context_supplement.strip()}",
+            required=True,
+        ))
+
     if patient_historical_document_texts: # This is a list of strings (extracted text from past docs)
-        patient_context_str += "\nRelevant Excerpts from Patient's Past Uploaded Documents:\n"
+        blocks.append(ContextBlock("documents_header", "\nRelevant Excerpts from Patient's Past Uploaded Documents:", required=True))
         for i, doc_text in enumerate(patient_historical_document_texts):
             doc_text_str = str(doc_text) if doc_text is not None else "No text available for this document."
-            patient_context_str += f"--- Document Excerpt {i+1} ---\n{doc_text_str[:500]}...\n" # Show a snippet
-
-    # --- Prepare context from retrieved_knowledge_entries (textbooks, guidelines) ---
-    knowledge_context_str = "\nRetrieved Relevant Knowledge Base Information (from general medical literature/guidelines):\n"
+            excerpt = truncate_to_tokens(doc_text_str, PATIENT_DOCUMENT_EXCERPT_TOKENS) # Show a snippet
+            # Patient records outrank the retrieved knowledge entries (priority 50 - i)
+            blocks.append(ContextBlock(f"document:{i+1}", f"--- Document Excerpt {i+1} ---\n{excerpt}", priority=100 - i))
+
+    # --- Retrieved knowledge entries (textbooks, guidelines), best match first ---
+    blocks.append(ContextBlock(
+        "knowledge_header",
+        "\nRetrieved Relevant Knowledge Base Information (from general medical literature/guidelines):",
+        required=True,
+    ))
     if not retrieved_knowledge_entries:
-        knowledge_context_str += "No specific knowledge base entries were retrieved for this presentation.\n"
+        blocks.append(ContextBlock("knowledge_none", "No specific knowledge base entries were retrieved for this presentation.", required=True))
     else:
         for i, entry in enumerate(retrieved_knowledge_entries[:3]): # Using top 3 relevant entries
-            knowledge_context_str += f"\n--- Knowledge Entry {i+1} (Retrieval Score/Distance: {entry.get('retrieval_score (distance)', 'N/A'):.4f}) ---\n"
-            knowledge_context_str += f"Source Type: {entry.get('source_type', 'N/A')}\n"
-            knowledge_context_str += f"Source Name: {entry.get('source_document_name', 'N/A')}\n"
-            if entry.get('source_type') == "Textbook" and entry.get('disease_info'):
-                disease = entry['disease_info']
-                knowledge_context_str += f"Disease: {disease.get('disease', 'N/A')}\n"
-                knowledge_context_str += f"Textbook Symptoms: {', '.join(disease.get('symptoms', []))}\n"
-                knowledge_context_str += f"Textbook Investigations: {', '.join(disease.get('diagnosis', {}).get('investigations', []))}\n"
-                knowledge_context_str += f"Textbook Treatment (First-line): {', '.join(disease.get('treatment', {}).get('first_line', []))}\n"
-                if disease.get('contextual_notes', {}).get('triage_alert'):
-                    knowledge_context_str += f"Textbook Triage Alert: {disease['contextual_notes']['triage_alert']}\n"
-            elif entry.get('source_type') == "Guideline":
-                knowledge_context_str += f"Guideline Case: {entry.get('case', 'N/A')}\n"
-                knowledge_context_str += f"Guideline Clinical Judgement: {entry.get('clinical_judgement', 'N/A')}\n"
-                knowledge_context_str += f"Guideline Actions: {', '.join(entry.get('action', [])) if isinstance(entry.get('action', []), list) else entry.get('action', '')}\n"
-            # Optionally include a snippet of the original chunk text for LLM context
-            # if entry.get('original_text_chunk'):
-            #     knowledge_context_str += f"Original Chunk Snippet: {entry.get('original_text_chunk', '')[:250]}...\n"
+            blocks.append(ContextBlock(f"knowledge:{i+1}", _knowledge_entry_text(i, entry), priority=50 - i))
 
+    packed = pack_blocks(blocks, CLINICAL_SUPPORT_CONTEXT_BUDGET_TOKENS, label="clinical support")
+    context_str = packed.text
 
     system_instruction = (
         "You are an AI Clinical Decision Support assistant for medical professionals. "
@@ -104,8 +136,7 @@ def generate_clinical_support_details(
         "If the knowledge base is sparse for a given patient symptom, state that and suggest general principles or referral if appropriate."
     )
     prompt = f"""
-    {patient_context_str}
-    {knowledge_context_str}
+    {context_str}
 
     Task:
     Based ONLY on ALL the provided patient information (current consultation, manual doctor input, past document excerpts) 
@@ -191,6 +222,7 @@ def generate_clinical_support_details(
                 # You might want to fill missing keys with default empty values or retry
                 for key in missing_keys:
                     support_details[key] = [] if key != "differential_summary_for_doctor" else "" # Default values
+            support_details["context_packing"] = packed.report()
             return support_details
 
         except json.JSONDecodeError as e:
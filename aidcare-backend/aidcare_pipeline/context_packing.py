@@ -0,0 +1,197 @@
+# aidcare_pipeline/context_packing.py
+# Token-budgeted packing of retrieved evidence and patient records into LLM prompts.
+#
+# Generators describe their context as blocks (one per guideline entry,
+# document excerpt or consultation) with a priority. pack_blocks() keeps the
+# required blocks, then adds the rest in priority order until the token budget
+# is spent, truncating the block that crosses the budget and dropping what no
+# longer fits. Blocks are emitted in their original order, and the returned
+# report records what was truncated or dropped.
+#
+# Token counts use tiktoken when it is installed and a ~4 characters per token
+# estimate otherwise; budgets are meant as cost/latency caps, not exact limits.
+# The tiktoken encoding (which may be downloaded) is loaded on the first count,
+# not at import time.
+
+import os
+import threading
+from typing import Any, Dict, Iterable, List, Tuple
+
+CHARS_PER_TOKEN = 4
+TRUNCATION_MARKER = " …[truncated]"
+# Truncating a block to less than this is not worth it; the block is dropped instead
+MIN_TRUNCATED_TOKENS = int(os.getenv("CONTEXT_MIN_TRUNCATED_TOKENS", "40"))
+
+# Values that carry no information for the model
+_EMPTY_VALUES = {"", "n/a", "na", "none", "[]", "not specified.", "not specified"}
+
+
+# --- Global instance, loaded on first use ---
+_encoding = None
+_encoding_loaded = False
+_encoding_lock = threading.Lock()
+
+
+def _get_encoding():
+    """tiktoken's cl100k_base encoding, or None when unavailable (the character estimate is used)."""
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        with _encoding_lock:
+            if not _encoding_loaded:
+                try:
+                    import tiktoken
+                    _encoding = tiktoken.get_encoding("cl100k_base")
+                except Exception as e:  # not installed, or the encoding file cannot be fetched
+                    print(f"Context Packing: tiktoken unavailable ({e}); estimating {CHARS_PER_TOKEN} characters per token.")
+                _encoding_loaded = True
+    return _encoding
+
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to roughly max_tokens, at a word boundary, marking the cut."""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max(0, max_tokens - estimate_tokens(TRUNCATION_MARKER))
+    encoding = _get_encoding()
+    if encoding is not None:
+        cut = encoding.decode(encoding.encode(text, disallowed_special=())[:budget])
+    else:
+        cut = text[:budget * CHARS_PER_TOKEN]
+    if " " in cut:
+        cut = cut[:cut.rindex(" ")]
+    return cut.rstrip(" ,;:") + TRUNCATION_MARKER
+
+
+def _as_text(value: Any) -> str:
+    if isinstance(value, (list, tuple)):
+        return "; ".join(str(v) for v in value if v not in (None, ""))
+    return "" if value is None else str(value).strip()
+
+
+def field_lines(fields: Iterable[Tuple[str, Any]], indent: str = "") -> List[str]:
+    """
+    "Label: value" lines for the fields worth sending: empty / "N/A" values
+    are skipped, as is a value already sent under an earlier label (e.g. a
+    clinical judgement that repeats the case text).
+    """
+    lines, seen = [], set()
+    for label, value in fields:
+        text = _as_text(value)
+        key = " ".join(text.lower().split())
+        if key in _EMPTY_VALUES or key in seen:
+            continue
+        seen.add(key)
+        lines.append(f"{indent}{label}: {text}")
+    return lines
+
+
+class ContextBlock:
+    """One unit of prompt context."""
+
+    def __init__(self, key: str, text: str, priority: float = 0.0, required: bool = False, truncatable: bool = True):
+        """
+        Args:
+            key: Identifies the block in the packing report (e.g. "guideline:2")
+            text: The block's prompt text
+            priority: Higher is kept first when the budget runs out
+            required: Always included in full, even over budget
+            truncatable: Whether the block may be shortened instead of dropped
+        """
+        self.key = key
+        self.text = text
+        self.priority = priority
+        self.required = required
+        self.truncatable = truncatable
+        self.tokens = estimate_tokens(text)
+
+
+class PackedContext:
+    def __init__(self, text: str, budget_tokens: int, used_tokens: int,
+                 included: List[str], truncated: List[str], dropped: List[str], input_tokens: int):
+        self.text = text
+        self.budget_tokens = budget_tokens
+        self.used_tokens = used_tokens
+        self.included = included
+        self.truncated = truncated
+        self.dropped = dropped
+        self.input_tokens = input_tokens
+
+    def report(self) -> Dict[str, Any]:
+        return {
+            "budget_tokens": self.budget_tokens,
+            "input_tokens": self.input_tokens,
+            "used_tokens": self.used_tokens,
+            "included": self.included,
+            "truncated": self.truncated,
+            "dropped": self.dropped,
+        }
+
+
+def pack_blocks(blocks: List[ContextBlock], budget_tokens: int, separator: str = "\n",
+                label: str = "Context") -> PackedContext:
+    """
+    Fit blocks into budget_tokens.
+
+    Args:
+        blocks: Context blocks in the order they should appear in the prompt
+        budget_tokens: Token budget for the packed text (0 or less means unlimited)
+        separator: Joins the kept blocks
+        label: Name used in the log line
+
+    Returns:
+        PackedContext with the packed text and what was kept, truncated and dropped
+    """
+    input_tokens = sum(block.tokens for block in blocks)
+    separator_tokens = estimate_tokens(separator)
+    texts: Dict[int, str] = {}
+    truncated: List[str] = []
+    dropped: List[str] = []
+
+    if budget_tokens <= 0:
+        texts = {i: block.text for i, block in enumerate(blocks)}
+        remaining = 0
+    else:
+        remaining = budget_tokens
+        for i, block in enumerate(blocks):
+            if block.required:
+                texts[i] = block.text
+                remaining -= block.tokens + separator_tokens
+        # Stable sort: equal priorities keep their prompt order
+        for i in sorted((i for i, b in enumerate(blocks) if not b.required), key=lambda i: -blocks[i].priority):
+            block = blocks[i]
+            cost = block.tokens + separator_tokens
+            if cost <= remaining:
+                texts[i] = block.text
+                remaining -= cost
+            elif block.truncatable and remaining - separator_tokens >= MIN_TRUNCATED_TOKENS:
+                texts[i] = truncate_to_tokens(block.text, remaining - separator_tokens)
+                remaining -= estimate_tokens(texts[i]) + separator_tokens
+                truncated.append(block.key)
+            else:
+                dropped.append(block.key)
+
+    ordered = sorted(texts)
+    text = separator.join(texts[i] for i in ordered)
+    packed = PackedContext(
+        text=text,
+        budget_tokens=budget_tokens,
+        used_tokens=estimate_tokens(text),
+        included=[blocks[i].key for i in ordered],
+        truncated=truncated,
+        dropped=dropped,
+        input_tokens=input_tokens,
+    )
+    if truncated or dropped:
+        print(f"Context Packing ({label}): {packed.used_tokens}/{budget_tokens} tokens "
+              f"(from {input_tokens}); truncated: {', '.join(truncated) or 'none'}; "
+              f"dropped: {', '.join(dropped) or 'none'}")
+    return packed
@@ -0,0 +1,100 @@
+# aidcare_pipeline/embedding_cache.py
+# Persistent chunk-embedding cache for the KB build scripts.
+# Vectors are keyed by (model name, SHA-256 of the chunk text), so a rebuild only
+# embeds chunks that are new or changed; everything else comes from disk.
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Dict, Sequence
+
+import numpy as np
+
+_PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_PIPELINE_DIR)
+
+DEFAULT_EMBEDDING_CACHE_PATH = os.getenv(
+    "KB_EMBEDDING_CACHE_PATH",
+    os.path.join(_PROJECT_ROOT, "data", "embedding_cache", "chunk_embeddings.sqlite3"),
+)
+
+# SQLite caps bound parameters per statement; stay well below it
+_LOOKUP_CHUNK = 500
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """SQLite-backed store of float32 embeddings for one embedding model."""
+
+    def __init__(self, path: str = DEFAULT_EMBEDDING_CACHE_PATH, model_name: str = ""):
+        self.path = path
+        self.model_name = model_name
+        cache_dir = os.path.dirname(path)
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunk_embeddings ("
+            " model_name TEXT NOT NULL,"
+            " text_hash TEXT NOT NULL,"
+            " dim INTEGER NOT NULL,"
+            " vector BLOB NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " PRIMARY KEY (model_name, text_hash))"
+        )
+        self._conn.commit()
+
+    def get_many(self, texts: Sequence[str]) -> Dict[int, np.ndarray]:
+        """Return {position: vector} for every text already in the cache."""
+        hashes = [text_hash(t) for t in texts]
+        found: Dict[str, np.ndarray] = {}
+        unique_hashes = list(dict.fromkeys(hashes))
+        for start in range(0, len(unique_hashes), _LOOKUP_CHUNK):
+            chunk = unique_hashes[start:start + _LOOKUP_CHUNK]
+            placeholders = ",".join("?" * len(chunk))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM chunk_embeddings "
+                f"WHERE model_name = ? AND text_hash IN ({placeholders})",
+                [self.model_name, *chunk],
+            )
+            for h, blob in rows:
+                found[h] = np.frombuffer(blob, dtype="float32")
+        return {i: found[h] for i, h in enumerate(hashes) if h in found}
+
+    def put_many(self, texts: Sequence[str], vectors: np.ndarray) -> None:
+        now = time.time()
+        vectors = np.asarray(vectors, dtype="float32")
+        self._conn.executemany(
+            "INSERT OR REPLACE INTO chunk_embeddings (model_name, text_hash, dim, vector, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [
+                (self.model_name, text_hash(t), int(v.shape[0]), v.tobytes(), now)
+                for t, v in zip(texts, vectors)
+            ],
+        )
+        self._conn.commit()
+
+    def count(self) -> int:
+        row = self._conn.execute(
+            "SELECT COUNT(*) FROM chunk_embeddings WHERE model_name = ?", (self.model_name,)
+        ).fetchone()
+        return int(row[0])
+
+    def close(self) -> None:
+        self._conn.close()
+
+
+def add_embedding_cache_arguments(parser) -> None:
+    """Add the --embedding-cache / --no-embedding-cache options shared by the KB prep scripts."""
+    parser.add_argument(
+        "--embedding-cache", default=DEFAULT_EMBEDDING_CACHE_PATH,
+        help="SQLite file holding chunk embeddings keyed by text hash and model (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--no-embedding-cache", action="store_true",
+        help="Re-embed every chunk and leave the cache untouched",
+    )
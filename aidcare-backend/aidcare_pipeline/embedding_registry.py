@@ -0,0 +1,124 @@
+# aidcare_pipeline/embedding_registry.py
+# Process-wide registry of loaded sentence-embedding models.
+# Every retriever and KB build script asks for its encoder here, so one copy of
+# each model is loaded per process no matter how many knowledge bases use it.
+#
+# Backends (EMBEDDING_BACKEND):
+#   torch - SentenceTransformer on PyTorch (default)
+#   onnx  - int8-quantized export run by onnxruntime (see onnx_encoder.py); no torch import
+
+import os
+import time
+from threading import Lock
+from typing import Any, Dict, Optional
+
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_RAG", 'all-MiniLM-L6-v2')
+EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "torch").lower()
+ENCODER_BACKENDS = ("torch", "onnx")
+
+_registry_lock = Lock()
+_encoders: Dict[str, Any] = {}
+_encoder_stats: Dict[str, Dict[str, Any]] = {}
+
+
+def _model_size_bytes(model: Any) -> int:
+    if hasattr(model, "size_bytes"):
+        return model.size_bytes()
+    try:
+        return sum(p.numel() * p.element_size() for p in model.parameters())
+    except Exception:
+        return 0
+
+
+def encoder_id(model_name: str = EMBEDDING_MODEL_NAME, backend: str | None = None) -> str:
+    """
+    Identity of an encoder's vectors, e.g. for embedding-cache keys and build manifests.
+    The torch backend keeps the bare model name so existing caches stay valid.
+    """
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    return model_name if backend == "torch" else f"{model_name}@{backend}-int8"
+
+
+def _load_encoder(model_name: str, backend: str):
+    if backend == "onnx":
+        from .onnx_encoder import OnnxSentenceEncoder, onnx_model_dir_for
+        return OnnxSentenceEncoder(onnx_model_dir_for(model_name))
+    if backend != "torch":
+        raise ValueError(f"Unknown embedding backend '{backend}'. Expected one of: {', '.join(ENCODER_BACKENDS)}")
+    # Imported lazily so importing this module does not pull in torch
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(model_name)
+
+
+def get_encoder(model_name: str = EMBEDDING_MODEL_NAME, backend: str | None = None,
+                consumer: Optional[str] = None):
+    """
+    Return the shared encoder for model_name on the given backend (default
+    EMBEDDING_BACKEND), loading it on first use.
+
+    Safe to call from several threads; concurrent first calls load the model once.
+
+    Args:
+        model_name: Sentence-transformer model name
+        backend: "torch" or "onnx"; defaults to EMBEDDING_BACKEND
+        consumer: Label of a long-lived user of the encoder (e.g. a retriever's
+            index path), counted once in the sharing report. Per-request
+            lookups leave it unset and do not touch the stats.
+    """
+    backend = (backend or EMBEDDING_BACKEND).lower()
+    key = encoder_id(model_name, backend)
+    encoder = _encoders.get(key)
+    if encoder is None:
+        with _registry_lock:
+            encoder = _encoders.get(key)
+            if encoder is None:
+                print(f"EmbeddingRegistry: Loading {backend} encoder for model: {model_name}...")
+                start = time.perf_counter()
+                encoder = _load_encoder(model_name, backend)
+                load_seconds = time.perf_counter() - start
+                _encoders[key] = encoder
+                _encoder_stats[key] = {
+                    "load_seconds": load_seconds,
+                    "size_bytes": _model_size_bytes(encoder),
+                    "consumers": set(),
+                }
+                print(f"EmbeddingRegistry: Encoder '{key}' loaded in {load_seconds:.2f}s.")
+
+    if consumer is not None:
+        with _registry_lock:
+            _encoder_stats[key]["consumers"].add(consumer)
+    return encoder
+
+
+def get_registry_stats() -> Dict[str, Any]:
+    """Per-model load stats plus the memory and load time saved by sharing between distinct consumers."""
+    with _registry_lock:
+        models = {}
+        saved_bytes = 0
+        saved_seconds = 0.0
+        for name, stats in _encoder_stats.items():
+            reuses = max(0, len(stats["consumers"]) - 1)
+            models[name] = {
+                "size_mb": round(stats["size_bytes"] / (1024 * 1024), 1),
+                "load_seconds": round(stats["load_seconds"], 2),
+                "consumers": sorted(stats["consumers"]),
+            }
+            saved_bytes += reuses * stats["size_bytes"]
+            saved_seconds += reuses * stats["load_seconds"]
+        return {
+            "models_loaded": len(models),
+            "models": models,
+            "memory_saved_mb": round(saved_bytes / (1024 * 1024), 1),
+            "load_seconds_saved": round(saved_seconds, 2),
+        }
+
+
+def print_registry_report() -> None:
+    stats = get_registry_stats()
+    if not stats["models_loaded"]:
+        print("EmbeddingRegistry: No embedding models loaded yet (retrievers load on first use).")
+        return
+    for name, model in stats["models"].items():
+        print(f"EmbeddingRegistry: '{name}' ({model['size_mb']} MB) shared by {len(model['consumers'])} consumer(s).")
+    print(f"EmbeddingRegistry: Sharing saved ~{stats['memory_saved_mb']} MB of model weights "
+          f"and {stats['load_seconds_saved']}s of load time.")
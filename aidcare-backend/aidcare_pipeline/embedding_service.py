@@ -0,0 +1,315 @@
+# aidcare_pipeline/embedding_service.py
+# Optional out-of-process embedding service.
+#
+# One local process owns the sentence-transformer model and the FAISS indexes and
+# answers batched encode/search requests over a Unix domain socket. When
+# EMBEDDING_SERVICE_SOCKET is set, the API workers use RemoteGuidelineRetriever
+# (a thin client with the GuidelineRetriever search API) instead of loading
+# torch and the indexes themselves, so N workers share one model copy.
+#
+# Wire format: every message is a 4-byte big-endian length followed by a UTF-8
+# JSON object. Requests carry an "op"; responses carry "ok" plus the result or
+# an "error". A connection may send any number of requests.
+#
+# Run the service with:  python -m aidcare_pipeline.embedding_service
+
+import json
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET", "")
+EMBEDDING_SERVICE_TIMEOUT = float(os.getenv("EMBEDDING_SERVICE_TIMEOUT", "30"))
+
+_LENGTH = struct.Struct(">I")
+_MAX_MESSAGE_BYTES = 64 * 1024 * 1024
+
+
+class EmbeddingServiceError(RuntimeError):
+    """Raised by the client when the service is unreachable or reports an error."""
+
+
+def _recv_exact(sock: socket.socket, n: int) -> bytes:
+    data = bytearray()
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise ConnectionError("Embedding service connection closed")
+        data.extend(chunk)
+    return bytes(data)
+
+
+def send_message(sock: socket.socket, message: Dict[str, Any]) -> None:
+    body = json.dumps(message, separators=(",", ":")).encode("utf-8")
+    sock.sendall(_LENGTH.pack(len(body)) + body)
+
+
+def recv_message(sock: socket.socket) -> Dict[str, Any]:
+    (length,) = _LENGTH.unpack(_recv_exact(sock, _LENGTH.size))
+    if length > _MAX_MESSAGE_BYTES:
+        raise ConnectionError(f"Embedding service message too large ({length} bytes)")
+    return json.loads(_recv_exact(sock, length).decode("utf-8"))
+
+
+# --- Client ---
+
+# Failures that mean the request never reached the service, so it is safe to send again
+_RETRYABLE_ERRORS = (ConnectionRefusedError, BrokenPipeError, ConnectionResetError)
+
+
+class EmbeddingServiceClient:
+    """Length-prefixed JSON client with one persistent connection per thread."""
+
+    def __init__(self, socket_path: str = EMBEDDING_SERVICE_SOCKET, timeout: float = EMBEDDING_SERVICE_TIMEOUT):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connect(self) -> socket.socket:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self._local.sock = sock
+        return sock
+
+    def _close(self) -> None:
+        sock = getattr(self._local, "sock", None)
+        if sock is not None:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._local.sock = None
+
+    def request(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send one request and return the response payload.
+
+        A connection found broken while sending (e.g. the service restarted) is
+        retried once on a fresh connection. Once the request has been sent it
+        is never repeated: a timeout or a failure while waiting for the reply
+        is raised, so a slow search or a reload is not run twice.
+
+        Raises:
+            EmbeddingServiceError: If the service cannot be reached, does not answer in time or returns an error
+        """
+        for attempt in range(2):
+            sent = False
+            try:
+                sock = getattr(self._local, "sock", None) or self._connect()
+                send_message(sock, message)
+                sent = True
+                response = recv_message(sock)
+                break
+            except (OSError, ConnectionError) as e:
+                # The reply to an abandoned request could still arrive on this connection
+                self._close()
+                retryable = isinstance(e, _RETRYABLE_ERRORS) and not sent
+                if attempt == 1 or not retryable:
+                    raise EmbeddingServiceError(f"Embedding service at {self.socket_path} unavailable: {e}")
+        if not response.get("ok"):
+            raise EmbeddingServiceError(response.get("error", "Unknown embedding service error"))
+        return response
+
+
+class RemoteGuidelineRetriever:
+    """
+    GuidelineRetriever stand-in that forwards searches to the embedding service.
+
+    Exposes the search methods plus ntotal, version and manifest, refreshed from
+    each response so hot-swaps done inside the service are visible here.
+    """
+
+    def __init__(self, kind: str, client: Optional[EmbeddingServiceClient] = None):
+        self.kind = kind
+        self.client = client or EmbeddingServiceClient()
+        self.ntotal = 0
+        self.version: Optional[str] = None
+        self.manifest: Dict[str, Any] = {}
+        self.refresh()
+        print(f"RemoteGuidelineRetriever: '{kind}' served by {self.client.socket_path} "
+              f"(version {self.version}, {self.ntotal} vectors)")
+
+    def _update(self, response: Dict[str, Any]) -> None:
+        self.ntotal = int(response.get("ntotal", self.ntotal))
+        self.version = response.get("version", self.version)
+        if "manifest" in response:
+            self.manifest = response["manifest"]
+
+    def refresh(self) -> None:
+        self._update(self.client.request({"op": "info", "kb": self.kind}))
+
+    def validate(self) -> None:
+        if self.ntotal == 0:
+            raise ValueError(f"Remote '{self.kind}' index is empty.")
+
+    @staticmethod
+    def build_query_text(symptoms_list: list) -> str:
+        return f"Patient symptoms: {', '.join(symptoms_list)}."
+
+    def encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        response = self.client.request({"op": "encode", "texts": query_texts})
+        return np.asarray(response["vectors"], dtype="float32")
+
+    def _search(self, op: str, symptoms_lists: List[list], top_k: int, filters: Optional[dict]) -> List[list]:
+        response = self.client.request({
+            "op": op, "kb": self.kind, "symptoms_lists": symptoms_lists, "top_k": top_k, "filters": filters,
+        })
+        self._update(response)
+        return response["results"]
+
+    def retrieve_relevant_guidelines(self, symptoms_list: list, top_k: int = 3, filters: Optional[dict] = None) -> list:
+        if not symptoms_list:
+            return []
+        return self.retrieve_relevant_guidelines_batch([symptoms_list], top_k=top_k, filters=filters)[0]
+
+    def retrieve_relevant_guidelines_batch(self, symptoms_lists: List[list], top_k: int = 3,
+                                           filters: Optional[dict] = None) -> List[list]:
+        return self._search("search", symptoms_lists, top_k, filters)
+
+    def retrieve_hybrid(self, symptoms_list: list, top_k: int = 3, filters: Optional[dict] = None) -> list:
+        if not symptoms_list:
+            return []
+        return self.retrieve_hybrid_batch([symptoms_list], top_k=top_k, filters=filters)[0]
+
+    def retrieve_hybrid_batch(self, symptoms_lists: List[list], top_k: int = 3,
+                              filters: Optional[dict] = None) -> List[list]:
+        return self._search("hybrid", symptoms_lists, top_k, filters)
+
+    def reload(self) -> Dict[str, Any]:
+        """Ask the service to hot-swap this KB; returns the service's reload status."""
+        return self.client.request({"op": "reload", "kb": self.kind})["status"]
+
+
+# --- Server ---
+
+def _retriever_info(retriever) -> Dict[str, Any]:
+    return {"ntotal": int(retriever.ntotal), "version": retriever.version}
+
+
+def handle_request(message: Dict[str, Any]) -> Dict[str, Any]:
+    """Dispatch one request against the retrievers loaded in this process."""
+    from .embedding_registry import EMBEDDING_MODEL_NAME, get_encoder
+    from .rag_retrieval import (
+        get_federated_retriever,
+        get_retrieval_cache_stats,
+        get_retriever,
+        get_retriever_status,
+        reload_retriever,
+    )
+
+    op = message.get("op")
+    if op == "ping":
+        return {"ok": True}
+    if op == "status":
+        return {"ok": True, "status": get_retriever_status()}
+    if op == "cache_stats":
+        return {"ok": True, "stats": get_retrieval_cache_stats()}
+    if op == "encode":
+        vectors = get_encoder(EMBEDDING_MODEL_NAME).encode(message.get("texts", []), convert_to_numpy=True)
+        return {"ok": True, "vectors": vectors.tolist()}
+
+    if op == "federated":
+        federated = get_federated_retriever(kinds=message.get("kinds"), weights=message.get("weights"))
+        results = federated.retrieve_relevant_guidelines_batch(
+            message.get("symptoms_lists", []), top_k=int(message.get("top_k", 3)), filters=message.get("filters"),
+        )
+        return {"ok": True, "results": results}
+
+    kind = message.get("kb", "chw")
+    if op == "reload":
+        return {"ok": True, "status": reload_retriever(kind)}
+
+    retriever = get_retriever(kind)
+    if op == "info":
+        return {"ok": True, "manifest": retriever.manifest, **_retriever_info(retriever)}
+    if op in ("search", "hybrid"):
+        symptoms_lists = message.get("symptoms_lists", [])
+        top_k = int(message.get("top_k", 3))
+        filters = message.get("filters")
+        if op == "search":
+            results = retriever.retrieve_relevant_guidelines_batch(symptoms_lists, top_k=top_k, filters=filters)
+        else:
+            results = retriever.retrieve_hybrid_batch(symptoms_lists, top_k=top_k, filters=filters)
+        return {"ok": True, "results": results, **_retriever_info(retriever)}
+    return {"ok": False, "error": f"Unknown op '{op}'"}
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        while True:
+            try:
+                message = recv_message(self.request)
+            except (ConnectionError, OSError):
+                return
+            try:
+                response = handle_request(message)
+            except Exception as e:
+                response = {"ok": False, "error": f"{type(e).__name__}: {e}"}
+            try:
+                send_message(self.request, response)
+            except OSError:
+                return
+
+
+class EmbeddingServiceServer(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+
+
+def serve(socket_path: str = EMBEDDING_SERVICE_SOCKET, kinds: Optional[List[str]] = None) -> None:
+    """Load the encoder and indexes in this process and serve them on socket_path until interrupted."""
+    from . import rag_retrieval
+
+    if not socket_path:
+        raise ValueError("EMBEDDING_SERVICE_SOCKET is not set.")
+    # This process owns the indexes, so it must never act as a client of itself
+    rag_retrieval.serve_retrievers_locally()
+
+    start = time.perf_counter()
+    for kind in kinds or list(rag_retrieval.RETRIEVER_KINDS):
+        try:
+            rag_retrieval.get_retriever(kind)
+        except Exception as e:
+            print(f"EmbeddingService: Could not load '{kind}' knowledge base: {e}")
+    print(f"EmbeddingService: Retrievers loaded in {time.perf_counter() - start:.2f}s")
+
+    if os.path.exists(socket_path):
+        os.remove(socket_path)  # stale socket from a previous run
+    # Owner-only socket (0600): only processes of this user can query or reload the KBs
+    previous_umask = os.umask(0o177)
+    try:
+        server = EmbeddingServiceServer(socket_path, _RequestHandler)
+    finally:
+        os.umask(previous_umask)
+    with server:
+        print(f"EmbeddingService: Listening on {socket_path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            if os.path.exists(socket_path):
+                os.remove(socket_path)
+
+
+def wait_for_service(socket_path: str = EMBEDDING_SERVICE_SOCKET, timeout: float = 300.0) -> bool:
+    """Block until the service answers a ping or timeout seconds pass."""
+    client = EmbeddingServiceClient(socket_path, timeout=5.0)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            client.request({"op": "ping"})
+            return True
+        except EmbeddingServiceError:
+            time.sleep(0.5)
+    return False
+
+
+if __name__ == "__main__":
+    serve()
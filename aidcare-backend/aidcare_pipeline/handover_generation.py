@@ -1,13 +1,19 @@
 # aidcare_pipeline/handover_generation.py
 import google.generativeai as genai
+import asyncio
 import json
 import os
 import time
+from .context_packing import ContextBlock, field_lines, pack_blocks
+from .streaming import JsonSectionTracker
 
 GEMINI_MODEL_HANDOVER = os.getenv("GEMINI_MODEL_HANDOVER", "gemini-2.0-flash-exp")
 
 _MODERN_GEMINI_PREFIXES = ("gemini-1.5", "gemini-2", "gemini-3")
 
+# Token budget for the consultation records in the prompt (0 = unlimited)
+HANDOVER_CONTEXT_BUDGET_TOKENS = int(os.getenv("HANDOVER_CONTEXT_BUDGET_TOKENS", "6000"))
+
 _FALLBACK_HANDOVER_RESPONSE = {
     "critical_patients": [],
     "stable_patients": [],
@@ -16,60 +22,39 @@ _FALLBACK_HANDOVER_RESPONSE = {
 }
 
 
-def generate_handover_report(
-    consultations: list,
-    doctor_name: str,
-    ward: str,
-    shift_start: str,
-    shift_end: str,
-) -> dict:
-    """
-    Generates a prioritised shift handover report from a list of consultation dicts.
+def _handover_priority(consultation: dict) -> float:
+    try:
+        complexity = float(consultation.get("complexity_score") or 0)
+    except (TypeError, ValueError):
+        complexity = 0.0
+    return complexity + (5 if consultation.get("flags") else 0)
 
-    Args:
-        consultations: List of dicts, each containing:
-                       patient_ref, soap_note (dict with subjective/objective/assessment/plan),
-                       complexity_score (int 1-5), flags (list of str), patient_summary (str).
-        doctor_name:   Full name of the outgoing doctor.
-        ward:          Ward name/identifier.
-        shift_start:   ISO timestamp string or formatted string for shift start.
-        shift_end:     ISO timestamp string or formatted string for shift end.
 
-    Returns:
-        dict with keys:
-            critical_patients   -> [{patient_ref, summary, action_required, flags}]
-            stable_patients     -> [{patient_ref, summary}]
-            discharged_patients -> [{patient_ref, summary}]
-            overall_shift_notes -> str
-        Falls back to empty-field dict on any error.
-    """
-    GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
-    if not GOOGLE_API_KEY:
-        print("ERROR (handover_generation): GOOGLE_API_KEY not found in environment.")
-        return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Configuration error: Missing Google API Key."}
-
-    if not consultations:
-        print("Handover Gen - No consultations provided; returning empty report.")
-        return {
-            **_FALLBACK_HANDOVER_RESPONSE,
-            "overall_shift_notes": f"No consultations recorded for this shift ({shift_start} - {shift_end}).",
-        }
-
-    # Build a structured summary of each consultation for the prompt
-    consultation_summaries = []
+def _handover_prompt(consultations: list, doctor_name: str, ward: str, shift_start: str, shift_end: str):
+    """Returns (system instruction, prompt, packed consultation context)."""
+    # Build a structured summary of each consultation for the prompt. Every patient
+    # keeps a header line; when the records exceed the token budget, the clinical
+    # detail of the least complex, unflagged patients is shortened first.
+    blocks = []
     for i, c in enumerate(consultations, start=1):
         soap = c.get("soap_note", {})
-        entry = (
-            f"Patient {i}: {c.get('patient_ref', 'Unknown')}\n"
-            f"  Summary: {c.get('patient_summary', 'N/A')}\n"
+        header = (
+            ("\n" if i > 1 else "")
+            + f"Patient {i}: {c.get('patient_ref', 'Unknown')}\n"
             f"  Complexity: {c.get('complexity_score', 'N/A')}/5\n"
-            f"  Flags: {', '.join(c.get('flags', [])) or 'None'}\n"
-            f"  SOAP Assessment: {soap.get('assessment', 'N/A')}\n"
-            f"  SOAP Plan: {soap.get('plan', 'N/A')}"
+            f"  Flags: {', '.join(c.get('flags', [])) or 'None'}"
         )
-        consultation_summaries.append(entry)
-
-    consultations_text = "\n\n".join(consultation_summaries)
+        blocks.append(ContextBlock(f"patient:{i}", header, required=True))
+        detail = field_lines([
+            ("Summary", c.get("patient_summary")),
+            ("SOAP Assessment", soap.get("assessment")),
+            ("SOAP Plan", soap.get("plan")),
+        ], indent="  ")
+        if detail:
+            blocks.append(ContextBlock(f"patient:{i}:detail", "\n".join(detail), priority=_handover_priority(c)))
+
+    packed = pack_blocks(blocks, HANDOVER_CONTEXT_BUDGET_TOKENS, label="handover")
+    consultations_text = packed.text
 
     system_instruction = (
         "You are a clinical handover assistant. "
@@ -127,10 +112,137 @@ Return ONLY the JSON object. Do not include any text before or after it.
 JSON Response:
 """
 
+    return system_instruction, prompt, packed
+
+
+def _handover_model(system_instruction: str, prompt: str):
+    """Returns (GenerativeModel, prompt to send); older models take the instruction in the prompt."""
     generation_config = genai.types.GenerationConfig(
         temperature=0.2,
         max_output_tokens=3000,
     )
+    if GEMINI_MODEL_HANDOVER.startswith(_MODERN_GEMINI_PREFIXES):
+        model_to_use = genai.GenerativeModel(
+            GEMINI_MODEL_HANDOVER,
+            system_instruction=system_instruction,
+            generation_config=generation_config,
+        )
+        return model_to_use, prompt
+    model_to_use = genai.GenerativeModel(
+        GEMINI_MODEL_HANDOVER,
+        generation_config=generation_config,
+    )
+    return model_to_use, system_instruction + "\n\n" + prompt
+
+
+def _response_json_text(response, attempt: int) -> str:
+    raw_json_str = ""
+    if hasattr(response, "text") and response.text:
+        raw_json_str = response.text.strip()
+    elif response.parts:
+        raw_json_str = response.parts[0].text.strip()
+    else:
+        print(f"Handover Gen - Warning: Gemini response has no text or parts (Attempt {attempt + 1}). Response: {response}")
+    return _clean_json_text(raw_json_str, attempt)
+
+
+def _clean_json_text(raw_json_str: str, attempt: int) -> str:
+    raw_json_str = raw_json_str.strip()
+    # Clean markdown fences
+    if raw_json_str.startswith("```json"):
+        raw_json_str = raw_json_str[len("```json"):]
+    if raw_json_str.startswith("```"):
+        raw_json_str = raw_json_str[len("```"):]
+    if raw_json_str.endswith("```"):
+        raw_json_str = raw_json_str[: -len("```")]
+    raw_json_str = raw_json_str.strip()
+
+    print(f"Handover Gen - Raw Gemini response snippet (Attempt {attempt + 1}): {raw_json_str[:300]}...")
+    return raw_json_str
+
+
+def _parse_handover(raw_json_str: str, packed) -> dict:
+    parsed = json.loads(raw_json_str)
+
+    # Validate and fill missing keys with defaults
+    expected_keys = ["critical_patients", "stable_patients", "discharged_patients", "overall_shift_notes"]
+    for key in expected_keys:
+        if key not in parsed:
+            print(f"Handover Gen - Warning: Response missing key '{key}'. Filling with default.")
+            parsed[key] = [] if key != "overall_shift_notes" else ""
+
+    parsed["context_packing"] = packed.report()
+    return parsed
+
+
+def _retry_delay(error: Exception, attempt: int, max_retries: int, raw_json_str: str):
+    """Seconds to wait before the next attempt, or None to give up and report the error."""
+    if isinstance(error, json.JSONDecodeError):
+        print(f"Handover Gen - JSONDecodeError (Attempt {attempt + 1}): '{raw_json_str[:200]}'. Error: {error}")
+        return 2 * (attempt + 1) if attempt < max_retries - 1 else None
+    print(f"Handover Gen - Exception (Attempt {attempt + 1}): {error}")
+    import traceback
+    traceback.print_exc()
+    message = str(error).lower()
+    if "rate limit" in message or "quota" in message or "429" in message or "resource has been exhausted" in message:
+        print("Handover Gen - Rate limit / quota error detected.")
+        return 10 * (attempt + 1) if attempt < max_retries - 1 else None
+    return 2 * (attempt + 1) if attempt < max_retries - 1 else None
+
+
+def _failure(error: Exception, raw_json_str: str) -> dict:
+    if isinstance(error, json.JSONDecodeError):
+        return {
+            **_FALLBACK_HANDOVER_RESPONSE,
+            "error": f"Failed to decode JSON for handover report after retries. Last snippet: {raw_json_str[:200]}",
+        }
+    return {**_FALLBACK_HANDOVER_RESPONSE, "error": f"Unhandled error during handover generation: {str(error)}"}
+
+
+def _empty_handover(shift_start: str, shift_end: str) -> dict:
+    print("Handover Gen - No consultations provided; returning empty report.")
+    return {
+        **_FALLBACK_HANDOVER_RESPONSE,
+        "overall_shift_notes": f"No consultations recorded for this shift ({shift_start} - {shift_end}).",
+    }
+
+
+def generate_handover_report(
+    consultations: list,
+    doctor_name: str,
+    ward: str,
+    shift_start: str,
+    shift_end: str,
+) -> dict:
+    """
+    Generates a prioritised shift handover report from a list of consultation dicts.
+
+    Args:
+        consultations: List of dicts, each containing:
+                       patient_ref, soap_note (dict with subjective/objective/assessment/plan),
+                       complexity_score (int 1-5), flags (list of str), patient_summary (str).
+        doctor_name:   Full name of the outgoing doctor.
+        ward:          Ward name/identifier.
+        shift_start:   ISO timestamp string or formatted string for shift start.
+        shift_end:     ISO timestamp string or formatted string for shift end.
+
+    Returns:
+        dict with keys:
+            critical_patients   -> [{patient_ref, summary, action_required, flags}]
+            stable_patients     -> [{patient_ref, summary}]
+            discharged_patients -> [{patient_ref, summary}]
+            overall_shift_notes -> str
+        Falls back to empty-field dict on any error.
+    """
+    GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+    if not GOOGLE_API_KEY:
+        print("ERROR (handover_generation): GOOGLE_API_KEY not found in environment.")
+        return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Configuration error: Missing Google API Key."}
+
+    if not consultations:
+        return _empty_handover(shift_start, shift_end)
+
+    system_instruction, prompt, packed = _handover_prompt(consultations, doctor_name, ward, shift_start, shift_end)
 
     max_retries = 2
     raw_json_str = ""
@@ -139,40 +251,9 @@ JSON Response:
         try:
             print(f"Handover Gen - Attempt {attempt + 1} using model '{GEMINI_MODEL_HANDOVER}'...")
 
-            if GEMINI_MODEL_HANDOVER.startswith(_MODERN_GEMINI_PREFIXES):
-                model_to_use = genai.GenerativeModel(
-                    GEMINI_MODEL_HANDOVER,
-                    system_instruction=system_instruction,
-                    generation_config=generation_config,
-                )
-                full_prompt = prompt
-            else:
-                model_to_use = genai.GenerativeModel(
-                    GEMINI_MODEL_HANDOVER,
-                    generation_config=generation_config,
-                )
-                full_prompt = system_instruction + "\n\n" + prompt
-
+            model_to_use, full_prompt = _handover_model(system_instruction, prompt)
             response = model_to_use.generate_content(full_prompt)
-
-            raw_json_str = ""
-            if hasattr(response, "text") and response.text:
-                raw_json_str = response.text.strip()
-            elif response.parts:
-                raw_json_str = response.parts[0].text.strip()
-            else:
-                print(f"Handover Gen - Warning: Gemini response has no text or parts (Attempt {attempt + 1}). Response: {response}")
-
-            # Clean markdown fences
-            if raw_json_str.startswith("```json"):
-                raw_json_str = raw_json_str[len("```json"):]
-            if raw_json_str.startswith("```"):
-                raw_json_str = raw_json_str[len("```"):]
-            if raw_json_str.endswith("```"):
-                raw_json_str = raw_json_str[: -len("```")]
-            raw_json_str = raw_json_str.strip()
-
-            print(f"Handover Gen - Raw Gemini response snippet (Attempt {attempt + 1}): {raw_json_str[:300]}...")
+            raw_json_str = _response_json_text(response, attempt)
 
             if not raw_json_str:
                 if attempt < max_retries - 1:
@@ -182,48 +263,141 @@ JSON Response:
                 print("Handover Gen - Gemini returned an empty string after retries.")
                 return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Gemini returned an empty response."}
 
-            parsed = json.loads(raw_json_str)
-
-            # Validate and fill missing keys with defaults
-            expected_keys = ["critical_patients", "stable_patients", "discharged_patients", "overall_shift_notes"]
-            for key in expected_keys:
-                if key not in parsed:
-                    print(f"Handover Gen - Warning: Response missing key '{key}'. Filling with default.")
-                    parsed[key] = [] if key != "overall_shift_notes" else ""
-
-            return parsed
-
-        except json.JSONDecodeError as e:
-            print(f"Handover Gen - JSONDecodeError (Attempt {attempt + 1}): '{raw_json_str[:200]}'. Error: {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-                continue
-            return {
-                **_FALLBACK_HANDOVER_RESPONSE,
-                "error": f"Failed to decode JSON for handover report after retries. Last snippet: {raw_json_str[:200]}",
-            }
+            return _parse_handover(raw_json_str, packed)
+
         except Exception as e:
-            print(f"Handover Gen - Exception (Attempt {attempt + 1}): {e}")
-            import traceback
-            traceback.print_exc()
-            if (
-                "rate limit" in str(e).lower()
-                or "quota" in str(e).lower()
-                or "429" in str(e).lower()
-                or "resource has been exhausted" in str(e).lower()
-            ):
-                print("Handover Gen - Rate limit / quota error detected.")
+            delay = _retry_delay(e, attempt, max_retries, raw_json_str)
+            if delay is None:
+                return _failure(e, raw_json_str)
+            time.sleep(delay)
+
+    return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Failed handover generation after all retries."}
+
+
+async def generate_handover_report_async(
+    consultations: list,
+    doctor_name: str,
+    ward: str,
+    shift_start: str,
+    shift_end: str,
+) -> dict:
+    """Async variant of generate_handover_report for async endpoints."""
+    GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+    if not GOOGLE_API_KEY:
+        print("ERROR (handover_generation): GOOGLE_API_KEY not found in environment.")
+        return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Configuration error: Missing Google API Key."}
+
+    if not consultations:
+        return _empty_handover(shift_start, shift_end)
+
+    system_instruction, prompt, packed = _handover_prompt(consultations, doctor_name, ward, shift_start, shift_end)
+
+    max_retries = 2
+    raw_json_str = ""
+
+    for attempt in range(max_retries):
+        try:
+            print(f"Handover Gen - Attempt {attempt + 1} using model '{GEMINI_MODEL_HANDOVER}'...")
+
+            model_to_use, full_prompt = _handover_model(system_instruction, prompt)
+            response = await model_to_use.generate_content_async(full_prompt)
+            raw_json_str = _response_json_text(response, attempt)
+
+            if not raw_json_str:
                 if attempt < max_retries - 1:
-                    time.sleep(10 * (attempt + 1))
+                    print(f"Handover Gen - Gemini returned empty string, retrying (Attempt {attempt + 1})...")
+                    await asyncio.sleep(1 * (attempt + 1))
                     continue
-            elif attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-                continue
-            return {**_FALLBACK_HANDOVER_RESPONSE, "error": f"Unhandled error during handover generation: {str(e)}"}
+                print("Handover Gen - Gemini returned an empty string after retries.")
+                return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Gemini returned an empty response."}
+
+            return _parse_handover(raw_json_str, packed)
+
+        except Exception as e:
+            delay = _retry_delay(e, attempt, max_retries, raw_json_str)
+            if delay is None:
+                return _failure(e, raw_json_str)
+            await asyncio.sleep(delay)
 
     return {**_FALLBACK_HANDOVER_RESPONSE, "error": "Failed handover generation after all retries."}
 
 
+def _chunk_text(chunk) -> str:
+    try:
+        return chunk.text or ""
+    except ValueError:
+        # Chunks without text parts (e.g. only safety ratings) raise on .text
+        return ""
+
+
+async def stream_handover_report(
+    consultations: list,
+    doctor_name: str,
+    ward: str,
+    shift_start: str,
+    shift_end: str,
+):
+    """
+    Streaming variant of generate_handover_report.
+
+    Yields:
+        ("section", {"key", "value"}) for each report section as it completes
+        (critical_patients, stable_patients, ...), then ("result", dict) with
+        the validated report, as returned by generate_handover_report
+    """
+    GOOGLE_API_KEY = os.environ.get("GOOGLE_API_KEY")
+    if not GOOGLE_API_KEY:
+        print("ERROR (handover_generation): GOOGLE_API_KEY not found in environment.")
+        yield "result", {**_FALLBACK_HANDOVER_RESPONSE, "error": "Configuration error: Missing Google API Key."}
+        return
+
+    if not consultations:
+        yield "result", _empty_handover(shift_start, shift_end)
+        return
+
+    system_instruction, prompt, packed = _handover_prompt(consultations, doctor_name, ward, shift_start, shift_end)
+
+    max_retries = 2
+
+    for attempt in range(max_retries):
+        tracker = JsonSectionTracker()
+        sent = 0
+        raw_json_str = ""
+        try:
+            print(f"Handover Gen - Streaming attempt {attempt + 1} using model '{GEMINI_MODEL_HANDOVER}'...")
+
+            model_to_use, full_prompt = _handover_model(system_instruction, prompt)
+            response = await model_to_use.generate_content_async(full_prompt, stream=True)
+            async for chunk in response:
+                for key, value in tracker.feed(_chunk_text(chunk)):
+                    sent += 1
+                    yield "section", {"key": key, "value": value}
+
+            raw_json_str = _clean_json_text(tracker.text, attempt)
+            if not raw_json_str:
+                if attempt < max_retries - 1:
+                    print(f"Handover Gen - Gemini returned empty string, retrying (Attempt {attempt + 1})...")
+                    await asyncio.sleep(1 * (attempt + 1))
+                    continue
+                print("Handover Gen - Gemini returned an empty string after retries.")
+                yield "result", {**_FALLBACK_HANDOVER_RESPONSE, "error": "Gemini returned an empty response."}
+                return
+
+            yield "result", _parse_handover(raw_json_str, packed)
+            return
+
+        except Exception as e:
+            raw_json_str = raw_json_str or tracker.text
+            delay = _retry_delay(e, attempt, max_retries, raw_json_str)
+            # Once sections have reached the client a retry would repeat them
+            if delay is None or sent:
+                yield "result", _failure(e, raw_json_str)
+                return
+            await asyncio.sleep(delay)
+
+    yield "result", {**_FALLBACK_HANDOVER_RESPONSE, "error": "Failed handover generation after all retries."}
+
+
 # ---------------------------------------------------------------------------
 # Plain-text formatter (for WhatsApp sharing)
 # ---------------------------------------------------------------------------
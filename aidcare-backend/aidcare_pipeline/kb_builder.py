@@ -0,0 +1,584 @@
+# aidcare_pipeline/kb_builder.py
+# Shared build pipeline for the knowledge-base prep scripts (scripts/prepare_*_kb.py).
+#
+# Chunks are streamed in from the source documents, grouped into fixed-size
+# batches, embedded (embedding cache first, then in-process or across a process
+# pool), checked against the chunks already indexed for near-duplicates and
+# added to a FAISS index described by an index-factory string, one batch at a
+# time. Metadata is spooled to disk as it arrives, so memory stays
+# flat however large the corpus is; the index, metadata, BM25 index and build
+# manifest are written together at the end.
+
+import hashlib
+import json
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .embedding_cache import EmbeddingCache
+from .embedding_registry import EMBEDDING_BACKEND, ENCODER_BACKENDS, encoder_id, get_encoder
+from .kb_store import (
+    apply_search_params,
+    lexical_index_path_for,
+    metadata_store_path_for,
+    partitions_path_for,
+    write_kb_manifest,
+    write_metadata_store,
+)
+from .kb_partitions import PartitionMap, entry_populations
+from .lexical_index import BM25Index
+
+# Exhaustive L2 scan, matching the indexes built before the factory option existed.
+# Examples of alternatives: "HNSW32" (efSearch=64), "IVF64,PQ16" (nprobe=8), "SQ8", "HNSW32,SQ8".
+DEFAULT_INDEX_FACTORY = os.getenv("KB_INDEX_FACTORY", "Flat")
+DEFAULT_SEARCH_PARAMS = os.getenv("KB_SEARCH_PARAMS", "")
+
+DEFAULT_BATCH_SIZE = int(os.getenv("KB_BUILD_BATCH_SIZE", "64"))
+DEFAULT_WORKERS = int(os.getenv("KB_BUILD_WORKERS", "1"))
+# Vectors buffered to train IVF/PQ/SQ indexes before streaming adds begin
+DEFAULT_TRAIN_SAMPLE_SIZE = int(os.getenv("KB_TRAIN_SAMPLE_SIZE", "20000"))
+
+# Chunks whose source-neutral embedding (see dedup_text) has at least this cosine
+# similarity to an already indexed chunk of the same source type and patient
+# population are merged into that entry, across documents and cadres. The
+# canonical entry then answers the filters of every source merged into it and
+# keeps each source's differing actions in its provenance. 0 disables.
+# In the CHW index, the pairs at or above 0.95 are the same case repeated across
+# the childhood sections (jaundice, loose stools, vomiting, anaemia) or closely
+# related facility-management topics. Every merge is recorded with its
+# similarity in merged_sources, so the value can be re-tuned from a build.
+DEFAULT_DEDUP_THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.95"))
+# Fields a merged duplicate keeps in its provenance record when they differ from
+# the canonical entry's
+_MERGE_DIFF_FIELDS = ("clinical_judgement", "action", "notes")
+_PROVENANCE_FIELDS = ("source_type", "source_document_name", "section_title", "age_group", "subsection_code", "case")
+
+PROGRESS_INTERVAL_SECONDS = 5.0
+
+
+def create_faiss_index(dimension: int, index_factory: str = DEFAULT_INDEX_FACTORY):
+    """
+    Raises:
+        ValueError: If the factory string is invalid
+    """
+    try:
+        return faiss.index_factory(dimension, index_factory, faiss.METRIC_L2)
+    except Exception as e:
+        raise ValueError(f"Invalid FAISS index factory '{index_factory}': {e}")
+
+
+def train_faiss_index(index, embeddings: np.ndarray, index_factory: str) -> None:
+    """
+    Raises:
+        ValueError: If there are too few vectors to train the index
+    """
+    print(f"KB Builder: Training '{index_factory}' index on {len(embeddings)} vectors...")
+    try:
+        index.train(embeddings)
+    except Exception as e:
+        raise ValueError(f"Could not train '{index_factory}' on {len(embeddings)} vectors: {e}")
+
+
+def build_faiss_index(embeddings: np.ndarray, index_factory: str = DEFAULT_INDEX_FACTORY, search_params: str = DEFAULT_SEARCH_PARAMS):
+    """
+    Build an L2 FAISS index from an index-factory string in one go, training it
+    first if the index type needs it (IVF, PQ, SQ).
+
+    Raises:
+        ValueError: If the factory string is invalid or there are too few vectors to train it
+    """
+    embeddings = np.ascontiguousarray(embeddings, dtype="float32")
+    index = create_faiss_index(embeddings.shape[1], index_factory)
+    if not index.is_trained:
+        train_faiss_index(index, embeddings, index_factory)
+    index.add(embeddings)
+    apply_search_params(index, search_params)
+    return index
+
+
+# --- Process-pool encoding ---
+# Each worker process loads its own copy of the model once, through the registry.
+
+_worker_model_name: Optional[str] = None
+_worker_backend: Optional[str] = None
+
+
+def _init_encode_worker(model_name: str, backend: str, threads_per_worker: int) -> None:
+    global _worker_model_name, _worker_backend
+    _worker_model_name = model_name
+    _worker_backend = backend
+    os.environ.setdefault("ONNX_INTRA_OP_THREADS", str(threads_per_worker))
+    try:
+        import torch
+        # Split the cores between workers instead of every worker using all of them
+        torch.set_num_threads(threads_per_worker)
+    except ImportError:
+        pass
+
+
+def _encode_texts(model_name: str, backend: str, texts: List[str]) -> np.ndarray:
+    encoder = get_encoder(model_name, backend=backend)
+    return np.asarray(encoder.encode(texts, convert_to_numpy=True), dtype="float32")
+
+
+def _encode_in_worker(texts: List[str]) -> np.ndarray:
+    return _encode_texts(_worker_model_name, _worker_backend, texts)
+
+
+def _batched(chunks: Iterable[Tuple[str, Dict[str, Any]]], batch_size: int) -> Iterator[List[Tuple[str, Dict[str, Any]]]]:
+    batch = []
+    for chunk in chunks:
+        batch.append(chunk)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def dedup_group(meta: Dict[str, Any]) -> tuple:
+    """
+    Chunks are only merged within a group: the same source type and patient
+    populations. Documents and cadres are merged across; the canonical entry
+    takes on the partition keys of its duplicates.
+    """
+    return (meta.get("source_type"), tuple(entry_populations(meta)))
+
+
+def dedup_text(text: str, meta: Dict[str, Any]) -> str:
+    """
+    Chunk text compared by the duplicate check: without the source document
+    name, which every guideline chunk opens with and which otherwise keeps the
+    CHO and CHEW copies of an entry apart (~0.85 similarity at most).
+    """
+    document = meta.get("source_document_name")
+    return text.replace(document, "") if document else text
+
+
+def _field_digests(meta: Dict[str, Any]) -> Tuple[Optional[bytes], ...]:
+    """Short digests of the fields a provenance record compares, kept instead of the full metadata."""
+    return tuple(
+        hashlib.blake2b(json.dumps(meta[field], sort_keys=True).encode("utf-8"), digest_size=8).digest()
+        if field in meta else None
+        for field in _MERGE_DIFF_FIELDS
+    )
+
+
+class NearDuplicateFilter:
+    """
+    Finds chunks whose dedup_text embedding is within a cosine-similarity
+    threshold of a chunk already kept in the same group, using one exact
+    inner-product index per group over the kept (L2-normalized) vectors.
+
+    Memory is O(N·d): one float32 copy of every kept vector (N x d x 4 bytes,
+    about 1.5 KB per chunk for a 384-dim model), whatever the type of the KB's
+    own index, plus a doc id per vector.
+    """
+
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        # group -> (IndexFlatIP, doc id of each vector)
+        self.indexes: Dict[tuple, Tuple[Any, List[int]]] = {}
+
+    def match(self, embeddings: np.ndarray, groups: List[tuple]) -> Tuple[np.ndarray, List[Tuple[int, float]]]:
+        """
+        Split a batch into kept rows and duplicates.
+
+        Args:
+            embeddings: float32 batch of chunk vectors
+            groups: dedup_group() of each row
+
+        Returns:
+            (normalized vectors, per-row match): the match is (-1, 0.0) for a
+            row to keep, otherwise (canonical, similarity) where canonical is a
+            doc id from register() or, for a duplicate within this batch, -2 - row
+        """
+        vectors = np.array(embeddings, dtype="float32", copy=True)
+        faiss.normalize_L2(vectors)
+        best = [(-1, 0.0)] * len(vectors)
+        for group in set(groups):
+            if group not in self.indexes:
+                continue
+            index, doc_ids = self.indexes[group]
+            rows = [row for row, g in enumerate(groups) if g == group]
+            similarities, positions = index.search(np.ascontiguousarray(vectors[rows]), 1)
+            for row, s, p in zip(rows, similarities[:, 0], positions[:, 0]):
+                if p != -1 and s >= self.threshold:
+                    best[row] = (doc_ids[p], float(s))
+
+        kept_rows: List[int] = []
+        for row in range(len(vectors)):
+            candidates = [k for k in kept_rows if groups[k] == groups[row]]
+            if candidates:
+                similarities = vectors[candidates] @ vectors[row]
+                j = int(np.argmax(similarities))
+                if similarities[j] >= self.threshold and similarities[j] > best[row][1]:
+                    best[row] = (-2 - candidates[j], float(similarities[j]))
+            if best[row][0] == -1:
+                kept_rows.append(row)
+        return vectors, best
+
+    def register(self, vectors: np.ndarray, doc_ids: List[int], groups: List[tuple]) -> None:
+        for vector, doc_id, group in zip(vectors, doc_ids, groups):
+            if group not in self.indexes:
+                self.indexes[group] = (faiss.IndexFlatIP(vectors.shape[1]), [])
+            index, group_doc_ids = self.indexes[group]
+            index.add(np.ascontiguousarray(vector.reshape(1, -1)))
+            group_doc_ids.append(doc_id)
+
+
+def _provenance_record(meta: Dict[str, Any], canonical_digests: Tuple[Optional[bytes], ...],
+                       similarity: float) -> Dict[str, Any]:
+    record = {field: meta[field] for field in _PROVENANCE_FIELDS if meta.get(field)}
+    record.update({field: meta[field] for field, digest in zip(_MERGE_DIFF_FIELDS, _field_digests(meta))
+                   if digest is not None and digest != canonical_digests[_MERGE_DIFF_FIELDS.index(field)]})
+    record["similarity"] = round(similarity, 4)
+    return record
+
+
+class StreamingKBBuilder:
+    """
+    Streams (chunk_text, metadata) pairs into a FAISS index and metadata store.
+
+    Only the batches in flight (at most two per worker) are held in memory;
+    metadata is spooled to a JSON-lines file and converted into the final
+    artifacts once the stream ends. With deduplication on (dedup_threshold > 0)
+    memory is no longer flat: the NearDuplicateFilter keeps an O(N·d) float32
+    copy of every kept vector, plus a few short field digests per kept chunk.
+    """
+
+    def __init__(
+        self,
+        index_path: str,
+        metadata_path: str,
+        model_name: str,
+        index_factory: str = DEFAULT_INDEX_FACTORY,
+        search_params: str = DEFAULT_SEARCH_PARAMS,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        workers: int = DEFAULT_WORKERS,
+        embedding_cache_path: Optional[str] = None,
+        train_sample_size: int = DEFAULT_TRAIN_SAMPLE_SIZE,
+        backend: str = EMBEDDING_BACKEND,
+        dedup_threshold: float = DEFAULT_DEDUP_THRESHOLD,
+        label: str = "KB",
+    ):
+        self.index_path = index_path
+        self.metadata_path = metadata_path
+        self.model_name = model_name
+        self.index_factory = index_factory
+        self.search_params = search_params
+        self.batch_size = max(1, batch_size)
+        self.workers = max(1, workers)
+        self.embedding_cache_path = embedding_cache_path
+        self.train_sample_size = train_sample_size
+        self.backend = backend
+        self.dedup_threshold = dedup_threshold
+        self.label = label
+
+        self.index = None
+        self.lexical_index = BM25Index()
+        self.partitions = PartitionMap()
+        self._train_buffer: List[np.ndarray] = []
+        self._train_buffered = 0
+        self._dedup = NearDuplicateFilter(dedup_threshold) if dedup_threshold > 0 else None
+        # canonical doc id -> provenance of the duplicates merged into it, applied when the spool is read back
+        self._merged_sources: Dict[int, List[Dict[str, Any]]] = {}
+        # canonical doc id -> digests of its _MERGE_DIFF_FIELDS, for the provenance diff of later duplicates
+        self._kept_digests: Dict[int, Tuple[Optional[bytes], ...]] = {}
+        self.stats = {"chunks": 0, "cached": 0, "encoded": 0, "batches": 0, "merged": 0}
+
+    # --- Encoding ---
+
+    def _start_batch(self, batch, cache: Optional[EmbeddingCache], executor: Optional[ProcessPoolExecutor]):
+        """Look the batch up in the cache and start encoding the misses."""
+        texts = [text for text, _ in batch]
+        if self._dedup is not None:
+            # The duplicate check's source-neutral texts are encoded (and cached) with the chunks
+            texts += [dedup_text(text, meta) for text, meta in batch]
+        cached = cache.get_many(texts) if cache is not None else {}
+        missing = [i for i in range(len(texts)) if i not in cached]
+        pending = None
+        if missing:
+            missing_texts = [texts[i] for i in missing]
+            if executor is not None:
+                pending = executor.submit(_encode_in_worker, missing_texts)
+            else:
+                pending = _encode_texts(self.model_name, self.backend, missing_texts)
+        return batch, texts, cached, missing, pending
+
+    def _finish_batch(self, started, cache: Optional[EmbeddingCache], spool) -> None:
+        """Wait for a batch's vectors, then add them to the index, BM25 index and metadata spool."""
+        batch, texts, cached, missing, pending = started
+        encoded: Dict[int, np.ndarray] = {}
+        if missing:
+            vectors = pending.result() if isinstance(pending, Future) else pending
+            if cache is not None:
+                cache.put_many([texts[i] for i in missing], vectors)
+            encoded = dict(zip(missing, vectors))
+
+        embeddings = np.ascontiguousarray(
+            np.stack([cached[i] if i in cached else encoded[i] for i in range(len(texts))]), dtype="float32"
+        )
+        if self._dedup is None:
+            self._add_vectors(embeddings)
+            for text, meta in batch:
+                doc_id = self.lexical_index.add_document(text)
+                self.partitions.add(doc_id, meta)
+                spool.write(json.dumps(meta, ensure_ascii=False))
+                spool.write("\n")
+        else:
+            self._add_deduplicated(batch, embeddings[:len(batch)], embeddings[len(batch):], spool)
+
+        self.stats["chunks"] += len(batch)
+        self.stats["cached"] += len(cached)
+        self.stats["encoded"] += len(missing)
+        self.stats["batches"] += 1
+
+    def _add_deduplicated(self, batch, embeddings: np.ndarray, dedup_embeddings: np.ndarray, spool) -> None:
+        """Index the batch's new chunks; fold near-duplicates into the entry they repeat."""
+        groups = [dedup_group(meta) for _, meta in batch]
+        vectors, matches = self._dedup.match(dedup_embeddings, groups)
+        row_doc_ids: Dict[int, int] = {}
+        for row, ((text, meta), (canonical, similarity)) in enumerate(zip(batch, matches)):
+            if canonical == -1:
+                doc_id = self.lexical_index.add_document(text)
+                row_doc_ids[row] = doc_id
+                self.partitions.add(doc_id, meta)
+                self._kept_digests[doc_id] = _field_digests(meta)
+                spool.write(json.dumps(meta, ensure_ascii=False))
+                spool.write("\n")
+                continue
+            # The canonical entry also answers the duplicate's filters (cadre, document, age group)
+            doc_id = row_doc_ids[-2 - canonical] if canonical < -1 else canonical
+            self.partitions.add(doc_id, meta)
+            self._merged_sources.setdefault(doc_id, []).append(
+                _provenance_record(meta, self._kept_digests[doc_id], similarity)
+            )
+            self.stats["merged"] += 1
+
+        kept_rows = sorted(row_doc_ids)
+        if kept_rows:
+            self._add_vectors(np.ascontiguousarray(embeddings[kept_rows]))
+            self._dedup.register(vectors[kept_rows], [row_doc_ids[row] for row in kept_rows],
+                                 [groups[row] for row in kept_rows])
+
+    # --- Index ---
+
+    def _add_vectors(self, embeddings: np.ndarray) -> None:
+        if self.index is None:
+            self.index = create_faiss_index(embeddings.shape[1], self.index_factory)
+        if self.index.is_trained:
+            self.index.add(embeddings)
+            return
+        # Index types that need training buffer a sample first, then stream
+        self._train_buffer.append(embeddings)
+        self._train_buffered += len(embeddings)
+        if self._train_buffered >= self.train_sample_size:
+            self._flush_train_buffer()
+
+    def _flush_train_buffer(self) -> None:
+        if not self._train_buffer:
+            return
+        sample = np.concatenate(self._train_buffer)
+        self._train_buffer = []
+        self._train_buffered = 0
+        train_faiss_index(self.index, sample, self.index_factory)
+        self.index.add(sample)
+
+    # --- Pipeline ---
+
+    def build(self, chunks: Iterable[Tuple[str, Dict[str, Any]]]) -> Optional[Dict[str, Any]]:
+        """
+        Consume a stream of (chunk_text, metadata) pairs and write all KB artifacts.
+
+        Args:
+            chunks: Iterable of (chunk_text, metadata) pairs, typically a generator
+
+        Returns:
+            The build manifest, or None if the stream was empty
+        """
+        output_dir = os.path.dirname(self.index_path)
+        if output_dir and not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+            print(f"Created output directory for {self.label}: {output_dir}")
+
+        # Cached vectors are keyed by encoder identity, so torch and int8 ONNX vectors never mix
+        cache = EmbeddingCache(self.embedding_cache_path, model_name=encoder_id(self.model_name, self.backend)) if self.embedding_cache_path else None
+        executor = None
+        if self.workers > 1:
+            threads_per_worker = max(1, (os.cpu_count() or self.workers) // self.workers)
+            executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_encode_worker,
+                initargs=(self.model_name, self.backend, threads_per_worker),
+            )
+        print(f"KB Builder: Streaming {self.label} chunks in batches of {self.batch_size} "
+              f"with {self.workers} {self.backend} encoder worker(s)...")
+
+        spool_path = self.metadata_path + ".spool.tmp"
+        start = time.perf_counter()
+        last_report = start
+        try:
+            with open(spool_path, 'w', encoding='utf-8') as spool:
+                in_flight: deque = deque()
+                for batch in _batched(chunks, self.batch_size):
+                    in_flight.append(self._start_batch(batch, cache, executor))
+                    if len(in_flight) >= 2 * self.workers:
+                        self._finish_batch(in_flight.popleft(), cache, spool)
+                    now = time.perf_counter()
+                    if now - last_report >= PROGRESS_INTERVAL_SECONDS:
+                        last_report = now
+                        print(f"KB Builder: {self.stats['chunks']} {self.label} chunks indexed "
+                              f"({self.stats['chunks'] / (now - start):.1f} chunks/s)")
+                while in_flight:
+                    self._finish_batch(in_flight.popleft(), cache, spool)
+        except BaseException:
+            if os.path.exists(spool_path):
+                os.remove(spool_path)
+            raise
+        finally:
+            if executor is not None:
+                executor.shutdown()
+            if cache is not None:
+                cache.close()
+
+        if self.stats["chunks"] == 0:
+            os.remove(spool_path)
+            print(f"No text chunks created for {self.label}. Nothing written.")
+            return None
+
+        self._flush_train_buffer()
+        apply_search_params(self.index, self.search_params)
+        elapsed = time.perf_counter() - start
+        chunks_per_second = round(self.stats["chunks"] / elapsed, 1) if elapsed > 0 else None
+        print(f"KB Builder: {self.label}: {self.stats['chunks']} chunks in {self.stats['batches']} batches "
+              f"({self.stats['cached']} vectors cached, {self.stats['encoded']} encoded) in {elapsed:.2f}s "
+              f"= {chunks_per_second} chunks/s")
+        self._kept_digests.clear()
+
+        manifest = self._write_artifacts(spool_path)
+        manifest["build_stats"] = {
+            **self.stats,
+            "workers": self.workers,
+            "batch_size": self.batch_size,
+            "embed_seconds": round(elapsed, 2),
+            "chunks_per_second": chunks_per_second,
+        }
+        if self._dedup is not None:
+            manifest["dedup"] = self._dedup_report(manifest)
+        manifest_path = write_kb_manifest(self.index_path, manifest)
+        print(f"Saving {self.label} build manifest to: {manifest_path}")
+        return manifest
+
+    def _dedup_report(self, manifest: Dict[str, Any]) -> Dict[str, Any]:
+        chunks, kept = self.stats["chunks"], int(self.index.ntotal)
+        # Index size scales with the vector count, so the undeduplicated size is extrapolated
+        bytes_without_dedup = int(manifest["index_bytes"] * chunks / kept) if kept else 0
+        report = {
+            "threshold": self.dedup_threshold,
+            "input_chunks": chunks,
+            "kept": kept,
+            "merged": self.stats["merged"],
+            "canonical_entries_with_duplicates": len(self._merged_sources),
+            "vector_reduction_pct": round(100.0 * (chunks - kept) / chunks, 1) if chunks else 0.0,
+            "index_bytes": manifest["index_bytes"],
+            "index_bytes_without_dedup": bytes_without_dedup,
+        }
+        print(f"KB Builder: {self.label}: dedup (cosine >= {self.dedup_threshold}) merged {report['merged']} "
+              f"of {chunks} chunks into {report['canonical_entries_with_duplicates']} entries; "
+              f"index {kept} vectors instead of {chunks} ({report['vector_reduction_pct']}% smaller, "
+              f"{bytes_without_dedup / 1024:.0f} KB -> {manifest['index_bytes'] / 1024:.0f} KB)")
+        return report
+
+    def _iter_spool(self, spool_path: str) -> Iterator[Dict[str, Any]]:
+        with open(spool_path, 'r', encoding='utf-8') as spool:
+            for doc_id, line in enumerate(spool):
+                entry = json.loads(line)
+                if doc_id in self._merged_sources:
+                    entry["merged_sources"] = self._merged_sources[doc_id]
+                yield entry
+
+    def _write_json_metadata(self, spool_path: str) -> None:
+        # Same indented JSON array as json.dump(..., indent=2), written entry by entry;
+        # readers of the live file never see a partial write (atomically replaced)
+        tmp_path = self.metadata_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write("[")
+            for i, entry in enumerate(self._iter_spool(spool_path)):
+                f.write(",\n  " if i else "\n  ")
+                f.write(json.dumps(entry, indent=2).replace("\n", "\n  "))
+            f.write("\n]")
+        os.replace(tmp_path, self.metadata_path)
+
+    def _write_artifacts(self, spool_path: str) -> Dict[str, Any]:
+        print(f"\nSaving {self.label} FAISS index '{self.index_factory}' to: {self.index_path} "
+              f"(total vectors: {self.index.ntotal})")
+        # A server may have the live index mapped or be hot-reloading it: write aside, then swap
+        tmp_index_path = self.index_path + ".tmp"
+        faiss.write_index(self.index, tmp_index_path)
+        os.replace(tmp_index_path, self.index_path)
+
+        print(f"Saving {self.label} metadata to: {self.metadata_path}")
+        self._write_json_metadata(spool_path)
+        metadata_store_path = metadata_store_path_for(self.metadata_path)
+        print(f"Saving {self.label} binary metadata store to: {metadata_store_path}")
+        write_metadata_store(self._iter_spool(spool_path), metadata_store_path)
+        os.remove(spool_path)
+
+        lexical_path = lexical_index_path_for(self.index_path)
+        print(f"Saving {self.label} BM25 lexical index to: {lexical_path}")
+        self.lexical_index.finalize()
+        self.lexical_index.save(lexical_path)
+
+        partitions_path = partitions_path_for(self.index_path)
+        print(f"Saving {self.label} metadata partitions to: {partitions_path}")
+        self.partitions.save(partitions_path)
+
+        return {
+            "index_factory": self.index_factory,
+            "search_params": self.search_params,
+            "metric": "L2",
+            "embedding_model": self.model_name,
+            "embedding_backend": self.backend,
+            "dimension": int(self.index.d),
+            "ntotal": int(self.index.ntotal),
+            "index_bytes": os.path.getsize(self.index_path),
+            "built_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+
+def add_index_arguments(parser) -> None:
+    """Add the index and build-pipeline options shared by the KB prep scripts."""
+    parser.add_argument(
+        "--index-factory", default=DEFAULT_INDEX_FACTORY,
+        help="FAISS index-factory string, e.g. 'Flat', 'HNSW32', 'IVF64,PQ16', 'SQ8' (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--search-params", default=DEFAULT_SEARCH_PARAMS,
+        help="FAISS search parameters stored with the index, e.g. 'efSearch=64' or 'nprobe=8'",
+    )
+    parser.add_argument(
+        "--encoder-backend", choices=ENCODER_BACKENDS, default=EMBEDDING_BACKEND,
+        help="Embedding backend for chunk encoding (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workers", type=int, default=DEFAULT_WORKERS,
+        help="Encoder processes; 1 encodes in the main process (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+        help="Chunks per encode batch (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--dedup-threshold", type=float, default=DEFAULT_DEDUP_THRESHOLD,
+        help="Merge chunks of the same source type and population at or above this embedding cosine similarity "
+             "into one entry that keeps every source's provenance; 0 disables (default: %(default)s)",
+    )
@@ -0,0 +1,220 @@
+# aidcare_pipeline/kb_partitions.py
+# Metadata partitions for filter-aware retrieval.
+#
+# At KB build time every entry is tagged with partition keys (source type,
+# source document, cadre, age group and a derived patient population) and the
+# doc ids of each partition are saved next to the index. A filtered query turns
+# its filters into a FAISS ID selector over those ids, so the search itself only
+# ever visits matching entries instead of over-fetching and dropping hits.
+#
+# Filters are {field: value or [values]}: values within a field are OR-ed,
+# fields are AND-ed, e.g. {"cadre": "CHEW", "population": "paediatric"}.
+
+import json
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+PARTITION_FIELDS = ("source_type", "source_document_name", "cadre", "age_group", "population")
+
+# Standing-orders section titles -> patient population
+_SECTION_POPULATIONS = {
+    "THE NEWBORN": "newborn",
+    "EARLY CHILDHOOD CONDITIONS": "child",
+    "CHILDHOOD CONDITIONS": "child",
+    "MIDDLE CHILDHOOD CONDITIONS": "child",
+    "ADOLESCENT HEALTH": "adolescent",
+    "ADULT HEALTH CONDITIONS": "adult",
+    "GERIATRIC HEALTH": "geriatric",
+    "MATERNAL HEALTH": "maternal",
+}
+# Populations that also belong to a broader group
+_POPULATION_GROUPS = {"newborn": ("paediatric",), "child": ("paediatric",)}
+
+Filters = Dict[str, Any]
+
+
+def entry_populations(entry: Dict[str, Any]) -> List[str]:
+    """Patient populations an entry applies to; 'general' when not age-specific (e.g. textbook entries)."""
+    population = _SECTION_POPULATIONS.get((entry.get("section_title") or "").strip().upper())
+    if population is None and "DAYS" in (entry.get("age_group") or "").upper():
+        population = "newborn"
+    if population is None:
+        return ["general"]
+    return [population, *_POPULATION_GROUPS.get(population, ())]
+
+
+def entry_cadre(entry: Dict[str, Any]) -> Optional[str]:
+    if entry.get("cadre"):
+        return str(entry["cadre"])
+    # "CHO Guidelines" / "CHEW Guidelines" -> "CHO" / "CHEW"
+    document = entry.get("source_document_name") or ""
+    if entry.get("source_type") == "Guideline" and document.endswith(" Guidelines"):
+        return document[: -len(" Guidelines")]
+    return None
+
+
+def partition_keys(entry: Dict[str, Any]) -> List[Tuple[str, str]]:
+    """Partition keys of an entry, including those of near-duplicates merged into it at build time."""
+    keys = []
+    for field in ("source_type", "source_document_name", "age_group"):
+        if entry.get(field):
+            keys.append((field, str(entry[field])))
+    cadre = entry_cadre(entry)
+    if cadre:
+        keys.append(("cadre", cadre))
+    keys.extend(("population", p) for p in entry_populations(entry))
+    for source in entry.get("merged_sources", []):
+        keys.extend(key for key in partition_keys(source) if key not in keys)
+    return keys
+
+
+def merged_variants(entry: Dict[str, Any]) -> List[Tuple[str, Dict[str, Any]]]:
+    """
+    (label, fields) for each source merged into an entry at build time whose
+    clinical judgement, actions or notes differ from the entry's own, labelled
+    by cadre (or document) and, when it differs, case. Prompts list these so a
+    merged entry still gives every cadre its own instructions.
+    """
+    variants = []
+    for source in entry.get("merged_sources", []):
+        fields = {field: source[field] for field in ("clinical_judgement", "action", "notes") if field in source}
+        if not fields:
+            continue
+        label = entry_cadre(source) or source.get("source_document_name") or "merged source"
+        if source.get("case") and source["case"] != entry.get("case"):
+            label = f"{label}, {source['case']}"
+        variants.append((label, fields))
+    return variants
+
+
+def populations_for_age(age_years: float) -> List[str]:
+    """
+    Populations relevant to a patient of the given age. 'general' entries
+    (facility management, textbook material) are always included.
+    """
+    if age_years < 28 / 365:
+        return ["newborn", "general"]
+    if age_years < 10:
+        return ["child", "general"]
+    if age_years < 20:
+        return ["adolescent", "maternal", "general"]
+    if age_years < 60:
+        return ["adult", "maternal", "general"]
+    return ["geriatric", "adult", "general"]
+
+
+def normalize_filters(filters: Optional[Filters]) -> Optional[Tuple[Tuple[str, Tuple[str, ...]], ...]]:
+    """Canonical hashable form of a filter dict (None for no filtering)."""
+    if not filters:
+        return None
+    normalized = []
+    for field, values in sorted(filters.items()):
+        if values is None:
+            continue
+        if field not in PARTITION_FIELDS:
+            raise ValueError(f"Unknown filter field '{field}'. Expected one of: {', '.join(PARTITION_FIELDS)}")
+        if isinstance(values, (str, int, float)):
+            values = [values]
+        normalized.append((field, tuple(sorted(str(v) for v in values))))
+    return tuple(normalized) or None
+
+
+class PartitionMap:
+    """Doc ids per (field, value), plus a small cache of the ID selectors built from them."""
+
+    SELECTOR_CACHE_SIZE = 64
+
+    def __init__(self):
+        self.partitions: Dict[str, Dict[str, List[int]]] = {field: {} for field in PARTITION_FIELDS}
+        # normalized filters -> (ids, IDSelectorBatch, frozenset of ids)
+        self._selector_cache: "OrderedDict[Any, Tuple[np.ndarray, Any, FrozenSet[int]]]" = OrderedDict()
+        self._cache_lock = Lock()
+
+    @classmethod
+    def from_entries(cls, entries: Iterable[Dict[str, Any]]) -> "PartitionMap":
+        partition_map = cls()
+        for doc_id, entry in enumerate(entries):
+            partition_map.add(doc_id, entry)
+        return partition_map
+
+    def add(self, doc_id: int, entry: Dict[str, Any]) -> None:
+        for field, value in partition_keys(entry):
+            self.partitions[field].setdefault(value, []).append(doc_id)
+
+    def values(self) -> Dict[str, Dict[str, int]]:
+        """Partition sizes, e.g. for listing the filters a KB supports."""
+        return {field: {value: len(ids) for value, ids in by_value.items()}
+                for field, by_value in self.partitions.items()}
+
+    def matching_ids(self, filters: Optional[Filters]) -> Optional[np.ndarray]:
+        """Sorted doc ids matching the filters, or None when there is nothing to filter."""
+        return self._resolve(filters)[0]
+
+    def allowed_set(self, filters: Optional[Filters]) -> Optional[FrozenSet[int]]:
+        """Matching doc ids as a set (for filtering BM25 postings), or None when unfiltered."""
+        return self._resolve(filters)[2]
+
+    def selector(self, filters: Optional[Filters]) -> Tuple[Optional[np.ndarray], Any]:
+        """(matching ids, faiss.IDSelectorBatch) for the filters; (None, None) when unfiltered."""
+        ids, selector, _ = self._resolve(filters)
+        return ids, selector
+
+    def _resolve(self, filters: Optional[Filters]):
+        key = normalize_filters(filters)
+        if key is None:
+            return None, None, None
+        with self._cache_lock:
+            cached = self._selector_cache.get(key)
+            if cached is not None:
+                self._selector_cache.move_to_end(key)
+                return cached
+
+        ids: Optional[np.ndarray] = None
+        for field, values in key:
+            by_value = self.partitions.get(field, {})
+            field_ids = np.unique(np.concatenate(
+                [np.asarray(by_value.get(v, []), dtype="int64") for v in values]
+            )) if values else np.zeros(0, dtype="int64")
+            ids = field_ids if ids is None else np.intersect1d(ids, field_ids, assume_unique=True)
+        ids = np.ascontiguousarray(ids, dtype="int64")
+        resolved = (ids, faiss.IDSelectorBatch(len(ids), faiss.swig_ptr(ids)), frozenset(ids.tolist()))
+
+        with self._cache_lock:
+            self._selector_cache[key] = resolved
+            while len(self._selector_cache) > self.SELECTOR_CACHE_SIZE:
+                self._selector_cache.popitem(last=False)
+        return resolved
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            # A canonical entry is added once for itself and once per merged duplicate
+            fields = {field: {value: sorted(set(ids)) for value, ids in by_value.items()}
+                      for field, by_value in self.partitions.items()}
+            json.dump({"fields": fields}, f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "PartitionMap":
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        partition_map = cls()
+        for field, by_value in data.get("fields", {}).items():
+            partition_map.partitions[field] = {value: list(ids) for value, ids in by_value.items()}
+        return partition_map
+
+
+def search_parameters_for(index, selector):
+    """
+    SearchParameters restricting a search to selector, carrying over the
+    index's current nprobe / efSearch (explicit parameters override them).
+    """
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        return faiss.SearchParametersIVF(sel=selector, nprobe=ivf.nprobe)
+    hnsw_index = faiss.downcast_index(index)
+    if isinstance(hnsw_index, faiss.IndexHNSW):
+        return faiss.SearchParametersHNSW(sel=selector, efSearch=hnsw_index.hnsw.efSearch)
+    return faiss.SearchParameters(sel=selector)
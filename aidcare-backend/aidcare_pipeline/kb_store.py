@@ -0,0 +1,237 @@
+# aidcare_pipeline/kb_store.py
+# On-disk formats for the knowledge-base artifacts shared by the retrievers and
+# the KB build scripts:
+#   - FAISS indexes, optionally memory-mapped so several workers share page cache
+#   - a compact binary metadata store with an offset table, so only the entries a
+#     search actually returns are ever decoded
+
+import json
+import mmap
+import os
+import struct
+from typing import Any, Dict, Iterable, Iterator, List, Union
+
+import faiss
+import numpy as np
+
+FAISS_MMAP = os.getenv("FAISS_MMAP", "true").lower() == "true"
+
+METADATA_STORE_MAGIC = b"AIDKBMD1"
+METADATA_STORE_EXTENSION = ".bin"
+# magic (8 bytes) + entry count (uint64); followed by count+1 uint64 offsets
+# (relative to the start of the data section) and the UTF-8 JSON blobs
+_HEADER = struct.Struct("<8sQ")
+
+
+# Read flags tried in order when memory-mapping. IO_FLAG_MMAP_IFC (faiss >= 1.8)
+# maps the codes of Flat, HNSW and SQ indexes in place; plain IO_FLAG_MMAP only
+# maps IVF inverted lists and reads everything else into memory.
+_MMAP_MODES = [
+    (name, getattr(faiss, flag) | faiss.IO_FLAG_READ_ONLY)
+    for name, flag in (("mmap_ifc", "IO_FLAG_MMAP_IFC"), ("mmap", "IO_FLAG_MMAP"))
+    if hasattr(faiss, flag)
+]
+
+
+def _is_file_mapped(path: str) -> Union[bool, None]:
+    """Whether this process has path mapped (None where /proc is not available)."""
+    try:
+        real_path = os.path.realpath(path)
+        with open("/proc/self/maps", "r") as maps:
+            return any(line.rstrip().endswith(real_path) for line in maps)
+    except OSError:
+        return None
+
+
+def read_faiss_index(index_path: str, use_mmap: bool = FAISS_MMAP):
+    """Read a FAISS index, memory-mapping it read-only when supported, and log the mode used."""
+    if use_mmap:
+        for mode, flags in _MMAP_MODES:
+            try:
+                index = faiss.read_index(index_path, flags)
+            except Exception as e:
+                print(f"KB Store: {mode} load not supported for {index_path} ({e}).")
+                continue
+            mapped = _is_file_mapped(index_path)
+            detail = {True: "file mapped", False: "no file mapping, data read into memory",
+                      None: "mapping not verifiable"}[mapped]
+            print(f"KB Store: Loaded {index_path} with {mode} ({detail}).")
+            return index
+        print(f"KB Store: No mmap mode worked for {index_path}; reading into memory.")
+    index = faiss.read_index(index_path)
+    print(f"KB Store: Loaded {index_path} into memory.")
+    return index
+
+
+class MetadataStore:
+    """
+    Read-only, memory-mapped view over a binary metadata file.
+
+    Behaves like a list of dicts: len(), indexing and iteration work, but each
+    entry is decoded from the mapped file on access and returned as a fresh dict.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open(path, "rb")
+        try:
+            self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty file; mmap refuses zero-length maps
+            self._file.close()
+            raise ValueError(f"Metadata store is empty: {path}")
+
+        magic, count = _HEADER.unpack_from(self._mm, 0)
+        if magic != METADATA_STORE_MAGIC:
+            self.close()
+            raise ValueError(f"Not an AidCare metadata store: {path}")
+
+        self._count = count
+        offsets_start = _HEADER.size
+        self._offsets = np.frombuffer(self._mm, dtype="<u8", count=count + 1, offset=offsets_start)
+        self._data_start = offsets_start + (count + 1) * 8
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __getitem__(self, idx: int) -> Dict[str, Any]:
+        idx = int(idx)
+        if idx < 0:
+            idx += self._count
+        if not 0 <= idx < self._count:
+            raise IndexError(f"Metadata index {idx} out of range (size {self._count})")
+        start = self._data_start + int(self._offsets[idx])
+        end = self._data_start + int(self._offsets[idx + 1])
+        return json.loads(self._mm[start:end])
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        for idx in range(self._count):
+            yield self[idx]
+
+    def close(self) -> None:
+        self._offsets = None
+        try:
+            self._mm.close()
+        except Exception:
+            pass
+        self._file.close()
+
+
+def write_metadata_store(entries: Iterable[Dict[str, Any]], path: str) -> int:
+    """
+    Write entries to a binary metadata store at path (atomically replaced).
+
+    Returns the number of entries written.
+    """
+    blobs_path = path + ".blobs.tmp"
+    offsets = [0]
+    with open(blobs_path, "wb") as blobs:
+        for entry in entries:
+            blob = json.dumps(entry, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            blobs.write(blob)
+            offsets.append(offsets[-1] + len(blob))
+
+    tmp_path = path + ".tmp"
+    count = len(offsets) - 1
+    with open(tmp_path, "wb") as out, open(blobs_path, "rb") as blobs:
+        out.write(_HEADER.pack(METADATA_STORE_MAGIC, count))
+        out.write(np.asarray(offsets, dtype="<u8").tobytes())
+        while True:
+            block = blobs.read(1024 * 1024)
+            if not block:
+                break
+            out.write(block)
+    os.remove(blobs_path)
+    os.replace(tmp_path, path)
+    return count
+
+
+def kb_manifest_path_for(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + "_manifest.json"
+
+
+def lexical_index_path_for(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + "_bm25.json"
+
+
+def partitions_path_for(index_path: str) -> str:
+    return os.path.splitext(index_path)[0] + "_partitions.json"
+
+
+def write_kb_manifest(index_path: str, manifest: Dict[str, Any]) -> str:
+    """Write the build manifest (index factory, search params, model, counts) next to an index."""
+    manifest_path = kb_manifest_path_for(index_path)
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest_path
+
+
+def read_kb_manifest(index_path: str) -> Dict[str, Any]:
+    """Return the build manifest for an index, or {} for indexes built before manifests existed."""
+    manifest_path = kb_manifest_path_for(index_path)
+    if not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception as e:
+        print(f"KB Store: Could not read manifest {manifest_path}: {e}")
+        return {}
+
+
+def apply_search_params(index, search_params: str) -> None:
+    """Apply FAISS search-time parameters such as 'nprobe=8' or 'efSearch=64'."""
+    if search_params:
+        faiss.ParameterSpace().set_index_parameters(index, search_params)
+
+
+def metadata_store_path_for(metadata_json_path: str) -> str:
+    return os.path.splitext(metadata_json_path)[0] + METADATA_STORE_EXTENSION
+
+
+def is_metadata_store(path: str) -> bool:
+    try:
+        with open(path, "rb") as f:
+            return f.read(len(METADATA_STORE_MAGIC)) == METADATA_STORE_MAGIC
+    except OSError:
+        return False
+
+
+def resolve_metadata_path(metadata_path: str) -> str:
+    """
+    Prefer the binary store built alongside a JSON metadata file, as long as it
+    is not older than the JSON it was built from.
+    """
+    if is_metadata_store(metadata_path):
+        return metadata_path
+    store_path = metadata_store_path_for(metadata_path)
+    if os.path.exists(store_path) and (
+        not os.path.exists(metadata_path)
+        or os.path.getmtime(store_path) >= os.path.getmtime(metadata_path)
+    ):
+        return store_path
+    return metadata_path
+
+
+def load_metadata(metadata_path: str) -> Union[MetadataStore, List[Dict[str, Any]]]:
+    """Open a binary metadata store, or fully parse a legacy JSON metadata file."""
+    if is_metadata_store(metadata_path):
+        return MetadataStore(metadata_path)
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# --- Convert existing JSON metadata without re-embedding ---
+if __name__ == "__main__":
+    import sys
+
+    if len(sys.argv) < 2:
+        print("Usage: python -m aidcare_pipeline.kb_store <metadata.json> [<metadata.json> ...]")
+        sys.exit(1)
+    for json_path in sys.argv[1:]:
+        with open(json_path, 'r', encoding='utf-8') as f:
+            entries = json.load(f)
+        store_path = metadata_store_path_for(json_path)
+        written = write_metadata_store(entries, store_path)
+        print(f"Wrote {written} entries to {store_path} "
+              f"({os.path.getsize(json_path)} -> {os.path.getsize(store_path)} bytes)")
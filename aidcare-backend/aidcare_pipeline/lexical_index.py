@@ -0,0 +1,147 @@
+# aidcare_pipeline/lexical_index.py
+# BM25 inverted index for exact-term lookups (drug and disease names such as
+# "co-artemether" or "lassa") plus reciprocal rank fusion for combining the
+# lexical ranking with FAISS results.
+#
+# The index is built once (at KB build time, or when guidelines are loaded);
+# a query only touches the postings of its own terms.
+
+import heapq
+import json
+import math
+import re
+from collections import defaultdict
+from typing import Container, Dict, Iterable, List, Optional, Sequence, Tuple
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:-[a-z0-9]+)*")
+
+_STOPWORDS = frozenset({
+    "a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "has", "in",
+    "is", "it", "may", "no", "not", "of", "on", "or", "the", "to", "with",
+})
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercase word tokens. Hyphenated terms are kept whole and also split, so
+    "co-artemether" matches both "co-artemether" and "artemether".
+    """
+    tokens: List[str] = []
+    for match in _TOKEN_PATTERN.findall((text or "").lower()):
+        if "-" in match:
+            tokens.append(match)
+            tokens.extend(part for part in match.split("-") if len(part) > 1 and part not in _STOPWORDS)
+        elif len(match) > 1 and match not in _STOPWORDS:
+            tokens.append(match)
+    return tokens
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed list of documents, addressed by position."""
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.doc_lengths: List[int] = []
+        self.avg_doc_length = 0.0
+        # term -> [(doc_id, term_frequency), ...]
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        self.idf: Dict[str, float] = {}
+
+    @classmethod
+    def from_texts(cls, texts: Iterable[str], k1: float = 1.5, b: float = 0.75) -> "BM25Index":
+        index = cls(k1=k1, b=b)
+        for text in texts:
+            index.add_document(text)
+        index.finalize()
+        return index
+
+    def add_document(self, text: str) -> int:
+        """
+        Append one document (for streaming builds) and return its doc id.
+        Call finalize() once all documents are added.
+        """
+        doc_id = len(self.doc_lengths)
+        tokens = tokenize(text)
+        self.doc_lengths.append(len(tokens))
+        counts: Dict[str, int] = defaultdict(int)
+        for token in tokens:
+            counts[token] += 1
+        for token, tf in counts.items():
+            self.postings.setdefault(token, []).append((doc_id, tf))
+        return doc_id
+
+    def finalize(self) -> None:
+        n_docs = len(self.doc_lengths)
+        self.avg_doc_length = (sum(self.doc_lengths) / n_docs) if n_docs else 0.0
+        self.idf = {
+            term: math.log(1 + (n_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+            for term, docs in self.postings.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.doc_lengths)
+
+    def search(self, query: str, top_k: int = 10, allowed: Optional[Container[int]] = None) -> List[Tuple[int, float]]:
+        """
+        Return up to top_k (doc_id, score) pairs, best first. Docs with no query
+        term are never scored; with allowed, only those doc ids are considered.
+        """
+        if not self.doc_lengths:
+            return []
+        scores: Dict[int, float] = defaultdict(float)
+        avg_len = self.avg_doc_length or 1.0
+        for term in set(tokenize(query)):
+            docs = self.postings.get(term)
+            if not docs:
+                continue
+            idf = self.idf[term]
+            for doc_id, tf in docs:
+                if allowed is not None and doc_id not in allowed:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / avg_len)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return heapq.nlargest(top_k, scores.items(), key=lambda item: item[1])
+
+    def to_dict(self) -> dict:
+        return {
+            "k1": self.k1,
+            "b": self.b,
+            "doc_lengths": self.doc_lengths,
+            "postings": self.postings,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "BM25Index":
+        index = cls(k1=data.get("k1", 1.5), b=data.get("b", 0.75))
+        index.doc_lengths = list(data.get("doc_lengths", []))
+        index.postings = {term: [tuple(p) for p in docs] for term, docs in data.get("postings", {}).items()}
+        index.finalize()
+        return index
+
+    def save(self, path: str) -> None:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+
+    @classmethod
+    def load(cls, path: str) -> "BM25Index":
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def reciprocal_rank_fusion(
+    rankings: Sequence[Sequence[int]],
+    k: int = 60,
+    weights: Optional[Sequence[float]] = None,
+) -> List[Tuple[int, float]]:
+    """
+    Fuse several ranked lists of doc ids: score(d) = sum(w / (k + rank)).
+
+    Returns (doc_id, fused_score) pairs, best first.
+    """
+    fused: Dict[int, float] = defaultdict(float)
+    for i, ranking in enumerate(rankings):
+        weight = weights[i] if weights else 1.0
+        for rank, doc_id in enumerate(ranking, start=1):
+            fused[doc_id] += weight / (k + rank)
+    return sorted(fused.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,227 @@
+# aidcare_pipeline/llm_gateway.py
+# Process-wide OpenAI client with a pooled, keep-alive HTTP connection pool.
+#
+# Building OpenAI(api_key=...) per call opens a fresh connection pool each time,
+# so every model call paid a TCP + TLS handshake to api.openai.com. All OpenAI
+# calls now go through get_openai_client(), which reuses one httpx.Client; a
+# triage (extraction, recommendation, translations) then reuses warm
+# connections. Async endpoints use get_async_openai_client(), the same setup on
+# an httpx.AsyncClient, so model calls never block the event loop.
+#
+# Connection setup is measured via httpcore trace events: get_gateway_stats()
+# reports how many requests opened a new connection and the average setup
+# time, and begin_llm_scope() gives the same numbers for one request (e.g. one
+# triage). Gemini calls are not routed here: the google-generativeai SDK
+# already keeps one module-level client per process.
+
+import os
+import threading
+import time
+from contextvars import ContextVar
+from typing import Any, Dict, Optional
+
+import httpx
+
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "90"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "5"))
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "60"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))  # OpenAI SDK retries (429/5xx/connection errors)
+
+
+class ConnectionStats:
+    """Counts requests and the connections (TCP + TLS handshakes) they had to open."""
+
+    def __init__(self):
+        self.requests = 0
+        self.new_connections = 0
+        self.connect_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def record_request(self) -> None:
+        with self._lock:
+            self.requests += 1
+
+    def record_connection(self, seconds: float) -> None:
+        with self._lock:
+            self.new_connections += 1
+            self.connect_seconds += seconds
+
+    def as_dict(self, reference_connect_ms: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Args:
+            reference_connect_ms: Setup cost to credit each reused request with
+                (defaults to this object's own average)
+        """
+        with self._lock:
+            avg_connect_ms = (self.connect_seconds * 1000 / self.new_connections) if self.new_connections else None
+            reused = self.requests - self.new_connections
+            per_connection_ms = reference_connect_ms if reference_connect_ms is not None else avg_connect_ms
+            return {
+                "requests": self.requests,
+                "new_connections": self.new_connections,
+                "reused_connections": reused,
+                "connect_ms_total": round(self.connect_seconds * 1000, 1),
+                "avg_connect_ms": round(avg_connect_ms, 1) if avg_connect_ms is not None else None,
+                # What the reused requests would have paid with a client built per call
+                "saved_connect_ms_estimate": round(reused * per_connection_ms, 1) if per_connection_ms else None,
+            }
+
+
+_global_stats = ConnectionStats()
+_scope_stats: ContextVar[Optional[ConnectionStats]] = ContextVar("llm_scope_stats", default=None)
+
+
+class _ConnectionTracer:
+    """httpcore trace callback for one request: times connect_tcp + start_tls."""
+
+    def __init__(self, scope: Optional[ConnectionStats]):
+        self.scope = scope
+        self.started: Optional[float] = None
+
+    def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        if event_name == "connection.connect_tcp.started":
+            self.started = time.perf_counter()
+        elif self.started is not None and event_name in ("connection.start_tls.complete", "http11.send_request_headers.started",
+                                                         "http2.send_connection_init.started"):
+            # TLS done, or (plain HTTP) the first request on the new connection begins
+            seconds = time.perf_counter() - self.started
+            self.started = None
+            _global_stats.record_connection(seconds)
+            if self.scope is not None:
+                self.scope.record_connection(seconds)
+
+
+class _AsyncConnectionTracer(_ConnectionTracer):
+    """Async interfaces in httpcore await their trace callback."""
+
+    async def __call__(self, event_name: str, info: Dict[str, Any]) -> None:
+        super().__call__(event_name, info)
+
+
+def _on_request(request: httpx.Request, tracer_class=_ConnectionTracer) -> None:
+    scope = _scope_stats.get()
+    _global_stats.record_request()
+    if scope is not None:
+        scope.record_request()
+    request.extensions["trace"] = tracer_class(scope)
+
+
+async def _on_async_request(request: httpx.Request) -> None:
+    _on_request(request, _AsyncConnectionTracer)
+
+
+def _client_settings() -> Dict[str, Any]:
+    return {
+        "limits": httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS,
+        ),
+        "timeout": httpx.Timeout(LLM_READ_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS),
+    }
+
+
+def _build_http_client() -> httpx.Client:
+    return httpx.Client(event_hooks={"request": [_on_request]}, **_client_settings())
+
+
+def _build_async_http_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(event_hooks={"request": [_on_async_request]}, **_client_settings())
+
+
+def _api_key() -> str:
+    api_key = os.environ.get("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY not set")
+    return api_key
+
+
+# --- Global instances, created on first use ---
+_openai_client = None
+_async_openai_client = None
+_client_lock = threading.Lock()
+
+
+def get_openai_client(timeout: Optional[float] = None):
+    """
+    Return the shared OpenAI client.
+
+    Args:
+        timeout: Optional per-call-site read timeout in seconds (e.g. longer for
+            audio uploads); the returned client still shares the connection pool
+
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    global _openai_client
+    if _openai_client is None:
+        with _client_lock:
+            if _openai_client is None:
+                from openai import OpenAI
+                _openai_client = OpenAI(api_key=_api_key(), http_client=_build_http_client(), max_retries=LLM_MAX_RETRIES)
+                print(f"LLM Gateway: OpenAI client ready (pool: {LLM_MAX_CONNECTIONS} connections, "
+                      f"{LLM_MAX_KEEPALIVE_CONNECTIONS} keep-alive for {LLM_KEEPALIVE_EXPIRY_SECONDS:.0f}s)")
+    if timeout is not None:
+        return _openai_client.with_options(timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT_SECONDS))
+    return _openai_client
+
+
+def get_async_openai_client(timeout: Optional[float] = None):
+    """
+    Return the shared AsyncOpenAI client (for async endpoints).
+
+    Args:
+        timeout: Optional per-call-site read timeout in seconds
+
+    Raises:
+        ValueError: If OPENAI_API_KEY is not set
+    """
+    global _async_openai_client
+    if _async_openai_client is None:
+        with _client_lock:
+            if _async_openai_client is None:
+                from openai import AsyncOpenAI
+                _async_openai_client = AsyncOpenAI(api_key=_api_key(), http_client=_build_async_http_client(),
+                                                   max_retries=LLM_MAX_RETRIES)
+                print("LLM Gateway: AsyncOpenAI client ready")
+    if timeout is not None:
+        return _async_openai_client.with_options(timeout=httpx.Timeout(timeout, connect=LLM_CONNECT_TIMEOUT_SECONDS))
+    return _async_openai_client
+
+
+def begin_llm_scope() -> ConnectionStats:
+    """
+    Start collecting connection stats for the LLM calls made from here on in
+    the current context. Each request handler runs in its own context, so this
+    scopes the stats to one request (e.g. one triage).
+    """
+    stats = ConnectionStats()
+    _scope_stats.set(stats)
+    return stats
+
+
+def scope_report(stats: ConnectionStats) -> Dict[str, Any]:
+    """Stats for one scope, crediting reused connections with the process-wide average setup time."""
+    return stats.as_dict(reference_connect_ms=get_gateway_stats()["avg_connect_ms"])
+
+
+def get_gateway_stats() -> Dict[str, Any]:
+    return _global_stats.as_dict()
+
+
+def close_clients() -> None:
+    global _openai_client
+    with _client_lock:
+        if _openai_client is not None:
+            _openai_client.close()
+            _openai_client = None
+
+
+async def close_async_clients() -> None:
+    global _async_openai_client
+    with _client_lock:
+        client, _async_openai_client = _async_openai_client, None
+    if client is not None:
+        await client.close()
@@ -3,8 +3,11 @@
 # UNDP Nigeria IC x Timbuktu Initiative — International Mother Language Day
 # Uses OpenAI GPT-4o for richer multilingual understanding vs Gemini
 
+import asyncio
+import json
 import os
 import time
+from .llm_gateway import get_async_openai_client, get_openai_client
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL_MULTILINGUAL = os.getenv("OPENAI_MODEL_MULTILINGUAL", "gpt-4o")
@@ -116,6 +119,18 @@ def _language_name(code: str) -> str:
     return names.get(code, 'English')
 
 
+def _translation_request(text: str, source_language: str) -> dict:
+    lang_name = _language_name(source_language)
+    return {
+        "model": OPENAI_MODEL_TRANSLATE,
+        "messages": [
+            {"role": "system", "content": f"Translate the following from {lang_name} to English. Output ONLY the English translation, nothing else. Preserve medical terms."},
+            {"role": "user", "content": text.strip()},
+        ],
+        "max_tokens": 1000,
+    }
+
+
 def translate_to_english(text: str, source_language: str) -> str | None:
     """
     Translate text from a Nigerian language to English for transparency.
@@ -127,18 +142,9 @@ def translate_to_english(text: str, source_language: str) -> str | None:
     if not OPENAI_API_KEY:
         return None
 
-    lang_name = _language_name(source_language)
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL_TRANSLATE,
-            messages=[
-                {"role": "system", "content": f"Translate the following from {lang_name} to English. Output ONLY the English translation, nothing else. Preserve medical terms."},
-                {"role": "user", "content": text.strip()},
-            ],
-            max_tokens=1000,
-        )
+        client = get_openai_client()
+        response = client.chat.completions.create(**_translation_request(text, source_language))
         out = (response.choices[0].message.content or "").strip()
         return out if out else None
     except Exception as e:
@@ -146,32 +152,132 @@ def translate_to_english(text: str, source_language: str) -> str | None:
         return None
 
 
-def generate_multilingual_response(
-    conversation_history: str,
-    latest_message: str,
-    language: str = 'en'
-) -> dict:
+async def translate_to_english_async(text: str, source_language: str) -> str | None:
+    """Async variant of translate_to_english for async endpoints."""
+    if not text or not text.strip() or source_language == 'en':
+        return None
+    if not OPENAI_API_KEY:
+        return None
+
+    try:
+        client = get_async_openai_client()
+        response = await client.chat.completions.create(**_translation_request(text, source_language))
+        out = (response.choices[0].message.content or "").strip()
+        return out if out else None
+    except Exception as e:
+        print(f"Translation to English failed: {e}")
+        return None
+
+
+def _batch_translation_request(texts: list, source_language: str) -> dict:
+    lang_name = _language_name(source_language)
+    return {
+        "model": OPENAI_MODEL_TRANSLATE,
+        "messages": [
+            {"role": "system", "content": (
+                f"Translate each string in the JSON array from {lang_name} to English. Preserve medical terms. "
+                f'Return ONLY a JSON object {{"translations": [...]}} with exactly one English string per '
+                f"input string, in the same order."
+            )},
+            {"role": "user", "content": json.dumps(texts, ensure_ascii=False)},
+        ],
+        "max_tokens": 1000 + 250 * len(texts),
+        "response_format": {"type": "json_object"},
+    }
+
+
+def _parse_batch_translation(response, count: int) -> list | None:
+    """The translations in input order, or None if the model did not return one per input."""
+    data = json.loads((response.choices[0].message.content or "").strip())
+    translations = data.get("translations") if isinstance(data, dict) else None
+    if not isinstance(translations, list) or len(translations) != count:
+        print(f"Batch translation returned {len(translations) if isinstance(translations, list) else 'no'} "
+              f"items for {count} inputs; translating individually.")
+        return None
+    return [str(t).strip() or None for t in translations]
+
+
+def _batch_pending(texts: list, source_language: str) -> list:
+    """Indexes of the texts that need translating."""
+    if source_language == 'en' or not OPENAI_API_KEY:
+        return []
+    return [i for i, text in enumerate(texts) if isinstance(text, str) and text.strip()]
+
+
+def translate_batch_to_english(texts: list, source_language: str) -> list:
     """
-    Generate a conversational follow-up response in the specified Nigerian language
-    using GPT-4o for superior multilingual understanding.
+    Translate several texts to English in one model call (e.g. a triage summary
+    and its recommended actions) instead of one call per text.
 
     Args:
-        conversation_history: Full conversation so far (PATIENT:/YOU: format)
-        latest_message: The patient's most recent message
-        language: Language code — 'en' | 'ha' | 'yo' | 'ig' | 'pcm'
+        texts: Strings in source_language; empty entries are left untranslated
+        source_language: Language code — 'ha' | 'yo' | 'ig' | 'pcm'
 
     Returns:
-        dict with keys: response, language, conversation_complete, should_auto_complete
+        One English string (or None, as translate_to_english) per input text
     """
-    if not OPENAI_API_KEY:
-        return {
-            "response": "Service configuration error. Please try again.",
-            "language": language,
-            "conversation_complete": False,
-            "should_auto_complete": False,
-            "error": "Missing OPENAI_API_KEY"
-        }
+    results = [None] * len(texts)
+    pending = _batch_pending(texts, source_language)
+    if len(pending) == 1:
+        results[pending[0]] = translate_to_english(texts[pending[0]], source_language)
+        return results
+    if not pending:
+        return results
+
+    batch = [texts[i].strip() for i in pending]
+    try:
+        client = get_openai_client()
+        response = client.chat.completions.create(**_batch_translation_request(batch, source_language))
+        translations = _parse_batch_translation(response, len(batch))
+    except Exception as e:
+        print(f"Batch translation to English failed, translating individually: {e}")
+        translations = None
+    if translations is None:
+        translations = [translate_to_english(text, source_language) for text in batch]
+
+    for i, translated in zip(pending, translations):
+        results[i] = translated
+    return results
+
+
+async def translate_batch_to_english_async(texts: list, source_language: str) -> list:
+    """Async variant of translate_batch_to_english; the per-text fallback runs concurrently."""
+    results = [None] * len(texts)
+    pending = _batch_pending(texts, source_language)
+    if len(pending) == 1:
+        results[pending[0]] = await translate_to_english_async(texts[pending[0]], source_language)
+        return results
+    if not pending:
+        return results
+
+    batch = [texts[i].strip() for i in pending]
+    try:
+        client = get_async_openai_client()
+        response = await client.chat.completions.create(**_batch_translation_request(batch, source_language))
+        translations = _parse_batch_translation(response, len(batch))
+    except Exception as e:
+        print(f"Batch translation to English failed, translating individually: {e}")
+        translations = None
+    if translations is None:
+        translations = await asyncio.gather(*(translate_to_english_async(text, source_language) for text in batch))
+
+    for i, translated in zip(pending, translations):
+        results[i] = translated
+    return results
+
+
+def _missing_key_response(language: str) -> dict:
+    return {
+        "response": "Service configuration error. Please try again.",
+        "language": language,
+        "conversation_complete": False,
+        "should_auto_complete": False,
+        "error": "Missing OPENAI_API_KEY"
+    }
 
+
+def _conversation_request(conversation_history: str, latest_message: str, language: str):
+    """Returns (chat.completions.create kwargs, number of patient exchanges so far)."""
     system_instruction = LANGUAGE_SYSTEM_INSTRUCTIONS.get(
         language, LANGUAGE_SYSTEM_INSTRUCTIONS['en']
     )
@@ -221,63 +327,185 @@ def generate_multilingual_response(
         f"{auto_complete_note}"
     )
 
+    request = {
+        "model": OPENAI_MODEL_MULTILINGUAL,
+        "messages": [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": user_prompt},
+        ],
+        "temperature": 0.75,
+        "max_tokens": 350,
+    }
+    return request, exchange_count
+
+
+_COMPLETE_MARKER = "[COMPLETE_ASSESSMENT]"
+
+
+def _parse_conversation(response, language: str, exchange_count: int) -> dict:
+    return _conversation_result(response.choices[0].message.content, language, exchange_count)
+
+
+def _conversation_result(ai_response: str, language: str, exchange_count: int) -> dict:
+    ai_response = (ai_response or "").strip()
+
+    should_complete = _COMPLETE_MARKER in ai_response
+    # Remove hidden marker before sending to frontend
+    ai_response = ai_response.replace(_COMPLETE_MARKER, "").strip()
+
+    # Force auto-complete after 5 exchanges regardless
+    if exchange_count >= 5:
+        should_complete = True
+
+    return {
+        "response": ai_response,
+        "language": language,
+        "conversation_complete": should_complete,
+        "should_auto_complete": should_complete,
+    }
+
+
+def _conversation_fallback(language: str, error: Exception) -> dict:
+    # Language-appropriate fallback
+    fallbacks = {
+        'ha': "Ka ci gaba da fada mini alamun rashin lafiyar ka.",
+        'yo': "Jowo tesiwaju so fun mi nipa awon ami aisaan re.",
+        'ig': "Biko gwa m ozoo maka ihe o bu na-eme gi.",
+        'pcm': "Abeg tell me more about wetin dey do you.",
+        'en': "Please tell me more about your symptoms.",
+    }
+    return {
+        "response": fallbacks.get(language, fallbacks['en']),
+        "language": language,
+        "conversation_complete": False,
+        "should_auto_complete": False,
+        "error": str(error)
+    }
+
+
+_CONVERSATION_EXHAUSTED = {
+    "response": "Please continue describing your symptoms.",
+    "conversation_complete": False,
+    "should_auto_complete": False,
+}
+
+
+def generate_multilingual_response(
+    conversation_history: str,
+    latest_message: str,
+    language: str = 'en'
+) -> dict:
+    """
+    Generate a conversational follow-up response in the specified Nigerian language
+    using GPT-4o for superior multilingual understanding.
+
+    Args:
+        conversation_history: Full conversation so far (PATIENT:/YOU: format)
+        latest_message: The patient's most recent message
+        language: Language code — 'en' | 'ha' | 'yo' | 'ig' | 'pcm'
+
+    Returns:
+        dict with keys: response, language, conversation_complete, should_auto_complete
+    """
+    if not OPENAI_API_KEY:
+        return _missing_key_response(language)
+
+    request, exchange_count = _conversation_request(conversation_history, latest_message, language)
+
     max_retries = 2
     for attempt in range(max_retries):
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
-            response = client.chat.completions.create(
-                model=OPENAI_MODEL_MULTILINGUAL,
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": user_prompt},
-                ],
-                temperature=0.75,
-                max_tokens=350,
-            )
-
-            ai_response = response.choices[0].message.content.strip()
-
-            should_complete = "[COMPLETE_ASSESSMENT]" in ai_response
-            # Remove hidden marker before sending to frontend
-            ai_response = ai_response.replace("[COMPLETE_ASSESSMENT]", "").strip()
-
-            # Force auto-complete after 5 exchanges regardless
-            if exchange_count >= 5:
-                should_complete = True
-
-            return {
-                "response": ai_response,
-                "language": language,
-                "conversation_complete": should_complete,
-                "should_auto_complete": should_complete,
-            }
+            client = get_openai_client()
+            response = client.chat.completions.create(**request)
+            return _parse_conversation(response, language, exchange_count)
 
         except Exception as e:
             print(f"GPT-4o multilingual error (attempt {attempt + 1}): {e}")
             if attempt < max_retries - 1:
                 time.sleep(2 * (attempt + 1))
             else:
-                # Language-appropriate fallback
-                fallbacks = {
-                    'ha': "Ka ci gaba da fada mini alamun rashin lafiyar ka.",
-                    'yo': "Jowo tesiwaju so fun mi nipa awon ami aisaan re.",
-                    'ig': "Biko gwa m ozoo maka ihe o bu na-eme gi.",
-                    'pcm': "Abeg tell me more about wetin dey do you.",
-                    'en': "Please tell me more about your symptoms.",
-                }
-                return {
-                    "response": fallbacks.get(language, fallbacks['en']),
-                    "language": language,
-                    "conversation_complete": False,
-                    "should_auto_complete": False,
-                    "error": str(e)
-                }
+                return _conversation_fallback(language, e)
 
-    return {
-        "response": "Please continue describing your symptoms.",
-        "language": language,
-        "conversation_complete": False,
-        "should_auto_complete": False,
-    }
+    return {**_CONVERSATION_EXHAUSTED, "language": language}
+
+
+async def generate_multilingual_response_async(
+    conversation_history: str,
+    latest_message: str,
+    language: str = 'en'
+) -> dict:
+    """Async variant of generate_multilingual_response for async endpoints."""
+    if not OPENAI_API_KEY:
+        return _missing_key_response(language)
+
+    request, exchange_count = _conversation_request(conversation_history, latest_message, language)
+
+    max_retries = 2
+    for attempt in range(max_retries):
+        try:
+            client = get_async_openai_client()
+            response = await client.chat.completions.create(**request)
+            return _parse_conversation(response, language, exchange_count)
+
+        except Exception as e:
+            print(f"GPT-4o multilingual error (attempt {attempt + 1}): {e}")
+            if attempt < max_retries - 1:
+                await asyncio.sleep(2 * (attempt + 1))
+            else:
+                return _conversation_fallback(language, e)
+
+    return {**_CONVERSATION_EXHAUSTED, "language": language}
+
+
+def _visible_text(raw: str) -> str:
+    """Streamed text that is safe to show: the hidden marker removed, and a possible partial marker held back."""
+    text = raw.replace(_COMPLETE_MARKER, "")
+    for n in range(min(len(_COMPLETE_MARKER) - 1, len(text)), 0, -1):
+        if _COMPLETE_MARKER.startswith(text[-n:]):
+            return text[:-n]
+    return text
+
+
+async def stream_multilingual_response(
+    conversation_history: str,
+    latest_message: str,
+    language: str = 'en'
+):
+    """
+    Streaming variant of generate_multilingual_response.
+
+    Yields:
+        ("token", {"text": ...}) as the reply is generated, then ("result", dict)
+        with the same keys as generate_multilingual_response
+    """
+    if not OPENAI_API_KEY:
+        yield "result", _missing_key_response(language)
+        return
+
+    request, exchange_count = _conversation_request(conversation_history, latest_message, language)
+
+    max_retries = 2
+    for attempt in range(max_retries):
+        raw, sent = "", 0
+        try:
+            client = get_async_openai_client()
+            stream = await client.chat.completions.create(**request, stream=True)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                raw += chunk.choices[0].delta.content or ""
+                visible = _visible_text(raw).lstrip()
+                if len(visible) > sent:
+                    yield "token", {"text": visible[sent:]}
+                    sent = len(visible)
+            yield "result", _conversation_result(raw, language, exchange_count)
+            return
+
+        except Exception as e:
+            print(f"GPT-4o multilingual stream error (attempt {attempt + 1}): {e}")
+            # Once text has reached the client a retry would repeat it
+            if sent == 0 and attempt < max_retries - 1:
+                await asyncio.sleep(2 * (attempt + 1))
+            else:
+                yield "result", _conversation_fallback(language, e)
+                return
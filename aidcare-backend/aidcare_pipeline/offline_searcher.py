@@ -0,0 +1,95 @@
+# aidcare_pipeline/offline_searcher.py
+# Local stand-in for the Valyu searcher used by HybridKnowledgeRetriever.
+#
+# Answers the same three searches (literature, clinical guidelines, drug
+# information) from the clinical knowledge base, so multi-source retrieval can
+# run and be timed without network access. An optional per-search delay mimics
+# remote latency, e.g. to check that the sources run concurrently and that the
+# per-source deadlines drop slow ones:
+#
+#   searcher = OfflineKnowledgeSearcher(latency_seconds={"literature": 0.8, "drugs": 5.0})
+#   HybridKnowledgeRetriever(get_chw_retriever(), searcher).retrieve_multi_source(["fever"], mode="clinical")
+
+import time
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional
+
+
+class OfflineKnowledgeSearcher:
+    """Valyu-compatible searcher backed by the local clinical KB."""
+
+    def __init__(
+        self,
+        retriever_getter: Optional[Callable[[], Any]] = None,
+        latency_seconds: Optional[Dict[str, float]] = None,
+        max_results: int = 3,
+    ):
+        """
+        Args:
+            retriever_getter: Returns the retriever to search (default: the clinical KB retriever)
+            latency_seconds: Simulated delay per search, keyed by "literature", "guidelines" or "drugs"
+            max_results: Results returned per search
+        """
+        if retriever_getter is None:
+            from .rag_retrieval import get_clinical_retriever
+            retriever_getter = get_clinical_retriever
+        self.retriever_getter = retriever_getter
+        self.latency_seconds = latency_seconds or {}
+        self.max_results = max_results
+        self.search_counts = {"literature": 0, "guidelines": 0, "drugs": 0}
+        self._lock = Lock()
+
+    def _search(self, kind: str, terms: List[str], filters: Optional[dict],
+                timeout: Optional[float]) -> List[Dict[str, Any]]:
+        """
+        Raises:
+            TimeoutError: If the simulated latency exceeds timeout, as a remote client's would
+        """
+        with self._lock:
+            self.search_counts[kind] += 1
+        delay = self.latency_seconds.get(kind, 0.0)
+        if timeout is not None and delay > timeout:
+            time.sleep(max(0.0, timeout))
+            raise TimeoutError(f"Offline '{kind}' search timed out after {timeout:.2f}s")
+        if delay > 0:
+            time.sleep(delay)
+        if not terms:
+            return []
+        entries = self.retriever_getter().retrieve_hybrid(terms, top_k=self.max_results, filters=filters)
+        return [self._as_result(entry) for entry in entries]
+
+    @staticmethod
+    def _as_result(entry: Dict[str, Any]) -> Dict[str, Any]:
+        disease = (entry.get("disease_info") or {}).get("disease")
+        title = disease or entry.get("case") or entry.get("subsection_title") or "Untitled"
+        return {
+            "title": title,
+            "content": entry.get("original_text_chunk", ""),
+            "source": entry.get("source_document_name", "Local knowledge base"),
+            "url": None,
+            "relevance_score": entry.get("fusion_score"),
+        }
+
+    def search_medical_literature(self, query_terms: List[str], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._search("literature", query_terms, {"source_type": "Textbook"}, timeout)
+
+    def search_clinical_guidelines(self, symptoms: List[str], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        return self._search("guidelines", symptoms, {"source_type": "Guideline"}, timeout)
+
+    def search_drug_information(self, drug_names: List[str], timeout: Optional[float] = None) -> List[Dict[str, Any]]:
+        # BM25 in the hybrid search picks up exact drug names in the chunks
+        return self._search("drugs", drug_names, None, timeout)
+
+    def format_for_gemini(self, results: Dict[str, List[Dict[str, Any]]]) -> str:
+        sections = []
+        for heading, key in (("Medical literature", "literature"), ("Clinical guidelines", "guidelines"),
+                             ("Drug information", "drugs")):
+            items = results.get(key) or []
+            if items:
+                lines = [f"- {item['title']} ({item['source']}): {item['content']}" for item in items]
+                sections.append(f"{heading} (local):\n" + "\n".join(lines))
+        return "\n\n".join(sections)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {"backend": "offline", "search_counts": dict(self.search_counts)}
@@ -0,0 +1,88 @@
+# aidcare_pipeline/onnx_encoder.py
+# CPU encoder backend that runs an exported, int8-quantized sentence-transformer
+# (all-MiniLM-L6-v2) through onnxruntime, without importing torch.
+#
+# The model directory is produced by scripts/export_onnx_encoder.py and holds
+# model_quantized.onnx plus the Hugging Face tokenizer.json. Pooling and
+# normalization mirror the SentenceTransformer pipeline: mean over the
+# attention mask, then L2-normalize.
+
+import os
+from typing import List, Sequence
+
+import numpy as np
+
+_PIPELINE_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_PIPELINE_DIR)
+
+ONNX_MODELS_ROOT = os.path.join(_PROJECT_ROOT, "data", "models")
+ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "")  # overrides the per-model default below
+ONNX_MODEL_FILE = os.getenv("ONNX_MODEL_FILE", "model_quantized.onnx")
+ONNX_INTRA_OP_THREADS = int(os.getenv("ONNX_INTRA_OP_THREADS", "0"))  # 0 = onnxruntime default
+ONNX_MAX_SEQ_LENGTH = int(os.getenv("ONNX_MAX_SEQ_LENGTH", "256"))  # matches all-MiniLM-L6-v2
+
+
+def onnx_model_dir_for(model_name: str) -> str:
+    return ONNX_MODEL_DIR or os.path.join(ONNX_MODELS_ROOT, f"{model_name.split('/')[-1]}-onnx")
+
+
+class OnnxSentenceEncoder:
+    """
+    Drop-in for the SentenceTransformer.encode() calls used in this codebase.
+
+    Only the arguments the pipeline passes are supported; the return value is
+    always a float32 numpy array of shape (len(texts), dim).
+    """
+
+    def __init__(self, model_dir: str, model_file: str = ONNX_MODEL_FILE,
+                 max_seq_length: int = ONNX_MAX_SEQ_LENGTH, intra_op_threads: int = ONNX_INTRA_OP_THREADS):
+        # Imported lazily so the torch backend never needs onnxruntime installed
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path = os.path.join(model_dir, model_file)
+        tokenizer_path = os.path.join(model_dir, "tokenizer.json")
+        for path in (model_path, tokenizer_path):
+            if not os.path.exists(path):
+                raise FileNotFoundError(
+                    f"ONNX encoder file not found at: {path}. Run 'python scripts/export_onnx_encoder.py' first."
+                )
+
+        self.model_path = model_path
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id("[PAD]") or 0, pad_token="[PAD]")
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads > 0:
+            options.intra_op_num_threads = intra_op_threads
+        self.session = ort.InferenceSession(model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        self._input_names = {i.name for i in self.session.get_inputs()}
+
+    def size_bytes(self) -> int:
+        return os.path.getsize(self.model_path)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.asarray([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.asarray([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        token_embeddings = self.session.run(None, feeds)[0]
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (token_embeddings * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(pooled, axis=1, keepdims=True)
+        return (pooled / np.clip(norms, 1e-12, None)).astype(np.float32)
+
+    def encode(self, sentences, batch_size: int = 32, convert_to_numpy: bool = True,
+               show_progress_bar: bool = False, **kwargs) -> np.ndarray:
+        single = isinstance(sentences, str)
+        texts: Sequence[str] = [sentences] if single else list(sentences)
+        if not texts:
+            return np.zeros((0, 0), dtype=np.float32)
+        batches = [self._encode_batch(list(texts[i:i + batch_size])) for i in range(0, len(texts), batch_size)]
+        embeddings = np.concatenate(batches)
+        return embeddings[0] if single else embeddings
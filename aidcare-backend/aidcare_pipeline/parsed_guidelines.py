@@ -3,8 +3,11 @@ import os
 import re
 from typing import Any
 
+from .lexical_index import BM25Index, tokenize
+
 _PARSED_CACHE: list[dict[str, Any]] | None = None
 _SOURCE_COUNTS: dict[str, int] = {}
+_LEXICAL_INDEX: BM25Index | None = None
 
 
 def _safe_text(value: Any) -> str:
@@ -96,8 +99,19 @@ def _parsed_dir() -> str:
     return os.path.join(os.path.dirname(backend_root), "parsed")
 
 
+def _searchable_text(rec: dict[str, Any]) -> str:
+    return " ".join(
+        [
+            rec.get("condition", ""),
+            rec.get("source_excerpt", ""),
+            " ".join(rec.get("actions", [])),
+            rec.get("cadre", ""),
+        ]
+    )
+
+
 def load_parsed_guidelines(force_reload: bool = False) -> list[dict[str, Any]]:
-    global _PARSED_CACHE, _SOURCE_COUNTS
+    global _PARSED_CACHE, _SOURCE_COUNTS, _LEXICAL_INDEX
     if _PARSED_CACHE is not None and not force_reload:
         return _PARSED_CACHE
 
@@ -108,6 +122,7 @@ def load_parsed_guidelines(force_reload: bool = False) -> list[dict[str, Any]]:
     if not os.path.isdir(parsed_path):
         _PARSED_CACHE = []
         _SOURCE_COUNTS = {}
+        _LEXICAL_INDEX = BM25Index.from_texts([])
         return _PARSED_CACHE
 
     for filename in sorted(os.listdir(parsed_path)):
@@ -134,6 +149,8 @@ def load_parsed_guidelines(force_reload: bool = False) -> list[dict[str, Any]]:
             records.extend(items)
             source_counts[source_name] = len(items)
 
+    # Built once per load so queries only walk the postings of their own terms
+    _LEXICAL_INDEX = BM25Index.from_texts(_searchable_text(rec) for rec in records)
     _PARSED_CACHE = records
     _SOURCE_COUNTS = source_counts
     return records
@@ -150,26 +167,11 @@ def find_parsed_evidence(query_text: str, top_k: int = 2) -> list[dict[str, Any]
     if not records:
         return []
 
-    tokens = set(re.findall(r"[a-zA-Z]{3,}", query_text.lower()))
-    if not tokens:
+    if not tokenize(query_text):
         return records[:top_k]
 
-    scored: list[tuple[int, dict[str, Any]]] = []
-    for rec in records:
-        haystack = " ".join(
-            [
-                rec.get("condition", ""),
-                rec.get("source_excerpt", ""),
-                " ".join(rec.get("actions", [])),
-                rec.get("cadre", ""),
-            ]
-        ).lower()
-        score = sum(1 for token in tokens if token in haystack)
-        if score > 0:
-            scored.append((score, rec))
-
-    scored.sort(key=lambda x: x[0], reverse=True)
-    if not scored:
+    hits = _LEXICAL_INDEX.search(query_text, top_k=top_k) if _LEXICAL_INDEX else []
+    if not hits:
         return records[:top_k]
 
-    return [rec for _, rec in scored[:top_k]]
+    return [records[doc_id] for doc_id, _ in hits]
@@ -0,0 +1,173 @@
+# aidcare_pipeline/pipeline_dag.py
+# Small stage-graph executor for the request pipelines (triage, scribe).
+#
+# A pipeline is declared as named stages with dependencies. Each stage starts
+# as soon as the stages it depends on have finished, so independent work (e.g.
+# translating the transcript, scanning for urgency keywords and extracting
+# symptoms) runs concurrently instead of one step after another. Every stage
+# has a timeout; the run records per-stage status and timings for the
+# response metadata.
+#
+#   dag = PipelineDAG("triage", inputs=("transcript",))
+#   dag.add("symptoms", lambda r: extract_symptoms_async(r["transcript"]), deps=("transcript",))
+#   dag.add("urgency", lambda r: scan(r["transcript"]), deps=("transcript",), required=False, default=[])
+#   run = await dag.run({"transcript": text})
+#   run.results["symptoms"], run.report()
+#
+# A stage function takes the results dict and returns a value or an awaitable.
+# Blocking functions (DB queries, CPU work) should be added with blocking=True
+# so they run in a worker thread. When a required stage fails or times out,
+# the remaining stages are cancelled and its exception is raised from run();
+# an optional stage records the failure and yields its default instead.
+
+import asyncio
+import inspect
+import os
+import time
+from typing import Any, Callable, Dict, Iterable, Optional
+
+DEFAULT_STAGE_TIMEOUT_SECONDS = float(os.getenv("PIPELINE_STAGE_TIMEOUT_SECONDS", "60"))
+
+
+class StageTimeoutError(Exception):
+    """Raised when a required stage does not finish within its timeout."""
+
+    def __init__(self, stage: str, timeout: float):
+        self.stage = stage
+        self.timeout = timeout
+        super().__init__(f"Stage '{stage}' timed out after {timeout:g}s")
+
+
+class Stage:
+    def __init__(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+                 timeout: Optional[float] = None, required: bool = True, default: Any = None, blocking: bool = False):
+        self.name = name
+        self.func = func
+        self.deps = tuple(deps)
+        self.timeout = timeout if timeout is not None else DEFAULT_STAGE_TIMEOUT_SECONDS
+        self.required = required
+        self.default = default
+        self.blocking = blocking
+
+
+class PipelineRun:
+    """Results and timings of one pipeline execution."""
+
+    def __init__(self, label: str, results: Dict[str, Any]):
+        self.label = label
+        self.results = results
+        self.stages: Dict[str, Dict[str, Any]] = {}
+        self.total_ms: Optional[float] = None
+
+    def record(self, name: str, status: str, started_ms: float, duration_ms: float, error: Optional[str] = None) -> None:
+        entry = {"status": status, "started_ms": round(started_ms, 1), "duration_ms": round(duration_ms, 1)}
+        if error:
+            entry["error"] = error
+        self.stages[name] = entry
+
+    def report(self) -> Dict[str, Any]:
+        return {"total_ms": self.total_ms, "stages": dict(self.stages)}
+
+
+class PipelineDAG:
+    def __init__(self, label: str = "pipeline", inputs: Iterable[str] = ()):
+        """
+        Args:
+            label: Name used in logs and the report
+            inputs: Names of the values passed to run(); stages may depend on them
+        """
+        self.label = label
+        self.inputs = set(inputs)
+        self.stages: Dict[str, Stage] = {}
+
+    def add(self, name: str, func: Callable[[Dict[str, Any]], Any], deps: Iterable[str] = (),
+            timeout: Optional[float] = None, required: bool = True, default: Any = None,
+            blocking: bool = False) -> "PipelineDAG":
+        """
+        Add a stage. Dependencies must already be declared, which keeps the graph acyclic.
+
+        Args:
+            name: Stage name; its value is stored under this key in the results
+            func: Called with the results dict; may return a value or an awaitable
+            deps: Stages (or inputs) that must finish first
+            timeout: Seconds before the stage is abandoned (default PIPELINE_STAGE_TIMEOUT_SECONDS)
+            required: Whether a failure aborts the pipeline; optional stages fall back to default
+            default: Value of an optional stage that failed or timed out
+            blocking: Run func in a worker thread
+
+        Raises:
+            ValueError: If the name is taken or a dependency is unknown
+        """
+        if name in self.stages or name in self.inputs:
+            raise ValueError(f"Stage '{name}' is already defined")
+        for dep in deps:
+            if dep not in self.stages and dep not in self.inputs:
+                raise ValueError(f"Stage '{name}' depends on unknown stage '{dep}'")
+        self.stages[name] = Stage(name, func, deps, timeout, required, default, blocking)
+        return self
+
+    async def _call(self, stage: Stage, results: Dict[str, Any]) -> Any:
+        if stage.blocking:
+            value = await asyncio.to_thread(stage.func, results)
+        else:
+            value = stage.func(results)
+        if inspect.isawaitable(value):
+            value = await value
+        return value
+
+    async def run(self, inputs: Optional[Dict[str, Any]] = None) -> PipelineRun:
+        """
+        Execute the stages.
+
+        Args:
+            inputs: Values for the declared inputs
+
+        Returns:
+            PipelineRun with every stage's result and timing
+
+        Raises:
+            StageTimeoutError: If a required stage timed out
+            Exception: Whatever a failed required stage raised
+        """
+        run = PipelineRun(self.label, dict(inputs or {}))
+        start = time.perf_counter()
+        tasks: Dict[str, asyncio.Task] = {}
+
+        async def run_stage(stage: Stage) -> None:
+            for dep in stage.deps:
+                if dep in tasks:
+                    await tasks[dep]
+            stage_start = time.perf_counter()
+            error = None
+            try:
+                value = await asyncio.wait_for(self._call(stage, run.results), stage.timeout)
+                status = "ok"
+            except asyncio.TimeoutError:
+                status, error = "timeout", StageTimeoutError(stage.name, stage.timeout)
+            except Exception as e:
+                status, error = "error", e
+            run.record(stage.name, status, (stage_start - start) * 1000, (time.perf_counter() - stage_start) * 1000,
+                       error=str(error) if error else None)
+            if error is not None:
+                if stage.required:
+                    raise error
+                print(f"Pipeline ({self.label}): Optional stage '{stage.name}' {status}: {error}")
+                value = stage.default
+            run.results[stage.name] = value
+
+        # Declaration order is a valid topological order
+        for name, stage in self.stages.items():
+            tasks[name] = asyncio.ensure_future(run_stage(stage))
+        try:
+            await asyncio.gather(*tasks.values())
+        except BaseException:
+            for task in tasks.values():
+                task.cancel()
+            await asyncio.gather(*tasks.values(), return_exceptions=True)
+            raise
+        finally:
+            run.total_ms = round((time.perf_counter() - start) * 1000, 1)
+
+        timings = ", ".join(f"{name} {entry['duration_ms']:.0f}ms" for name, entry in run.stages.items())
+        print(f"Pipeline ({self.label}): {run.total_ms:.0f}ms total ({timings})")
+        return run
@@ -0,0 +1,162 @@
+# aidcare_pipeline/preload.py
+# Startup preloader for the components that otherwise load lazily on the first
+# request: the embedding model, the FAISS retrievers and the parsed guidelines.
+# They are loaded and warmed with a dummy query in a background thread so the
+# app can start serving /health immediately; /ready reports when they are done.
+
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from .embedding_registry import EMBEDDING_MODEL_NAME, get_encoder, print_registry_report
+from .embedding_service import EMBEDDING_SERVICE_SOCKET, EmbeddingServiceClient
+
+PRELOAD_ON_STARTUP = os.getenv("PRELOAD_ON_STARTUP", "true").lower() not in ("0", "false", "no")
+PRELOAD_COMPONENTS = [
+    c.strip() for c in os.getenv(
+        "PRELOAD_COMPONENTS", "encoder,chw_retriever,clinical_retriever,parsed_guidelines,llm_clients"
+    ).split(",") if c.strip()
+]
+# /ready stays 503 until these are loaded; other components report failures without blocking traffic
+READY_REQUIRED_COMPONENTS = {
+    c.strip() for c in os.getenv("READY_REQUIRED_COMPONENTS", "encoder,chw_retriever").split(",") if c.strip()
+}
+
+WARMUP_SYMPTOMS = ["fever", "cough"]
+
+
+def _warm_encoder() -> None:
+    if EMBEDDING_SERVICE_SOCKET:
+        # The model lives in the embedding service; make sure it answers
+        EmbeddingServiceClient().request({"op": "encode", "texts": ["Patient symptoms: fever, cough."]})
+        return
+    get_encoder(EMBEDDING_MODEL_NAME).encode(["Patient symptoms: fever, cough."], convert_to_numpy=True)
+
+
+def _warm_chw_retriever() -> None:
+    from .rag_retrieval import get_chw_retriever
+    # Hybrid retrieval also loads the BM25 index next to the FAISS index
+    get_chw_retriever().retrieve_hybrid(WARMUP_SYMPTOMS, top_k=1)
+
+
+def _warm_clinical_retriever() -> None:
+    from .rag_retrieval import get_clinical_retriever
+    get_clinical_retriever().retrieve_hybrid(WARMUP_SYMPTOMS, top_k=1)
+
+
+def _warm_parsed_guidelines() -> None:
+    from .parsed_guidelines import find_parsed_evidence, load_parsed_guidelines
+    load_parsed_guidelines()
+    find_parsed_evidence(" ".join(WARMUP_SYMPTOMS), top_k=1)
+
+
+def _warm_llm_clients() -> None:
+    # Building the OpenAI clients imports the SDK (~1s); doing it on the first
+    # request would stall the event loop for every in-flight request
+    from .llm_gateway import get_async_openai_client, get_openai_client
+    get_openai_client()
+    get_async_openai_client()
+
+
+_LOADERS: Dict[str, Callable[[], None]] = {
+    "encoder": _warm_encoder,
+    "chw_retriever": _warm_chw_retriever,
+    "clinical_retriever": _warm_clinical_retriever,
+    "parsed_guidelines": _warm_parsed_guidelines,
+    "llm_clients": _warm_llm_clients,
+}
+
+_state_lock = threading.Lock()
+_components: Dict[str, Dict[str, Any]] = {}
+_preload_thread: threading.Thread | None = None
+
+
+def _set_state(name: str, **fields) -> None:
+    with _state_lock:
+        _components.setdefault(name, {}).update(fields)
+
+
+def _load_component(name: str) -> None:
+    loader = _LOADERS.get(name)
+    if loader is None:
+        print(f"Preload: Unknown component '{name}', skipping.")
+        _set_state(name, state="failed", error="unknown component")
+        return
+
+    _set_state(name, state="loading")
+    start = time.perf_counter()
+    try:
+        loader()
+    except Exception as e:
+        elapsed = time.perf_counter() - start
+        print(f"Preload: {name} failed after {elapsed:.2f}s: {e}")
+        _set_state(name, state="failed", load_seconds=round(elapsed, 2), error=str(e))
+        return
+    elapsed = time.perf_counter() - start
+    print(f"Preload: {name} ready in {elapsed:.2f}s.")
+    _set_state(name, state="ready", load_seconds=round(elapsed, 2), error=None)
+
+
+def _run_preload(components: List[str]) -> None:
+    start = time.perf_counter()
+    for name in components:
+        _load_component(name)
+    print(f"Preload: Finished in {time.perf_counter() - start:.2f}s.")
+    print_registry_report()
+
+
+def start_preload(components: List[str] | None = None) -> bool:
+    """
+    Start loading and warming components in a background thread (once per process).
+
+    Args:
+        components: Component names to load; defaults to PRELOAD_COMPONENTS
+
+    Returns:
+        True if a preload thread is running, False if preloading is disabled
+    """
+    global _preload_thread
+    if not PRELOAD_ON_STARTUP:
+        print("Preload: Disabled (PRELOAD_ON_STARTUP=false); components load on first use.")
+        return False
+
+    components = list(components or PRELOAD_COMPONENTS)
+    with _state_lock:
+        if _preload_thread is not None:
+            return True
+        for name in components:
+            _components[name] = {"state": "pending", "load_seconds": None, "error": None}
+        _preload_thread = threading.Thread(
+            target=_run_preload, args=(components,), name="aidcare-preload", daemon=True,
+        )
+    print(f"Preload: Loading {', '.join(components)} in the background...")
+    _preload_thread.start()
+    return True
+
+
+def get_readiness() -> Dict[str, Any]:
+    """
+    Per-component load state and load time, plus an overall ready flag.
+
+    Ready means every required component is loaded and nothing is still
+    pending or loading. With preloading disabled the app is always ready.
+    """
+    with _state_lock:
+        components = {name: dict(info) for name, info in _components.items()}
+
+    if not PRELOAD_ON_STARTUP:
+        return {"ready": True, "preload_enabled": False, "components": components}
+
+    in_progress = any(info["state"] in ("pending", "loading") for info in components.values())
+    required_ok = all(
+        components.get(name, {}).get("state") == "ready"
+        for name in READY_REQUIRED_COMPONENTS if name in components
+    )
+    for name, info in components.items():
+        info["required"] = name in READY_REQUIRED_COMPONENTS
+    return {
+        "ready": bool(components) and not in_progress and required_ok,
+        "preload_enabled": True,
+        "components": components,
+    }
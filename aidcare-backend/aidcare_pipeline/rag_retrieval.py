@@ -1,14 +1,38 @@
 # aidcare_pipeline/rag_retrieval.py
-import json
+import copy
+import inspect
 import os
+import threading
+import time
 import faiss
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 import numpy as np # faiss returns numpy arrays for distances and indices
-from sentence_transformers import SentenceTransformer
+from datetime import datetime, timezone
 from typing import Dict, List, Any, Optional
+from .embedding_registry import EMBEDDING_BACKEND, get_encoder, print_registry_report
+from .embedding_service import EMBEDDING_SERVICE_SOCKET, RemoteGuidelineRetriever
+from .kb_partitions import Filters, PartitionMap, search_parameters_for
+from .lexical_index import BM25Index, reciprocal_rank_fusion
+from .retrieval_cache import get_retrieval_cache, normalize_symptoms
+from .semantic_cache import get_semantic_cache
+from .kb_store import (
+    MetadataStore,
+    apply_search_params,
+    lexical_index_path_for,
+    load_metadata,
+    partitions_path_for,
+    read_faiss_index,
+    read_kb_manifest,
+    resolve_metadata_path,
+)
 
 # --- Configuration for Model Name (can be overridden by environment variable) ---
 EMBEDDING_MODEL_NAME_RAG = os.getenv("EMBEDDING_MODEL_RAG", 'all-MiniLM-L6-v2')
 
+# Candidates taken from each ranking before reciprocal rank fusion
+HYBRID_CANDIDATES = int(os.getenv("RAG_HYBRID_CANDIDATES", "20"))
+RRF_K = int(os.getenv("RAG_RRF_K", "60"))
+
 # --- Path Definitions ---
 # Determine the project root directory based on the location of this file
 # This assumes rag_retrieval.py is in aidcare_pipeline/, which is in aidcare-backend/
@@ -24,21 +48,76 @@ DEFAULT_CLINICAL_INDEX_PATH = os.path.join(_PROJECT_ROOT, "data", "kb_clinical",
 DEFAULT_CLINICAL_METADATA_PATH = os.path.join(_PROJECT_ROOT, "data", "kb_clinical", "clinical_kb_metadata.json")
 
 
+def _retrieve_cached(scope: tuple, version: Optional[str], mode: str, symptoms_lists: List[list], top_k: int,
+                     filters: Optional[Filters], search) -> List[list]:
+    """
+    Serve each query from the retrieval cache where possible and run search()
+    once for the rest. Queries with the same normalized symptom set share one
+    search, run with the first caller's own list, so a miss searches exactly
+    what an uncached call would.
+    """
+    cache = get_retrieval_cache()
+    if not cache.enabled:
+        return search(symptoms_lists)
+
+    results: List[list] = [[] for _ in symptoms_lists]
+    # normalized symptoms -> positions asking for them (the first one's list is searched)
+    missed: Dict[tuple, List[int]] = {}
+    for position, symptoms in enumerate(symptoms_lists):
+        canonical = normalize_symptoms(symptoms or [])
+        if not canonical:
+            continue
+        if canonical in missed:
+            missed[canonical].append(position)
+            continue
+        cached = cache.get(cache.make_key(scope, version, mode, canonical, top_k, filters))
+        if cached is not None:
+            results[position] = cached
+        else:
+            missed[canonical] = [position]
+
+    if missed:
+        canonicals = list(missed)
+        searched = search([list(symptoms_lists[missed[c][0]]) for c in canonicals])
+        for canonical, entries in zip(canonicals, searched):
+            cache.put(cache.make_key(scope, version, mode, canonical, top_k, filters), entries)
+            for n, position in enumerate(missed[canonical]):
+                results[position] = entries if n == 0 else copy.deepcopy(entries)
+    return results
+
+
 # --- RAG Retriever Class ---
 class GuidelineRetriever:
     def __init__(self, index_path: str, metadata_path: str, model_name: str = EMBEDDING_MODEL_NAME_RAG):
+        self.index_path = index_path
+        self._lexical_index: BM25Index | None = None
+        self._partitions: PartitionMap | None = None
         if not os.path.exists(index_path):
             raise FileNotFoundError(f"FAISS index file not found at: {index_path}")
+        metadata_path = resolve_metadata_path(metadata_path)
         if not os.path.exists(metadata_path):
             raise FileNotFoundError(f"Metadata file not found at: {metadata_path}")
 
         print(f"GuidelineRetriever: Loading FAISS index from: {index_path}")
-        self.index = faiss.read_index(index_path)
+        self.index = read_faiss_index(index_path)
         print(f"GuidelineRetriever: FAISS index loaded. Total vectors: {self.index.ntotal}")
 
+        # Index type and search-time parameters recorded by the KB build scripts
+        self.manifest = read_kb_manifest(index_path)
+        # Identifies the KB build serving a request; falls back to the index file's mtime for older builds
+        self.version = self.manifest.get("built_at") or datetime.fromtimestamp(
+            os.path.getmtime(index_path), timezone.utc
+        ).isoformat()
+        search_params = os.getenv("KB_SEARCH_PARAMS_OVERRIDE") or self.manifest.get("search_params", "")
+        if search_params:
+            apply_search_params(self.index, search_params)
+            print(f"GuidelineRetriever: Applied search params '{search_params}' "
+                  f"(index factory: {self.manifest.get('index_factory', 'unknown')})")
+
         print(f"GuidelineRetriever: Loading metadata from: {metadata_path}")
-        with open(metadata_path, 'r', encoding='utf-8') as f:
-            self.metadata = json.load(f)
+        self.metadata = load_metadata(metadata_path)
+        # The binary store decodes a fresh dict per access; a parsed JSON list must be copied
+        self._metadata_is_shared = not isinstance(self.metadata, MetadataStore)
         print(f"GuidelineRetriever: Metadata loaded. Total entries: {len(self.metadata)}")
 
         if self.index.ntotal == 0:
@@ -47,67 +126,557 @@ class GuidelineRetriever:
             print(f"Warning: Mismatch! FAISS index ({self.index.ntotal} vectors) "
                   f"and metadata ({len(self.metadata)} entries) for paths: {index_path}, {metadata_path}")
 
-        print(f"GuidelineRetriever: Loading sentence transformer model: {model_name}...")
-        self.model = SentenceTransformer(model_name)
-        print(f"GuidelineRetriever: Sentence transformer model '{model_name}' loaded.")
+        # Shared across all retrievers in this process (see embedding_registry)
+        self.model = get_encoder(model_name, consumer=f"GuidelineRetriever:{index_path}")
+        print(f"GuidelineRetriever: Using shared {EMBEDDING_BACKEND} encoder for model '{model_name}'.")
+        built_with = self.manifest.get("embedding_backend", "torch")
+        if self.manifest and built_with != EMBEDDING_BACKEND:
+            print(f"GuidelineRetriever: Note: index built with the {built_with} encoder, queried with "
+                  f"{EMBEDDING_BACKEND}; run scripts/benchmark_encoder_backends.py to check parity.")
 
-    def retrieve_relevant_guidelines(self, symptoms_list: list, top_k: int = 3) -> list:
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal)
+
+    def validate(self) -> None:
+        """
+        Raises:
+            ValueError: If the index is empty or its vector count does not match the metadata
+        """
+        if self.index.ntotal == 0:
+            raise ValueError(f"FAISS index at {self.index_path} is empty.")
+        if self.index.ntotal != len(self.metadata):
+            raise ValueError(f"FAISS index has {self.index.ntotal} vectors but metadata has "
+                             f"{len(self.metadata)} entries ({self.index_path}).")
+
+    @staticmethod
+    def build_query_text(symptoms_list: list) -> str:
+        return f"Patient symptoms: {', '.join(symptoms_list)}."
+
+    def retrieve_relevant_guidelines(self, symptoms_list: list, top_k: int = 3, filters: Optional[Filters] = None) -> list:
         if not symptoms_list:
             print("GuidelineRetriever: Empty symptoms list provided. Cannot retrieve guidelines.")
             return []
+        return self.retrieve_relevant_guidelines_batch([symptoms_list], top_k=top_k, filters=filters)[0]
+
+    def retrieve_relevant_guidelines_batch(self, symptoms_lists: List[list], top_k: int = 3,
+                                           filters: Optional[Filters] = None) -> List[list]:
+        """
+        Retrieve guidelines for many symptom lists with a single encoder forward pass
+        and a single FAISS search.
+
+        Args:
+            symptoms_lists: One symptom list per query (empty lists yield no results)
+            top_k: Number of entries to return per query
+            filters: Optional metadata filters applied inside the search, e.g.
+                {"population": "paediatric"} or {"cadre": "CHEW"} (see kb_partitions)
+
+        Returns:
+            List of result lists, aligned with symptoms_lists (served from the
+            retrieval cache where possible)
+        """
+        return _retrieve_cached(
+            (self.index_path,), self.version, "dense", symptoms_lists, top_k, filters,
+            lambda lists: self._retrieve_dense_batch(lists, top_k, filters),
+        )
+
+    def _retrieve_dense_batch(self, symptoms_lists: List[list], top_k: int, filters: Optional[Filters]) -> List[list]:
+        results: List[list] = [[] for _ in symptoms_lists]
         if self.index.ntotal == 0:
             print("GuidelineRetriever: FAISS index is empty. Cannot retrieve guidelines.")
+            return results
+
+        query_positions = [i for i, symptoms in enumerate(symptoms_lists) if symptoms]
+        if not query_positions:
+            return results
+
+        query_texts = [self.build_query_text(symptoms_lists[i]) for i in query_positions]
+        distances, indices = self._search_dense(query_texts, top_k, filters=filters)
+
+        for row, position in enumerate(query_positions):
+            results[position] = self._entries_for_hits(distances[row], indices[row])
+        return results
+
+    def encode_queries(self, query_texts: List[str]) -> np.ndarray:
+        return self.model.encode(query_texts, convert_to_numpy=True)
+
+    def similarity_scores(self, distances: np.ndarray) -> np.ndarray:
+        """
+        Map raw FAISS scores to cosine similarity so different KBs can be ranked together.
+        Embeddings are L2-normalized, so for the L2 indexes the build scripts create
+        (squared distances) cos = 1 - d / 2; inner-product scores already are cosines.
+        """
+        if self.index.metric_type == faiss.METRIC_INNER_PRODUCT:
+            return distances
+        return 1.0 - distances / 2.0
+
+    def _search_dense(self, query_texts: List[str], k: int, filters: Optional[Filters] = None,
+                      query_embeddings: Optional[np.ndarray] = None):
+        allowed_ids, selector = self.get_partitions().selector(filters)
+        if allowed_ids is not None and len(allowed_ids) == 0:
+            empty = np.zeros((len(query_texts), 0))
+            return empty.astype("float32"), empty.astype("int64")
+
+        if query_embeddings is None:
+            query_embeddings = self.encode_queries(query_texts)
+        # One search for the whole batch; k must not exceed the number of candidates
+        if selector is None:
+            return self.index.search(query_embeddings, k=min(k, self.index.ntotal))
+        # Filtered: the ID selector restricts the scan itself, so no over-fetching
+        return self.index.search(query_embeddings, k=min(k, len(allowed_ids)),
+                                 params=search_parameters_for(self.index, selector))
+
+    def get_partitions(self) -> PartitionMap:
+        """Metadata partitions for filtered search: loaded from the KB build, or built once from metadata."""
+        if self._partitions is None:
+            partitions_path = partitions_path_for(self.index_path)
+            if os.path.exists(partitions_path):
+                print(f"GuidelineRetriever: Loading metadata partitions from: {partitions_path}")
+                self._partitions = PartitionMap.load(partitions_path)
+            else:
+                print("GuidelineRetriever: No partition file found for this KB; building it from metadata...")
+                self._partitions = PartitionMap.from_entries(self.metadata)
+        return self._partitions
+
+    def get_lexical_index(self) -> BM25Index:
+        """BM25 index over the chunk texts: loaded from the KB build, or built once from metadata."""
+        if self._lexical_index is None:
+            lexical_path = lexical_index_path_for(self.index_path)
+            if os.path.exists(lexical_path):
+                print(f"GuidelineRetriever: Loading BM25 lexical index from: {lexical_path}")
+                self._lexical_index = BM25Index.load(lexical_path)
+            else:
+                print("GuidelineRetriever: No BM25 index found for this KB; building it from metadata...")
+                self._lexical_index = BM25Index.from_texts(
+                    entry.get("original_text_chunk", "") for entry in self.metadata
+                )
+        return self._lexical_index
+
+    def retrieve_hybrid(self, symptoms_list: list, top_k: int = 3, filters: Optional[Filters] = None) -> list:
+        if not symptoms_list:
             return []
+        return self.retrieve_hybrid_batch([symptoms_list], top_k=top_k, filters=filters)[0]
+
+    def retrieve_hybrid_batch(self, symptoms_lists: List[list], top_k: int = 3,
+                              filters: Optional[Filters] = None) -> List[list]:
+        """
+        Lexical (BM25) + dense (FAISS) retrieval fused with reciprocal rank fusion.
 
-        query_text = f"Patient symptoms: {', '.join(symptoms_list)}."
-        # print(f"GuidelineRetriever: Constructed query for retrieval: \"{query_text}\"") # Can be verbose
+        Exact drug and disease names are picked up by BM25 even when the dense
+        neighbours miss them. Each entry carries 'fusion_score' plus its
+        'dense_rank' / 'lexical_rank' (None when absent from that ranking).
+        """
+        return _retrieve_cached(
+            (self.index_path,), self.version, "hybrid", symptoms_lists, top_k, filters,
+            lambda lists: self._retrieve_hybrid_batch(lists, top_k, filters),
+        )
 
-        query_embedding = self.model.encode([query_text], convert_to_numpy=True)
-        
-        # print(f"GuidelineRetriever: Searching FAISS index for top {top_k} results...")
-        distances, indices = self.index.search(query_embedding, k=min(top_k, self.index.ntotal)) # Ensure k is not > ntotal
-        
+    def _retrieve_hybrid_batch(self, symptoms_lists: List[list], top_k: int, filters: Optional[Filters]) -> List[list]:
+        results: List[list] = [[] for _ in symptoms_lists]
+        if self.index.ntotal == 0:
+            print("GuidelineRetriever: FAISS index is empty. Cannot retrieve guidelines.")
+            return results
+
+        query_positions = [i for i, symptoms in enumerate(symptoms_lists) if symptoms]
+        if not query_positions:
+            return results
+
+        lexical_index = self.get_lexical_index()
+        allowed = self.get_partitions().allowed_set(filters)
+        query_texts = [self.build_query_text(symptoms_lists[i]) for i in query_positions]
+        distances, indices = self._search_dense(query_texts, max(top_k, HYBRID_CANDIDATES), filters=filters)
+
+        for row, position in enumerate(query_positions):
+            dense_ranking = [int(idx) for idx in indices[row] if idx != -1]
+            dense_distance = {int(idx): float(d) for idx, d in zip(indices[row], distances[row]) if idx != -1}
+            lexical_ranking = [
+                doc_id for doc_id, _ in lexical_index.search(" ".join(symptoms_lists[position]), top_k=HYBRID_CANDIDATES, allowed=allowed)
+            ]
+
+            entries = []
+            for doc_id, fused_score in reciprocal_rank_fusion([dense_ranking, lexical_ranking], k=RRF_K)[:top_k]:
+                if not 0 <= doc_id < len(self.metadata):
+                    continue
+                entry = self.metadata[doc_id]
+                if self._metadata_is_shared:
+                    entry = entry.copy()
+                entry['retrieval_score (distance)'] = dense_distance.get(doc_id)
+                entry['fusion_score'] = fused_score
+                entry['dense_rank'] = dense_ranking.index(doc_id) + 1 if doc_id in dense_distance else None
+                entry['lexical_rank'] = lexical_ranking.index(doc_id) + 1 if doc_id in lexical_ranking else None
+                entries.append(entry)
+            results[position] = entries
+        return results
+
+    def _entries_for_hits(self, distances: np.ndarray, indices: np.ndarray) -> list:
         retrieved_entries = []
-        if indices.size > 0:
-            for i in range(indices.shape[1]): # Iterate through the number of results found for the query
-                retrieved_idx = indices[0][i]
-                if 0 <= retrieved_idx < len(self.metadata):
-                    entry_metadata = self.metadata[retrieved_idx].copy() # Return a copy to avoid modifying cached metadata
-                    entry_metadata['retrieval_score (distance)'] = float(distances[0][i])
-                    retrieved_entries.append(entry_metadata)
-                else:
-                    print(f"GuidelineRetriever Warning: Retrieved index {retrieved_idx} is out of bounds for metadata (size {len(self.metadata)}).")
-        
-        # print(f"GuidelineRetriever: Retrieved {len(retrieved_entries)} guideline entries.")
+        for distance, retrieved_idx in zip(distances, indices):
+            if 0 <= retrieved_idx < len(self.metadata):
+                entry_metadata = self.metadata[retrieved_idx]
+                if self._metadata_is_shared:
+                    entry_metadata = entry_metadata.copy() # Return a copy to avoid modifying cached metadata
+                entry_metadata['retrieval_score (distance)'] = float(distance)
+                retrieved_entries.append(entry_metadata)
+            elif retrieved_idx != -1:
+                print(f"GuidelineRetriever Warning: Retrieved index {retrieved_idx} is out of bounds for metadata (size {len(self.metadata)}).")
         return retrieved_entries
 
 # --- Global Instances for Singleton Pattern (loaded once per application lifecycle) ---
 chw_retriever_instance: GuidelineRetriever | None = None
 clinical_retriever_instance: GuidelineRetriever | None = None
+# The startup preloader and request handlers may ask for a retriever at the same time
+_retriever_init_lock = threading.Lock()
+
+# kind -> (label, index path env var, default index path, metadata path env var, default metadata path)
+_RETRIEVER_SOURCES = {
+    "chw": ("CHW", "CHW_FAISS_INDEX_PATH", DEFAULT_CHW_INDEX_PATH, "CHW_METADATA_PATH", DEFAULT_CHW_METADATA_PATH),
+    "clinical": ("Clinical Support", "CLINICAL_FAISS_INDEX_PATH", DEFAULT_CLINICAL_INDEX_PATH,
+                 "CLINICAL_METADATA_PATH", DEFAULT_CLINICAL_METADATA_PATH),
+}
+RETRIEVER_KINDS = tuple(_RETRIEVER_SOURCES)
+
+# With an embedding service configured, retrievers are thin clients of that process
+_service_socket = EMBEDDING_SERVICE_SOCKET
+
+
+def serve_retrievers_locally() -> None:
+    """Load indexes in this process even if EMBEDDING_SERVICE_SOCKET is set (used by the service itself)."""
+    global _service_socket
+    _service_socket = ""
+
+
+def _load_retriever(kind: str) -> GuidelineRetriever:
+    if _service_socket:
+        return RemoteGuidelineRetriever(kind)
+    label, index_env, default_index, meta_env, default_meta = _RETRIEVER_SOURCES[kind]
+    print(f"Initializing {label} GuidelineRetriever instance...")
+    # Use environment variables for paths if set, otherwise use defaults
+    idx_path = os.getenv(index_env, default_index)
+    meta_path = os.getenv(meta_env, default_meta)
+    print(f"{label} Retriever will use index: {idx_path}, metadata: {meta_path}")
+    retriever = GuidelineRetriever(index_path=idx_path, metadata_path=meta_path)
+    print_registry_report()
+    return retriever
+
+
+def _current_retriever(kind: str) -> GuidelineRetriever | None:
+    return chw_retriever_instance if kind == "chw" else clinical_retriever_instance
+
+
+def _set_retriever(kind: str, retriever: GuidelineRetriever) -> None:
+    global chw_retriever_instance, clinical_retriever_instance
+    # A single reference assignment: searches already holding the old retriever finish on it
+    if kind == "chw":
+        chw_retriever_instance = retriever
+    else:
+        clinical_retriever_instance = retriever
+
+
+def get_retriever(kind: str) -> GuidelineRetriever:
+    """Return the current retriever for kind ('chw' or 'clinical'), loading it on first use."""
+    retriever = _current_retriever(kind)
+    if retriever is not None:
+        return retriever
+    with _retriever_init_lock:
+        retriever = _current_retriever(kind)
+        if retriever is None:
+            retriever = _load_retriever(kind)
+            _set_retriever(kind, retriever)
+    return retriever
 
 def get_chw_retriever() -> GuidelineRetriever:
-    global chw_retriever_instance
-    if chw_retriever_instance is None:
-        print("Initializing CHW GuidelineRetriever instance...")
-        # Use environment variables for paths if set, otherwise use defaults
-        idx_path = os.getenv("CHW_FAISS_INDEX_PATH", DEFAULT_CHW_INDEX_PATH)
-        meta_path = os.getenv("CHW_METADATA_PATH", DEFAULT_CHW_METADATA_PATH)
-        print(f"CHW Retriever will use index: {idx_path}, metadata: {meta_path}")
-        chw_retriever_instance = GuidelineRetriever(index_path=idx_path, metadata_path=meta_path)
-    return chw_retriever_instance
+    return get_retriever("chw")
 
 def get_clinical_retriever() -> GuidelineRetriever:
-    global clinical_retriever_instance
-    if clinical_retriever_instance is None:
-        print("Initializing Clinical Support GuidelineRetriever instance...")
-        idx_path = os.getenv("CLINICAL_FAISS_INDEX_PATH", DEFAULT_CLINICAL_INDEX_PATH)
-        meta_path = os.getenv("CLINICAL_METADATA_PATH", DEFAULT_CLINICAL_METADATA_PATH)
-        print(f"Clinical Retriever will use index: {idx_path}, metadata: {meta_path}")
-        clinical_retriever_instance = GuidelineRetriever(index_path=idx_path, metadata_path=meta_path)
-    return clinical_retriever_instance
+    return get_retriever("clinical")
+
+
+# --- Hot-swap reload ---
+# A rebuilt KB is loaded next to the live one, validated, warmed and then swapped
+# in; requests keep using the old retriever until the swap and never wait on it.
+
+_reload_lock = threading.Lock()
+_reload_status: Dict[str, Dict[str, Any]] = {}
+
+
+def _run_reload(kind: str) -> None:
+    start = time.perf_counter()
+    try:
+        retriever = _load_retriever(kind)
+        retriever.validate()
+        retriever.retrieve_hybrid(["fever", "cough"], top_k=1)  # warm the encoder path and BM25 index
+    except Exception as e:
+        print(f"KB Reload: {kind} reload failed, keeping the current index: {e}")
+        with _reload_lock:
+            _reload_status[kind].update(state="failed", error=str(e),
+                                        seconds=round(time.perf_counter() - start, 2))
+        return
+
+    previous = _current_retriever(kind)
+    _set_retriever(kind, retriever)
+    # Keys carry the version, so old results could not be served anyway; this frees them
+    cache = get_retrieval_cache()
+    dropped = cache.invalidate(retriever.index_path)
+    if previous is not None and previous.index_path != retriever.index_path:
+        dropped += cache.invalidate(previous.index_path)
+    if previous is not None and previous.version != retriever.version:
+        dropped += get_semantic_cache().invalidate(previous.version)
+    print(f"KB Reload: {kind} swapped to version {retriever.version} "
+          f"({retriever.ntotal} vectors) in {time.perf_counter() - start:.2f}s; "
+          f"dropped {dropped} cached results")
+    with _reload_lock:
+        _reload_status[kind].update(
+            state="swapped", error=None, seconds=round(time.perf_counter() - start, 2),
+            previous_version=previous.version if previous is not None else None,
+            version=retriever.version, ntotal=retriever.ntotal,
+        )
+
+
+def reload_retriever(kind: str) -> Dict[str, Any]:
+    """
+    Start reloading a retriever's index and metadata from disk in the background.
+
+    Args:
+        kind: 'chw' or 'clinical'
+
+    Returns:
+        The reload status for kind; a reload already in progress is not restarted
+
+    Raises:
+        ValueError: If kind is unknown
+    """
+    if kind not in _RETRIEVER_SOURCES:
+        raise ValueError(f"Unknown knowledge base '{kind}'. Expected one of: {', '.join(RETRIEVER_KINDS)}")
+    if _service_socket:
+        # The service owns the indexes and swaps them itself
+        return get_retriever(kind).reload()
+    with _reload_lock:
+        status = _reload_status.get(kind)
+        if status and status["state"] == "loading":
+            return dict(status)
+        current = _current_retriever(kind)
+        _reload_status[kind] = {
+            "state": "loading",
+            "started_at": datetime.now(timezone.utc).isoformat(),
+            "previous_version": current.version if current is not None else None,
+        }
+        threading.Thread(target=_run_reload, args=(kind,), name=f"kb-reload-{kind}", daemon=True).start()
+        return dict(_reload_status[kind])
+
+
+def get_retriever_status() -> Dict[str, Any]:
+    """Loaded version and last reload outcome for each knowledge base."""
+    if _service_socket:
+        return get_retriever(RETRIEVER_KINDS[0]).client.request({"op": "status"})["status"]
+    with _reload_lock:
+        reloads = {kind: dict(status) for kind, status in _reload_status.items()}
+    status = {}
+    for kind in RETRIEVER_KINDS:
+        retriever = _current_retriever(kind)
+        status[kind] = {
+            "loaded": retriever is not None,
+            "version": retriever.version if retriever is not None else None,
+            "ntotal": retriever.ntotal if retriever is not None else None,
+            "index_factory": retriever.manifest.get("index_factory") if retriever is not None else None,
+            "last_reload": reloads.get(kind),
+            "served_by": _service_socket or "in-process",
+        }
+    return status
+
+
+def get_retrieval_cache_stats() -> Dict[str, Any]:
+    """Hit-rate counters of the retrieval result cache (the embedding service's, when one is used)."""
+    if _service_socket:
+        return get_retriever(RETRIEVER_KINDS[0]).client.request({"op": "cache_stats"})["stats"]
+    return get_retrieval_cache().get_stats()
+
+
+# --- Federated search across knowledge bases ---
+
+def _dedupe_key(entry: Dict[str, Any]) -> str:
+    return " ".join((entry.get("original_text_chunk") or "").lower().split())
+
+
+class FederatedRetriever:
+    """
+    Searches several knowledge bases as one: the query is encoded once, every
+    index is searched with that vector, scores are mapped to cosine similarity
+    (see GuidelineRetriever.similarity_scores) and the hits are merged into a
+    single ranking. Chunks that appear in more than one KB (the CHO/CHEW
+    standing orders are in both) are kept once, at their best score.
+
+    Each returned entry carries 'federated_score', 'kb' (the KB of the best
+    hit) and 'provenance': one {kb, version, rank, score} record per KB that
+    returned the chunk. The retrieve_* methods match GuidelineRetriever's, so a
+    FederatedRetriever can be handed to HybridKnowledgeRetriever or
+    RetrievalBatcher in place of a single KB.
+    """
+
+    def __init__(self, kinds: Optional[List[str]] = None, weights: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            kinds: Registered KBs to search (defaults to all of RETRIEVER_KINDS)
+            weights: Optional per-KB score multipliers, e.g. {"chw": 1.0, "clinical": 0.9}
+
+        Raises:
+            ValueError: If a kind is unknown
+        """
+        self.kinds = list(kinds or RETRIEVER_KINDS)
+        for kind in self.kinds:
+            if kind not in _RETRIEVER_SOURCES:
+                raise ValueError(f"Unknown knowledge base '{kind}'. Expected one of: {', '.join(RETRIEVER_KINDS)}")
+        self.weights = {kind: 1.0 for kind in self.kinds}
+        self.weights.update(weights or {})
+
+    @property
+    def version(self) -> str:
+        # Resolved per call so hot-swapped KBs are reflected
+        return ",".join(f"{kind}:{get_retriever(kind).version}" for kind in self.kinds)
+
+    @property
+    def ntotal(self) -> int:
+        return sum(get_retriever(kind).ntotal for kind in self.kinds)
+
+    def retrieve_relevant_guidelines(self, symptoms_list: list, top_k: int = 3, filters: Optional[Filters] = None) -> list:
+        if not symptoms_list:
+            return []
+        return self.retrieve_relevant_guidelines_batch([symptoms_list], top_k=top_k, filters=filters)[0]
+
+    def retrieve_relevant_guidelines_batch(self, symptoms_lists: List[list], top_k: int = 3,
+                                           filters: Optional[Filters] = None) -> List[list]:
+        """
+        Args:
+            symptoms_lists: One symptom list per query (empty lists yield no results)
+            top_k: Number of merged entries to return per query
+            filters: Metadata filters applied within every KB (see kb_partitions)
+
+        Returns:
+            List of merged result lists, aligned with symptoms_lists
+
+        Raises:
+            ValueError: If some of the KBs are served by the embedding service and others locally
+        """
+        retrievers = {kind: get_retriever(kind) for kind in self.kinds}
+        remote = [kind for kind, r in retrievers.items() if isinstance(r, RemoteGuidelineRetriever)]
+        if remote and len(remote) != len(retrievers):
+            # Local federation needs raw scores and vectors, which remote retrievers do not expose
+            raise ValueError(f"Cannot federate KBs served by the embedding service ({', '.join(remote)}) "
+                             f"with locally loaded ones; serve all of {', '.join(self.kinds)} from one place.")
+        if remote:
+            # The embedding service holds every index; let it federate (and cache) in one round trip
+            client = next(iter(retrievers.values())).client
+            return client.request({
+                "op": "federated", "kinds": self.kinds, "weights": self.weights,
+                "symptoms_lists": symptoms_lists, "top_k": top_k, "filters": filters,
+            })["results"]
+
+        scope = tuple(retriever.index_path for retriever in retrievers.values())
+        version = ",".join(f"{kind}:{retriever.version}" for kind, retriever in retrievers.items())
+        mode = "federated:" + ",".join(f"{kind}={weight}" for kind, weight in sorted(self.weights.items()))
+        return _retrieve_cached(
+            scope, version, mode, symptoms_lists, top_k, filters,
+            lambda lists: self._retrieve_batch(retrievers, lists, top_k, filters),
+        )
+
+    def _retrieve_batch(self, retrievers: Dict[str, GuidelineRetriever], symptoms_lists: List[list], top_k: int,
+                        filters: Optional[Filters]) -> List[list]:
+        results: List[list] = [[] for _ in symptoms_lists]
+        query_positions = [i for i, symptoms in enumerate(symptoms_lists) if symptoms]
+        if not query_positions:
+            return results
+
+        # Over-fetch per KB so cross-KB duplicates don't leave the merged list short
+        per_kb_k = top_k * 2
+        query_texts = [GuidelineRetriever.build_query_text(symptoms_lists[i]) for i in query_positions]
+        embeddings_by_model: Dict[int, np.ndarray] = {}
+        hits_by_kb: Dict[str, List[list]] = {}
+        for kind, retriever in retrievers.items():
+            if retriever.ntotal == 0:
+                hits_by_kb[kind] = [[] for _ in query_positions]
+                continue
+            # KBs sharing an encoder (the usual case) share one forward pass
+            model_key = id(retriever.model)
+            if model_key not in embeddings_by_model:
+                embeddings_by_model[model_key] = retriever.encode_queries(query_texts)
+            distances, indices = retriever._search_dense(
+                query_texts, per_kb_k, filters=filters, query_embeddings=embeddings_by_model[model_key],
+            )
+            scores = retriever.similarity_scores(distances)
+            hits_by_kb[kind] = []
+            for row in range(len(query_positions)):
+                valid = [0 <= idx < len(retriever.metadata) for idx in indices[row]]
+                entries = retriever._entries_for_hits(distances[row], indices[row])
+                hits_by_kb[kind].append(list(zip(entries, (float(s) for s, ok in zip(scores[row], valid) if ok))))
+
+        versions = {kind: retriever.version for kind, retriever in retrievers.items()}
+        for row, position in enumerate(query_positions):
+            results[position] = self._merge({kind: hits[row] for kind, hits in hits_by_kb.items()}, versions, top_k)
+        return results
+
+    def _merge(self, hits_by_kb: Dict[str, list], versions: Dict[str, str], top_k: int) -> list:
+        merged: Dict[str, Dict[str, Any]] = {}
+        for kind, hits in hits_by_kb.items():
+            for rank, (entry, score) in enumerate(hits, start=1):
+                weighted = score * self.weights.get(kind, 1.0)
+                provenance = {"kb": kind, "version": versions[kind], "rank": rank, "score": round(score, 6)}
+                key = _dedupe_key(entry) or f"{kind}:{rank}"
+                best = merged.get(key)
+                if best is not None:
+                    provenance_list = best['provenance'] + [provenance]
+                    if weighted <= best['federated_score']:
+                        best['provenance'] = provenance_list
+                        continue
+                else:
+                    provenance_list = [provenance]
+                entry['federated_score'] = weighted
+                entry['kb'] = kind
+                entry['provenance'] = provenance_list
+                merged[key] = entry
+        return sorted(merged.values(), key=lambda e: e['federated_score'], reverse=True)[:top_k]
+
+
+def get_federated_retriever(kinds: Optional[List[str]] = None,
+                            weights: Optional[Dict[str, float]] = None) -> FederatedRetriever:
+    """Federated view over the registered KBs; cheap to create, the underlying retrievers are shared."""
+    return FederatedRetriever(kinds=kinds, weights=weights)
 
 
 # --- Hybrid Knowledge Retriever (FAISS + Valyu) ---
+# Per-source deadlines for HybridKnowledgeRetriever.retrieve_multi_source, in seconds
+LOCAL_SOURCE_TIMEOUT_SECONDS = float(os.getenv("HYBRID_LOCAL_TIMEOUT_SECONDS", "10"))
+EXTERNAL_SOURCE_TIMEOUT_SECONDS = float(os.getenv("HYBRID_SOURCE_TIMEOUT_SECONDS", "4"))
+# Shared by all hybrid retrievers. External sources get their own pool, so slow
+# remote calls can never queue the local FAISS searches behind them.
+_fanout_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HYBRID_FANOUT_WORKERS", "16")), thread_name_prefix="hybrid-source",
+)
+_local_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv("HYBRID_LOCAL_WORKERS", "4")), thread_name_prefix="hybrid-local",
+)
+
+
+def _timed_call(call, deadline: float):
+    """Run call with the seconds left until deadline (time.monotonic()); returns (result, seconds taken)."""
+    started = time.perf_counter()
+    return call(deadline - time.monotonic()), time.perf_counter() - started
+
+
+def _source_call(method, **kwargs):
+    """
+    Bind an external searcher method for _fan_out. A searcher that accepts a
+    timeout keyword is given the time left to the source's deadline, so an
+    abandoned call ends at the deadline instead of holding a pool thread; a
+    call still queued when its deadline passes is not started.
+    """
+    takes_timeout = "timeout" in inspect.signature(method).parameters
+
+    def call(remaining: float):
+        if remaining <= 0:
+            raise FutureTimeoutError()
+        return method(**kwargs, timeout=remaining) if takes_timeout else method(**kwargs)
+    return call
+
+
 class HybridKnowledgeRetriever:
     """
     Intelligent hybrid retrieval combining local FAISS and Valyu AI-native search
@@ -121,14 +690,20 @@ class HybridKnowledgeRetriever:
     def __init__(
         self,
         faiss_retriever: GuidelineRetriever,
-        valyu_searcher: Optional[Any] = None
+        valyu_searcher: Optional[Any] = None,
+        source_timeouts: Optional[Dict[str, float]] = None,
     ):
         """
         Initialize hybrid retriever
 
         Args:
-            faiss_retriever: Local FAISS retriever instance
-            valyu_searcher: Valyu searcher instance (optional)
+            faiss_retriever: Local FAISS retriever instance, or a FederatedRetriever
+                to search several local KBs as one
+            valyu_searcher: Valyu searcher instance (optional); OfflineKnowledgeSearcher
+                (aidcare_pipeline.offline_searcher) provides the same interface without network access.
+                Search methods that take a timeout keyword get the time left to the source's deadline.
+            source_timeouts: Optional per-source deadlines in seconds, keyed by
+                "local_guidelines", "literature", "guidelines" or "drugs"
         """
         self.faiss_retriever = faiss_retriever
         self.valyu_searcher = valyu_searcher
@@ -138,6 +713,15 @@ class HybridKnowledgeRetriever:
         self.valyu_usage_rate = float(os.getenv("VALYU_USAGE_RATE", "0.2"))  # 20% of queries
         self.query_count = 0
 
+        self.source_timeouts = {
+            "local_guidelines": LOCAL_SOURCE_TIMEOUT_SECONDS,
+            "literature": EXTERNAL_SOURCE_TIMEOUT_SECONDS,
+            "guidelines": EXTERNAL_SOURCE_TIMEOUT_SECONDS,
+            "drugs": EXTERNAL_SOURCE_TIMEOUT_SECONDS,
+        }
+        self.source_timeouts.update(source_timeouts or {})
+        self.timeout_counts: Dict[str, int] = {}
+
         print(f"HybridKnowledgeRetriever initialized (Valyu {'enabled' if self.valyu_enabled else 'disabled'})")
 
     def should_use_valyu(self, symptoms: List[str], mode: str = "chw") -> bool:
@@ -183,6 +767,11 @@ class HybridKnowledgeRetriever:
         """
         Retrieve knowledge from multiple sources (FAISS + Valyu)
 
+        The local FAISS search and the Valyu searches run concurrently, each under
+        its own deadline (source_timeouts), so latency is that of the slowest
+        source rather than the sum. Sources that miss their deadline or fail
+        are left out of the result and listed in timed_out_sources / failed_sources.
+
         Args:
             symptoms: List of symptoms/conditions
             mode: Triage mode ("chw" or "clinical")
@@ -194,14 +783,42 @@ class HybridKnowledgeRetriever:
             - valyu_results: Valyu search results (if used)
             - merged_context: Formatted context for LLM
             - knowledge_sources: Source statistics
+            - timed_out_sources / failed_sources: Sources left out of this response
+            - source_latency_ms: Time each completed source took
         """
         print(f"HybridRetriever: Retrieving for symptoms={symptoms}, mode={mode}")
+        start = time.monotonic()
 
         # Always get FAISS results (local, fast)
-        faiss_results = self.faiss_retriever.retrieve_relevant_guidelines(
-            symptoms_list=symptoms,
-            top_k=top_k
-        )
+        calls = {
+            "local_guidelines": lambda remaining: self.faiss_retriever.retrieve_relevant_guidelines(
+                symptoms_list=symptoms,
+                top_k=top_k
+            )
+        }
+
+        # Determine if we should use Valyu
+        use_valyu = self.should_use_valyu(symptoms, mode)
+        if use_valyu and self.valyu_searcher:
+            print("HybridRetriever: Querying Valyu for enrichment...")
+            # Search medical literature
+            calls["literature"] = _source_call(self.valyu_searcher.search_medical_literature, query_terms=symptoms)
+            # Search clinical guidelines
+            calls["guidelines"] = _source_call(self.valyu_searcher.search_clinical_guidelines, symptoms=symptoms)
+            # For clinical mode or if drugs mentioned, search drug info
+            if mode == "clinical" or any(
+                term in " ".join(symptoms).lower()
+                for term in ["drug", "medication", "medicine", "pill"]
+            ):
+                calls["drugs"] = _source_call(
+                    self.valyu_searcher.search_drug_information,
+                    drug_names=symptoms  # Will be refined in actual usage
+                )
+        else:
+            print("HybridRetriever: Using FAISS only (Valyu not triggered)")
+
+        outcomes = self._fan_out(calls, start)
+        faiss_results = outcomes["results"].get("local_guidelines", [])
 
         # Initialize response
         response = {
@@ -210,73 +827,97 @@ class HybridKnowledgeRetriever:
             "merged_context": "",
             "knowledge_sources": {
                 "local_guidelines": len(faiss_results),
+                "local_sources": self._local_source_counts(faiss_results),
                 "pubmed_research": 0,
                 "drug_databases": 0,
                 "clinical_trials": 0
-            }
+            },
+            "timed_out_sources": outcomes["timed_out"],
+            "failed_sources": outcomes["failed"],
+            "source_latency_ms": outcomes["latency_ms"],
         }
 
-        # Determine if we should use Valyu
-        use_valyu = self.should_use_valyu(symptoms, mode)
+        external = {name: outcomes["results"][name] for name in ("literature", "guidelines", "drugs")
+                    if name in outcomes["results"]}
+        if external:
+            literature_results = external.get("literature", [])
+            guideline_results = external.get("guidelines", [])
+            drug_results = external.get("drugs", [])
+
+            # Store Valyu results
+            response["valyu_results"] = {
+                "literature": literature_results,
+                "guidelines": guideline_results,
+                "drugs": drug_results
+            }
 
-        if use_valyu and self.valyu_searcher:
-            print("HybridRetriever: Querying Valyu for enrichment...")
+            # Update source counts
+            response["knowledge_sources"]["pubmed_research"] = len(literature_results)
+            response["knowledge_sources"]["drug_databases"] = len(drug_results)
+            response["knowledge_sources"]["clinical_trials"] = len(guideline_results)
 
             try:
-                # Search medical literature
-                literature_results = self.valyu_searcher.search_medical_literature(
-                    query_terms=symptoms
-                )
-
-                # Search clinical guidelines
-                guideline_results = self.valyu_searcher.search_clinical_guidelines(
-                    symptoms=symptoms
-                )
-
-                # For clinical mode or if drugs mentioned, search drug info
-                drug_results = []
-                if mode == "clinical" or any(
-                    term in " ".join(symptoms).lower()
-                    for term in ["drug", "medication", "medicine", "pill"]
-                ):
-                    drug_results = self.valyu_searcher.search_drug_information(
-                        drug_names=symptoms  # Will be refined in actual usage
-                    )
-
-                # Store Valyu results
-                response["valyu_results"] = {
-                    "literature": literature_results,
-                    "guidelines": guideline_results,
-                    "drugs": drug_results
-                }
-
-                # Update source counts
-                response["knowledge_sources"]["pubmed_research"] = len(literature_results)
-                response["knowledge_sources"]["drug_databases"] = len(drug_results)
-                response["knowledge_sources"]["clinical_trials"] = len(guideline_results)
-
                 # Format for LLM context
-                valyu_context = self.valyu_searcher.format_for_gemini(response["valyu_results"])
-                response["merged_context"] = valyu_context
-
-                print(f"HybridRetriever: Valyu enrichment added ({len(literature_results)} articles, "
-                      f"{len(drug_results)} drugs, {len(guideline_results)} guidelines)")
-
+                response["merged_context"] = self.valyu_searcher.format_for_gemini(response["valyu_results"])
             except Exception as e:
-                print(f"HybridRetriever: Valyu query failed (graceful fallback): {e}")
-                # Graceful degradation - continue with FAISS only
+                print(f"HybridRetriever: Could not format Valyu results (graceful fallback): {e}")
 
-        else:
-            print("HybridRetriever: Using FAISS only (Valyu not triggered)")
+            print(f"HybridRetriever: Valyu enrichment added ({len(literature_results)} articles, "
+                  f"{len(drug_results)} drugs, {len(guideline_results)} guidelines)")
 
+        print(f"HybridRetriever: Done in {(time.monotonic() - start) * 1000:.0f} ms"
+              + (f"; timed out: {', '.join(outcomes['timed_out'])}" if outcomes["timed_out"] else ""))
         return response
 
+    def _fan_out(self, calls: Dict[str, Any], start: float) -> Dict[str, Any]:
+        """
+        Run every source call concurrently (the local search on its own pool,
+        external ones on the shared fan-out pool) and collect what finishes
+        before each source's deadline (measured from start). Each call is given
+        the time left to its deadline; results that arrive later are dropped.
+        """
+        deadlines = {name: start + self.source_timeouts.get(name, EXTERNAL_SOURCE_TIMEOUT_SECONDS) for name in calls}
+        futures = {
+            name: (_local_executor if name == "local_guidelines" else _fanout_executor).submit(
+                _timed_call, call, deadlines[name]
+            )
+            for name, call in calls.items()
+        }
+        outcomes: Dict[str, Any] = {"results": {}, "timed_out": [], "failed": [], "latency_ms": {}}
+        for name in sorted(futures, key=deadlines.get):
+            try:
+                result, seconds = futures[name].result(timeout=max(0.0, deadlines[name] - time.monotonic()))
+            except (FutureTimeoutError, TimeoutError):
+                futures[name].cancel()
+                outcomes["timed_out"].append(name)
+                self.timeout_counts[name] = self.timeout_counts.get(name, 0) + 1
+                print(f"HybridRetriever: '{name}' missed its {self.source_timeouts.get(name)}s deadline; skipping it")
+                continue
+            except Exception as e:
+                outcomes["failed"].append(name)
+                print(f"HybridRetriever: '{name}' query failed (graceful fallback): {e}")
+                continue
+            outcomes["results"][name] = result
+            outcomes["latency_ms"][name] = round(seconds * 1000, 1)
+        return outcomes
+
+    @staticmethod
+    def _local_source_counts(faiss_results: list) -> Dict[str, int]:
+        """Hits per KB; federated results record their KB, single-KB results count as 'local'."""
+        counts: Dict[str, int] = {}
+        for entry in faiss_results:
+            kb = entry.get("kb", "local")
+            counts[kb] = counts.get(kb, 0) + 1
+        return counts
+
     def get_stats(self) -> Dict[str, Any]:
         """Get retrieval statistics"""
         stats = {
             "valyu_enabled": self.valyu_enabled,
             "query_count": self.query_count,
-            "valyu_usage_rate": self.valyu_usage_rate
+            "valyu_usage_rate": self.valyu_usage_rate,
+            "source_timeouts": self.source_timeouts,
+            "timeout_counts": dict(self.timeout_counts)
         }
 
         if self.valyu_searcher:
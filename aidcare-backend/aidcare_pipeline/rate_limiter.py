@@ -2,17 +2,19 @@
 """
 Rate limiting and caching to protect against high Gemini API usage
 """
-import time
+import asyncio
+import inspect
 import hashlib
 import json
-from collections import defaultdict
 from functools import wraps
 from typing import Dict, Any, Optional
 import os
 
-# Simple in-memory cache (use Redis in production)
-_cache: Dict[str, tuple[Any, float]] = {}
-_request_counts: Dict[str, list[float]] = defaultdict(list)
+from .cache_backends import get_cache_backend
+
+# Cached responses and request counters live in a pluggable backend (see
+# cache_backends.py): per-process memory by default, or SQLite / Redis shared by
+# all workers and kept across restarts
 
 # Configuration
 CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "3600"))  # 1 hour default
@@ -50,50 +52,34 @@ def check_rate_limit(identifier: str = "global") -> None:
     Raises:
         RateLimitExceeded: If rate limit is exceeded
     """
-    current_time = time.time()
-
-    # Clean up old entries
-    _request_counts[identifier] = [
-        t for t in _request_counts[identifier]
-        if current_time - t < 86400  # Keep last 24 hours
-    ]
-
-    # Check per-minute limit
-    recent_requests = [
-        t for t in _request_counts[identifier]
-        if current_time - t < 60
-    ]
-
-    if len(recent_requests) >= MAX_REQUESTS_PER_MINUTE:
-        retry_after = 60 - (current_time - recent_requests[0])
-        raise RateLimitExceeded(retry_after)
+    # Checks the per-minute and per-day limits and records this request in one step
+    try:
+        retry_after = get_cache_backend().acquire(identifier, MAX_REQUESTS_PER_MINUTE, MAX_REQUESTS_PER_DAY)
+    except Exception as e:
+        # An unreachable shared backend must not take the LLM features down with it
+        print(f"Rate limit check skipped, cache backend error: {e}")
+        return
 
-    # Check per-day limit
-    if len(_request_counts[identifier]) >= MAX_REQUESTS_PER_DAY:
-        oldest_request = _request_counts[identifier][0]
-        retry_after = 86400 - (current_time - oldest_request)
+    if retry_after is not None:
         raise RateLimitExceeded(retry_after)
 
-    # Record this request
-    _request_counts[identifier].append(current_time)
-
 
 def get_from_cache(key: str) -> Optional[Any]:
     """Retrieve value from cache if not expired"""
     if not ENABLE_CACHING:
         return None
 
-    if key in _cache:
-        value, expiry = _cache[key]
-        if time.time() < expiry:
-            print(f"Cache HIT for key: {key[:16]}...")
-            return value
-        else:
-            # Expired, remove it
-            del _cache[key]
-            print(f"Cache EXPIRED for key: {key[:16]}...")
+    try:
+        value, expired = get_cache_backend().get(key)
+    except Exception as e:
+        print(f"Cache read failed for key: {key[:16]}...: {e}")
+        return None
 
-    return None
+    if value is not None:
+        print(f"Cache HIT for key: {key[:16]}...")
+    elif expired:
+        print(f"Cache EXPIRED for key: {key[:16]}...")
+    return value
 
 
 def set_in_cache(key: str, value: Any, ttl: int = CACHE_TTL_SECONDS) -> None:
@@ -101,100 +87,106 @@ def set_in_cache(key: str, value: Any, ttl: int = CACHE_TTL_SECONDS) -> None:
     if not ENABLE_CACHING:
         return
 
-    expiry = time.time() + ttl
-    _cache[key] = (value, expiry)
+    try:
+        get_cache_backend().set(key, value, ttl)
+    except Exception as e:
+        print(f"Cache write failed for key: {key[:16]}...: {e}")
+        return
     print(f"Cache SET for key: {key[:16]}... (TTL: {ttl}s)")
 
-    # Basic cache size management
-    if len(_cache) > 1000:
-        # Remove oldest 10% when cache gets too large
-        sorted_items = sorted(_cache.items(), key=lambda x: x[1][1])
-        for k, _ in sorted_items[:100]:
-            del _cache[k]
 
-
-def cached_gemini_call(ttl: int = CACHE_TTL_SECONDS, rate_limit_id: str = "global"):
+def cached_gemini_call(ttl: int = CACHE_TTL_SECONDS, rate_limit_id: str = "global", cache_name: Optional[str] = None):
     """
-    Decorator for Gemini API calls with caching and rate limiting
+    Decorator for Gemini API calls with caching and rate limiting.
+    Works on both regular and async functions.
 
     Args:
         ttl: Time-to-live for cache in seconds
         rate_limit_id: Identifier for rate limiting
+        cache_name: Name used in the cache key (default: the function's name);
+            lets an async variant share cached results with its sync counterpart
     """
     def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
+        name = cache_name or func.__name__
+
+        def before_call(args, kwargs):
+            """Returns (cache_key, early_result); early_result is a cache hit or a rate-limit error."""
             # Generate cache key
-            cache_key = generate_cache_key(func.__name__, *args, **kwargs)
+            cache_key = generate_cache_key(name, *args, **kwargs)
 
             # Try to get from cache first
             cached_result = get_from_cache(cache_key)
             if cached_result is not None:
-                return cached_result
+                return cache_key, cached_result
 
             # Check rate limit before making API call
             try:
                 check_rate_limit(rate_limit_id)
             except RateLimitExceeded as e:
                 print(f"Rate limit exceeded for {func.__name__}: {e}")
-                return {
+                return cache_key, {
                     "error": f"Rate limit exceeded. Please try again in {e.retry_after:.0f} seconds.",
                     "retry_after": e.retry_after
                 }
+            return cache_key, None
 
-            # Make the actual API call
-            result = func(*args, **kwargs)
-
+        def after_call(cache_key, result):
             # Only cache successful results (not errors)
             if result and not (isinstance(result, dict) and "error" in result):
                 set_in_cache(cache_key, result, ttl)
-
             return result
 
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                # The SQLite and Redis backends block, so they are kept off the event loop
+                cache_key, early_result = await asyncio.to_thread(before_call, args, kwargs)
+                if early_result is not None:
+                    return early_result
+                return await asyncio.to_thread(after_call, cache_key, await func(*args, **kwargs))
+
+            return async_wrapper
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            cache_key, early_result = before_call(args, kwargs)
+            if early_result is not None:
+                return early_result
+            # Make the actual API call
+            return after_call(cache_key, func(*args, **kwargs))
+
         return wrapper
     return decorator
 
 
 def get_rate_limit_stats(identifier: str = "global") -> Dict[str, Any]:
     """Get current rate limit statistics"""
-    current_time = time.time()
-
-    # Clean up old entries
-    _request_counts[identifier] = [
-        t for t in _request_counts[identifier]
-        if current_time - t < 86400
-    ]
-
-    recent_requests = [
-        t for t in _request_counts[identifier]
-        if current_time - t < 60
-    ]
+    backend = get_cache_backend()
+    requests_last_minute, requests_last_day = backend.request_counts(identifier)
 
     return {
-        "requests_last_minute": len(recent_requests),
-        "requests_last_day": len(_request_counts[identifier]),
+        "requests_last_minute": requests_last_minute,
+        "requests_last_day": requests_last_day,
         "max_per_minute": MAX_REQUESTS_PER_MINUTE,
         "max_per_day": MAX_REQUESTS_PER_DAY,
         "cache_enabled": ENABLE_CACHING,
-        "cache_size": len(_cache),
+        "cache_backend": backend.name,
+        "cache_size": backend.size(),
         "cache_ttl_seconds": CACHE_TTL_SECONDS
     }
 
 
 def clear_cache() -> int:
     """Clear all cached entries. Returns number of entries cleared."""
-    count = len(_cache)
-    _cache.clear()
+    count = get_cache_backend().clear()
     print(f"Cache cleared: {count} entries removed")
     return count
 
 
 def clear_rate_limits(identifier: Optional[str] = None) -> None:
     """Clear rate limit counters for specific identifier or all"""
+    get_cache_backend().clear_rate_limits(identifier)
     if identifier:
-        if identifier in _request_counts:
-            del _request_counts[identifier]
-            print(f"Rate limits cleared for: {identifier}")
+        print(f"Rate limits cleared for: {identifier}")
     else:
-        _request_counts.clear()
         print("All rate limits cleared")
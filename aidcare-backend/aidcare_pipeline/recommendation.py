@@ -3,37 +3,44 @@
 # Replaces Gemini — better JSON compliance, faster, same multilingual support
 # Same function signature kept for full backward compatibility
 
+import asyncio
 import json
 import os
 import time
+from .llm_gateway import get_async_openai_client, get_openai_client
+from .context_packing import ContextBlock, field_lines, pack_blocks
+from .kb_partitions import merged_variants
 from .rate_limiter import cached_gemini_call, RateLimitExceeded
+from .semantic_cache import semantic_recommendation_cache
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL_RECOMMEND = os.getenv("OPENAI_MODEL_RECOMMEND", "gpt-4o")
-
-
-@cached_gemini_call(ttl=3600, rate_limit_id="recommendation")
-def generate_triage_recommendation(
-    symptoms_list: list,
-    retrieved_guideline_entries: list,
-    language: str = "en"
-) -> dict:
-    """
-    Generate a triage recommendation from symptoms and FAISS-retrieved guidelines.
-
-    Args:
-        symptoms_list: English symptom strings from extraction step
-        retrieved_guideline_entries: Top-N FAISS guideline entries
-        language: Target language code for response values ('en'|'ha'|'yo'|'ig'|'pcm')
-
-    Returns:
-        dict with keys: summary_of_findings, recommended_actions_for_chw,
-                        urgency_level, key_guideline_references,
-                        important_notes_for_chw, evidence_based_notes
-    """
-    if not OPENAI_API_KEY:
-        return {"error": "Configuration error: Missing OPENAI_API_KEY for recommendations."}
-
+# Token budget for the guideline context in the prompt (0 = unlimited)
+RECOMMENDATION_CONTEXT_BUDGET_TOKENS = int(os.getenv("RECOMMENDATION_CONTEXT_BUDGET_TOKENS", "1200"))
+
+
+def _guideline_block(i: int, entry: dict) -> ContextBlock:
+    lines = [f"--- Guideline Entry {i+1} ---"] + field_lines([
+        ("Source Document", entry.get('source_document') or entry.get('source_document_name')),
+        ("Section", entry.get('section_title')),
+        ("Subsection", f"{entry.get('subsection_title', 'N/A')} (Code: {entry.get('subsection_code', 'N/A')})"),
+        ("Case/Condition", entry.get('case')),
+        ("Clinical Judgement from Guideline", entry.get('clinical_judgement')),
+        ("Recommended Actions from Guideline", entry.get('action')),
+        ("Notes from Guideline", entry.get('notes')),
+    ])
+    for label, fields in merged_variants(entry):
+        lines += field_lines([
+            (f"Clinical Judgement ({label})", fields.get('clinical_judgement')),
+            (f"Recommended Actions ({label})", fields.get('action')),
+            (f"Notes ({label})", fields.get('notes')),
+        ])
+    # Entries arrive best match first
+    return ContextBlock(f"guideline:{i+1}", "\n".join(lines), priority=-i)
+
+
+def _recommendation_request(symptoms_list: list, retrieved_guideline_entries: list, language: str):
+    """Returns (chat.completions.create kwargs, language name, context packing report or None)."""
     # ---------- Resolve language name + multilingual system instruction ----------
     lang_name = "English"
     lang_system_prefix = ""
@@ -49,30 +56,19 @@ def generate_triage_recommendation(
 
     # ---------- Build guideline context string ----------
     context_str = "Relevant Guideline Information:\n"
+    packing_report = None
     if not retrieved_guideline_entries:
         context_str += (
             "No specific guideline entries were retrieved. Base recommendation on general "
             "knowledge for the given symptoms, or state that specific guidelines are needed.\n"
         )
     else:
-        for i, entry in enumerate(retrieved_guideline_entries[:3]):
-            context_str += f"\n--- Guideline Entry {i+1} ---\n"
-            context_str += f"Source Document: {entry.get('source_document', 'N/A')}\n"
-            context_str += f"Section: {entry.get('section_title', 'N/A')}\n"
-            context_str += f"Subsection: {entry.get('subsection_title', 'N/A')} (Code: {entry.get('subsection_code', 'N/A')})\n"
-            context_str += f"Case/Condition: {entry.get('case', 'N/A')}\n"
-            context_str += f"Clinical Judgement from Guideline: {entry.get('clinical_judgement', 'N/A')}\n"
-            actions = entry.get('action', [])
-            if isinstance(actions, list):
-                context_str += f"Recommended Actions from Guideline: {'; '.join(actions)}\n"
-            else:
-                context_str += f"Recommended Actions from Guideline: {actions}\n"
-            notes = entry.get('notes', [])
-            if notes:
-                if isinstance(notes, list):
-                    context_str += f"Notes from Guideline: {'; '.join(notes)}\n"
-                else:
-                    context_str += f"Notes from Guideline: {notes}\n"
+        packed = pack_blocks(
+            [_guideline_block(i, entry) for i, entry in enumerate(retrieved_guideline_entries[:3])],
+            RECOMMENDATION_CONTEXT_BUDGET_TOKENS, separator="\n\n", label="recommendation",
+        )
+        context_str += "\n" + packed.text + "\n"
+        packing_report = packed.report()
 
     symptoms_str = ", ".join(symptoms_list) if symptoms_list else "No specific symptoms reported."
 
@@ -117,50 +113,127 @@ Return ONLY a JSON object with these exact keys:
 - "evidence_based_notes": (string) Any supporting evidence notes.
 {lang_mandate}"""
 
+    request = {
+        "model": OPENAI_MODEL_RECOMMEND,
+        "messages": [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.15,
+        "max_tokens": 1536,
+        "response_format": {"type": "json_object"},  # Native JSON mode
+    }
+    return request, lang_name, packing_report
+
+
+def _parse_recommendation(response, packing_report) -> dict:
+    raw = response.choices[0].message.content.strip()
+    recommendation_json = json.loads(raw)
+
+    # Basic validation
+    expected_keys = ["summary_of_findings", "recommended_actions_for_chw",
+                     "urgency_level", "key_guideline_references"]
+    if not all(k in recommendation_json for k in expected_keys):
+        print(f"Warning: Response missing expected keys. Got: {list(recommendation_json.keys())}")
+
+    print(f"Recommendation generated successfully.")
+    if packing_report is not None:
+        recommendation_json["context_packing"] = packing_report
+    return recommendation_json
+
+
+def _retry_delay(error: Exception, attempt: int, max_retries: int):
+    """Seconds to wait before the next attempt, or None to give up and report the error."""
+    if isinstance(error, json.JSONDecodeError):
+        print(f"JSON decode error in recommendation (attempt {attempt+1}): {error}")
+        return 2 * (attempt + 1) if attempt < max_retries - 1 else None
+    print(f"Error during recommendation call (attempt {attempt+1}): {error}")
+    if "rate_limit" in str(error).lower() or "429" in str(error):
+        return 10 * (attempt + 1)
+    return 2 * (attempt + 1) if attempt < max_retries - 1 else None
+
+
+def _failure(error: Exception) -> dict:
+    if isinstance(error, json.JSONDecodeError):
+        return {"error": f"Failed to decode JSON from recommendation model: {error}"}
+    return {"error": f"Recommendation generation failed: {error}"}
+
+
+@semantic_recommendation_cache
+@cached_gemini_call(ttl=3600, rate_limit_id="recommendation")
+def generate_triage_recommendation(
+    symptoms_list: list,
+    retrieved_guideline_entries: list,
+    language: str = "en",
+    kb_version: str | None = None,
+    guideline_filters: dict | None = None,
+) -> dict:
+    """
+    Generate a triage recommendation from symptoms and FAISS-retrieved guidelines.
+
+    Args:
+        symptoms_list: English symptom strings from extraction step
+        retrieved_guideline_entries: Top-N FAISS guideline entries
+        language: Target language code for response values ('en'|'ha'|'yo'|'ig'|'pcm')
+        kb_version: Version of the KB the guideline entries came from; when given,
+                    a recommendation for a similar symptom set may be served from
+                    the semantic cache (see semantic_cache.py)
+        guideline_filters: Filters the guideline entries were retrieved with; part of
+                    the semantic cache key
+
+    Returns:
+        dict with keys: summary_of_findings, recommended_actions_for_chw,
+                        urgency_level, key_guideline_references,
+                        important_notes_for_chw, evidence_based_notes
+        (plus semantic_cache provenance when served from that cache)
+    """
+    if not OPENAI_API_KEY:
+        return {"error": "Configuration error: Missing OPENAI_API_KEY for recommendations."}
+
+    request, lang_name, packing_report = _recommendation_request(symptoms_list, retrieved_guideline_entries, language)
+    print(f"Sending recommendation request to {OPENAI_MODEL_RECOMMEND} (language: {lang_name})...")
+
+    max_retries = 2
+    for attempt in range(max_retries):
+        try:
+            client = get_openai_client()
+            response = client.chat.completions.create(**request)
+            return _parse_recommendation(response, packing_report)
+        except Exception as e:
+            delay = _retry_delay(e, attempt, max_retries)
+            if delay is None:
+                return _failure(e)
+            time.sleep(delay)
+
+    return {"error": "Failed to generate recommendation after all retries."}
+
+
+@semantic_recommendation_cache
+@cached_gemini_call(ttl=3600, rate_limit_id="recommendation", cache_name="generate_triage_recommendation")
+async def generate_triage_recommendation_async(
+    symptoms_list: list,
+    retrieved_guideline_entries: list,
+    language: str = "en",
+    kb_version: str | None = None,
+    guideline_filters: dict | None = None,
+) -> dict:
+    """Async variant of generate_triage_recommendation for async endpoints."""
+    if not OPENAI_API_KEY:
+        return {"error": "Configuration error: Missing OPENAI_API_KEY for recommendations."}
+
+    request, lang_name, packing_report = _recommendation_request(symptoms_list, retrieved_guideline_entries, language)
     print(f"Sending recommendation request to {OPENAI_MODEL_RECOMMEND} (language: {lang_name})...")
 
     max_retries = 2
     for attempt in range(max_retries):
         try:
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
-            response = client.chat.completions.create(
-                model=OPENAI_MODEL_RECOMMEND,
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.15,
-                max_tokens=1536,
-                response_format={"type": "json_object"},  # Native JSON mode
-            )
-
-            raw = response.choices[0].message.content.strip()
-            recommendation_json = json.loads(raw)
-
-            # Basic validation
-            expected_keys = ["summary_of_findings", "recommended_actions_for_chw",
-                             "urgency_level", "key_guideline_references"]
-            if not all(k in recommendation_json for k in expected_keys):
-                print(f"Warning: Response missing expected keys. Got: {list(recommendation_json.keys())}")
-
-            print(f"Recommendation generated successfully.")
-            return recommendation_json
-
-        except json.JSONDecodeError as e:
-            print(f"JSON decode error in recommendation (attempt {attempt+1}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-                continue
-            return {"error": f"Failed to decode JSON from recommendation model: {e}"}
+            client = get_async_openai_client()
+            response = await client.chat.completions.create(**request)
+            return _parse_recommendation(response, packing_report)
         except Exception as e:
-            print(f"Error during recommendation call (attempt {attempt+1}): {e}")
-            if "rate_limit" in str(e).lower() or "429" in str(e):
-                time.sleep(10 * (attempt + 1))
-            elif attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-            else:
-                return {"error": f"Recommendation generation failed: {e}"}
+            delay = _retry_delay(e, attempt, max_retries)
+            if delay is None:
+                return _failure(e)
+            await asyncio.sleep(delay)
 
     return {"error": "Failed to generate recommendation after all retries."}
@@ -0,0 +1,129 @@
+# aidcare_pipeline/retrieval_batcher.py
+# Dynamic micro-batching for guideline retrieval.
+# Queries that arrive within a few milliseconds of each other are encoded and
+# searched together on a worker thread, so the event loop never runs the encoder.
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Callable, Optional, Tuple
+
+from .kb_partitions import normalize_filters
+
+RETRIEVAL_BATCH_WAIT_MS = float(os.getenv("RETRIEVAL_BATCH_WAIT_MS", "5"))
+RETRIEVAL_MAX_BATCH_SIZE = int(os.getenv("RETRIEVAL_MAX_BATCH_SIZE", "32"))
+
+
+class RetrievalBatcher:
+    """
+    Collects concurrent retrieval requests into one batched encode + search.
+
+    The first request of a batch starts a short timer; every request that arrives
+    before it fires (or until max_batch_size is reached) joins the same batch.
+    The batch runs on a dedicated thread and each caller's future is resolved
+    with its own slice of the results.
+    """
+
+    def __init__(
+        self,
+        retriever_getter: Callable,
+        max_wait_ms: float = RETRIEVAL_BATCH_WAIT_MS,
+        max_batch_size: int = RETRIEVAL_MAX_BATCH_SIZE,
+    ):
+        """
+        Args:
+            retriever_getter: Callable returning the GuidelineRetriever to search
+            max_wait_ms: How long the first request of a batch waits for company
+            max_batch_size: Flush immediately once this many requests are queued
+        """
+        self.retriever_getter = retriever_getter
+        self.max_wait_seconds = max_wait_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+
+        # A single worker keeps batches ordered and stops encoder calls from
+        # competing with each other for the same cores.
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="retrieval-batch")
+        self._pending: list = []
+        self._flush_handle: Optional[asyncio.TimerHandle] = None
+
+        self.batches_run = 0
+        self.queries_served = 0
+
+    async def retrieve(self, symptoms_list: list, top_k: int = 3, filters: Optional[dict] = None) -> list:
+        """Queue one query and wait for its batched result."""
+        entries, _ = await self.retrieve_with_version(symptoms_list, top_k=top_k, filters=filters)
+        return entries
+
+    async def retrieve_with_version(self, symptoms_list: list, top_k: int = 3,
+                                    filters: Optional[dict] = None) -> Tuple[list, Optional[str]]:
+        """
+        Like retrieve(), but also returns the version of the KB that served the
+        query, which can change between requests when an index is hot-swapped.
+        """
+        if not symptoms_list:
+            return [], None
+        normalize_filters(filters)  # reject unknown filter fields before queueing
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((symptoms_list, top_k, filters, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self.max_wait_seconds, self._flush)
+
+        return await future
+
+    def _flush(self) -> None:
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run_batch(batch))
+
+    async def _run_batch(self, batch: list) -> None:
+        # Queries with the same filters share one search; differently filtered ones run back to back
+        groups: dict = {}
+        for item in batch:
+            groups.setdefault(normalize_filters(item[2]), []).append(item)
+        for group in groups.values():
+            await self._run_group(group)
+
+    async def _run_group(self, group: list) -> None:
+        loop = asyncio.get_running_loop()
+        symptoms_lists = [symptoms for symptoms, _, _, _ in group]
+        filters = group[0][2]
+        # Search once with the largest k and trim per caller
+        batch_top_k = max(top_k for _, top_k, _, _ in group)
+
+        try:
+            retriever = self.retriever_getter()
+            results = await loop.run_in_executor(
+                self._executor,
+                partial(retriever.retrieve_relevant_guidelines_batch, symptoms_lists, batch_top_k, filters=filters),
+            )
+        except Exception as e:
+            for _, _, _, future in group:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches_run += 1
+        self.queries_served += len(group)
+        version = getattr(retriever, "version", None)
+        for (_, top_k, _, future), entries in zip(group, results):
+            if not future.done():
+                future.set_result((entries[:top_k], version))
+
+    def get_stats(self) -> dict:
+        return {
+            "batches_run": self.batches_run,
+            "queries_served": self.queries_served,
+            "avg_batch_size": round(self.queries_served / self.batches_run, 2) if self.batches_run else 0.0,
+            "max_wait_ms": self.max_wait_seconds * 1000.0,
+            "max_batch_size": self.max_batch_size,
+        }
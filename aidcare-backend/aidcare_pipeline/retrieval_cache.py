@@ -0,0 +1,125 @@
+# aidcare_pipeline/retrieval_cache.py
+# In-memory LRU + TTL cache of retrieval results.
+#
+# CHW triage sees the same few symptom sets over and over ("fever, cough",
+# "diarrhoea, vomiting"), so results are cached per query and served without
+# encoding or searching. Keys are built from the order-insensitive, normalized
+# symptom set plus the search mode, top_k, filters and the KB's loaded version,
+# so a rebuilt index never serves old results; reloading a KB also drops its
+# entries outright (see rag_retrieval._run_reload).
+
+import copy
+import os
+import time
+from collections import OrderedDict
+from threading import Lock
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from .kb_partitions import Filters, normalize_filters
+
+RETRIEVAL_CACHE_SIZE = int(os.getenv("RETRIEVAL_CACHE_SIZE", "2048"))  # 0 disables the cache
+RETRIEVAL_CACHE_TTL_SECONDS = float(os.getenv("RETRIEVAL_CACHE_TTL_SECONDS", "3600"))
+
+
+def normalize_symptoms(symptoms_list: Iterable[str]) -> Tuple[str, ...]:
+    """Lower-cased, whitespace-collapsed, de-duplicated and sorted symptoms."""
+    return tuple(sorted({" ".join(str(s).lower().split()) for s in symptoms_list} - {""}))
+
+
+class RetrievalCache:
+    """
+    Thread-safe LRU cache with a per-entry time-to-live.
+
+    Keys start with a scope: the KB(s) the results came from, so
+    invalidate() can drop everything belonging to one KB.
+    """
+
+    def __init__(self, max_entries: int = RETRIEVAL_CACHE_SIZE, ttl_seconds: float = RETRIEVAL_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, Tuple[float, List[dict]]]" = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    @staticmethod
+    def make_key(scope: Tuple[str, ...], version: Optional[str], mode: str, symptoms: Tuple[str, ...],
+                 top_k: int, filters: Optional[Filters]) -> tuple:
+        return (scope, version, mode, symptoms, top_k, normalize_filters(filters))
+
+    def get(self, key: tuple) -> Optional[List[dict]]:
+        """Cached entries for key (deep copies, safe to mutate), or None."""
+        now = time.monotonic()
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                self.misses += 1
+                return None
+            stored_at, entries = cached
+            if now - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return copy.deepcopy(entries)
+
+    def put(self, key: tuple, entries: List[dict]) -> None:
+        if not self.enabled:
+            return
+        stored = copy.deepcopy(entries)
+        with self._lock:
+            self._entries[key] = (time.monotonic(), stored)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, scope_member: Optional[str] = None) -> int:
+        """
+        Drop cached results that came from scope_member (an index path), or
+        everything when None. Returns the number of entries removed.
+        """
+        with self._lock:
+            if scope_member is None:
+                removed = len(self._entries)
+                self._entries.clear()
+            else:
+                stale = [key for key in self._entries if scope_member in key[0]]
+                for key in stale:
+                    del self._entries[key]
+                removed = len(stale)
+            self.invalidations += removed
+        return removed
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# --- Global instance, shared by every retriever in this process ---
+_retrieval_cache = RetrievalCache()
+
+
+def get_retrieval_cache() -> RetrievalCache:
+    return _retrieval_cache
@@ -0,0 +1,328 @@
+# aidcare_pipeline/semantic_cache.py
+# Similarity cache of triage recommendations.
+#
+# The exact cache in rate_limiter keys on the call's arguments, so "fever,
+# headache", "headache, fever" and "high temperature, headache" each cost a
+# GPT-4o call. Here the normalized symptom set is embedded with the CHW
+# retriever's query encoder (the model already loaded for retrieval) and
+# searched in a small FAISS inner-product index of earlier cases, one per
+# (language, KB version, guideline filters), since e.g. a population filter
+# changes which guidelines a recommendation was grounded in. A match at or
+# above SEMANTIC_CACHE_THRESHOLD with the same number of symptoms is served as
+# a copy carrying its provenance under "semantic_cache". Entries expire after
+# SEMANTIC_CACHE_TTL_SECONDS and the least recently used are evicted past
+# SEMANTIC_CACHE_SIZE.
+
+import asyncio
+import copy
+import inspect
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from functools import wraps
+from threading import Lock
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from .kb_partitions import Filters, normalize_filters
+from .retrieval_cache import normalize_symptoms
+
+SEMANTIC_CACHE_SIZE = int(os.getenv("SEMANTIC_CACHE_SIZE", "1024"))  # 0 disables the cache
+SEMANTIC_CACHE_TTL_SECONDS = float(os.getenv("SEMANTIC_CACHE_TTL_SECONDS", "86400"))
+# Cosine similarity of the symptom-set embeddings needed to reuse a recommendation
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+# Nearest cached cases checked per lookup
+_SEARCH_K = 5
+
+
+def _encode_with_chw_retriever(texts: List[str]) -> np.ndarray:
+    from .rag_retrieval import get_chw_retriever
+    return get_chw_retriever().encode_queries(texts)
+
+
+def query_text(symptoms: Tuple[str, ...]) -> str:
+    return f"Patient symptoms: {', '.join(symptoms)}."
+
+
+class _CachedRecommendation:
+    def __init__(self, partition: tuple, symptoms: Tuple[str, ...], value: dict):
+        self.partition = partition
+        self.symptoms = symptoms
+        self.value = value
+        self.stored_at = time.monotonic()
+        self.cached_at = datetime.now(timezone.utc).isoformat()
+        self.hits = 0
+
+
+class SemanticCache:
+    """
+    Thread-safe nearest-neighbour cache of recommendations keyed by symptom set.
+
+    Args:
+        max_entries: Entries kept across all partitions (0 disables the cache)
+        ttl_seconds: Age after which an entry is no longer served
+        threshold: Minimum cosine similarity for a hit
+        encode: Maps query texts to embeddings (default: the CHW retriever's encoder)
+    """
+
+    def __init__(self, max_entries: int = SEMANTIC_CACHE_SIZE, ttl_seconds: float = SEMANTIC_CACHE_TTL_SECONDS,
+                 threshold: float = SEMANTIC_CACHE_THRESHOLD,
+                 encode: Callable[[List[str]], np.ndarray] = _encode_with_chw_retriever):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.encode = encode
+        # (language, kb_version, normalized filters) -> FAISS index of entry ids
+        self._indexes: Dict[tuple, faiss.IndexIDMap2] = {}
+        # Entry id -> entry, least recently used first
+        self._entries: "OrderedDict[int, _CachedRecommendation]" = OrderedDict()
+        # (partition, symptoms) -> entry id, so identical symptom sets skip the encoder
+        self._exact: Dict[tuple, int] = {}
+        self._next_id = 0
+        self._lock = Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0
+
+    def _embed(self, symptoms: Tuple[str, ...]) -> np.ndarray:
+        vector = np.ascontiguousarray(np.asarray(self.encode([query_text(symptoms)]), dtype="float32").reshape(1, -1))
+        faiss.normalize_L2(vector)
+        return vector
+
+    def _remove(self, entry_id: int) -> None:
+        entry = self._entries.pop(entry_id)
+        self._exact.pop((entry.partition, entry.symptoms), None)
+        index = self._indexes.get(entry.partition)
+        if index is not None:
+            index.remove_ids(np.array([entry_id], dtype="int64"))
+            if index.ntotal == 0:
+                del self._indexes[entry.partition]
+
+    def _expired(self, entry: _CachedRecommendation, now: float) -> bool:
+        return now - entry.stored_at > self.ttl_seconds
+
+    def _served(self, entry_id: int, similarity: float) -> dict:
+        entry = self._entries[entry_id]
+        self._entries.move_to_end(entry_id)
+        entry.hits += 1
+        value = copy.deepcopy(entry.value)
+        value["semantic_cache"] = {
+            "matched_symptoms": list(entry.symptoms),
+            "similarity": round(similarity, 4),
+            "cached_at": entry.cached_at,
+            "language": entry.partition[0],
+            "kb_version": entry.partition[1],
+            "guideline_filters": {field: list(values) for field, values in entry.partition[2] or ()} or None,
+            "hits": entry.hits,
+        }
+        return value
+
+    @staticmethod
+    def _partition(language: str, kb_version: Optional[str], filters: Optional[Filters]) -> tuple:
+        return (language or "en", kb_version, normalize_filters(filters))
+
+    def lookup(self, symptoms_list: list, language: str, kb_version: Optional[str],
+               filters: Optional[Filters] = None) -> Tuple[Optional[dict], Optional[np.ndarray]]:
+        """
+        Args:
+            symptoms_list: Extracted symptoms
+            language: Language of the recommendation
+            kb_version: Version of the KB the guidelines came from
+            filters: Guideline filters used for retrieval
+
+        Returns:
+            (copy of a cached recommendation with provenance, or None;
+             the query embedding when one was computed, for put())
+        """
+        symptoms = normalize_symptoms(symptoms_list)
+        if not self.enabled or not symptoms:
+            return None, None
+        partition = self._partition(language, kb_version, filters)
+        now = time.monotonic()
+
+        with self._lock:
+            entry_id = self._exact.get((partition, symptoms))
+            if entry_id is not None:
+                if not self._expired(self._entries[entry_id], now):
+                    self.exact_hits += 1
+                    return self._served(entry_id, 1.0), None
+                self._remove(entry_id)
+                self.expirations += 1
+            if partition not in self._indexes:
+                self.misses += 1
+                return None, None
+
+        # Encoding runs outside the lock
+        vector = self._embed(symptoms)
+        with self._lock:
+            index = self._indexes.get(partition)
+            if index is None:
+                self.misses += 1
+                return None, vector
+            similarities, ids = index.search(vector, min(_SEARCH_K, index.ntotal))
+            for similarity, entry_id in zip(similarities[0], ids[0]):
+                entry = self._entries.get(int(entry_id))
+                if entry is None or similarity < self.threshold:
+                    continue
+                if self._expired(entry, now):
+                    self._remove(int(entry_id))
+                    self.expirations += 1
+                    continue
+                # Near-identical embeddings can still differ by a whole symptom
+                # ("fever, headache" vs "fever, headache, stiff neck"); never reuse those
+                if len(entry.symptoms) != len(symptoms):
+                    continue
+                self.similar_hits += 1
+                return self._served(int(entry_id), float(similarity)), vector
+            self.misses += 1
+        return None, vector
+
+    def put(self, symptoms_list: list, language: str, kb_version: Optional[str], value: dict,
+            filters: Optional[Filters] = None, vector: Optional[np.ndarray] = None) -> None:
+        """Store a recommendation; vector is the embedding returned by lookup(), if any."""
+        symptoms = normalize_symptoms(symptoms_list)
+        if not self.enabled or not symptoms:
+            return
+        if vector is None:
+            vector = self._embed(symptoms)
+        partition = self._partition(language, kb_version, filters)
+        stored = copy.deepcopy(value)
+        stored.pop("semantic_cache", None)
+
+        with self._lock:
+            existing = self._exact.get((partition, symptoms))
+            if existing is not None:
+                self._remove(existing)
+            entry_id = self._next_id
+            self._next_id += 1
+            index = self._indexes.get(partition)
+            if index is None:
+                index = self._indexes[partition] = faiss.IndexIDMap2(faiss.IndexFlatIP(vector.shape[1]))
+            index.add_with_ids(vector, np.array([entry_id], dtype="int64"))
+            self._entries[entry_id] = _CachedRecommendation(partition, symptoms, stored)
+            self._exact[(partition, symptoms)] = entry_id
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, kb_version: Optional[str] = None) -> int:
+        """Drop entries for kb_version, or everything when None. Returns the number removed."""
+        with self._lock:
+            stale = [
+                entry_id for entry_id, entry in self._entries.items()
+                if kb_version is None or entry.partition[1] == kb_version
+            ]
+            for entry_id in stale:
+                self._remove(entry_id)
+            self.invalidations += len(stale)
+        return len(stale)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.exact_hits + self.similar_hits
+            lookups = hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "partitions": len(self._indexes),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "threshold": self.threshold,
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+# --- Global instance ---
+_semantic_cache = SemanticCache()
+
+
+def get_semantic_cache() -> SemanticCache:
+    return _semantic_cache
+
+
+def semantic_recommendation_cache(func):
+    """
+    Serve a decorated recommendation function from the semantic cache.
+
+    The function must take symptoms_list, language, kb_version and
+    guideline_filters arguments; calls without a kb_version bypass the cache, since the guidelines behind
+    them are unknown. Only results without an "error" key are stored. Works on
+    both regular and async functions; lookups in async calls run in a worker
+    thread because they may encode the query. Cache failures are logged and
+    the function is called as if there had been a miss.
+    """
+    signature = inspect.signature(func)
+
+    def cache_args(args, kwargs):
+        bound = signature.bind(*args, **kwargs)
+        bound.apply_defaults()
+        arguments = bound.arguments
+        return (arguments["symptoms_list"], arguments["language"], arguments["kb_version"],
+                arguments["guideline_filters"])
+
+    def lookup(symptoms_list, language, kb_version, filters):
+        try:
+            return _semantic_cache.lookup(symptoms_list, language, kb_version, filters)
+        except Exception as e:
+            print(f"SemanticCache: Lookup failed, generating instead: {e}")
+            return None, None
+
+    def store(symptoms_list, language, kb_version, filters, result, vector):
+        if not result or (isinstance(result, dict) and "error" in result):
+            return
+        try:
+            _semantic_cache.put(symptoms_list, language, kb_version, result, filters=filters, vector=vector)
+        except Exception as e:
+            print(f"SemanticCache: Could not store recommendation: {e}")
+
+    def report_hit(hit):
+        provenance = hit["semantic_cache"]
+        print(f"SemanticCache: HIT ({provenance['similarity']:.3f}) "
+              f"for symptoms matching {provenance['matched_symptoms']}")
+
+    if inspect.iscoroutinefunction(func):
+        @wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            symptoms_list, language, kb_version, filters = cache_args(args, kwargs)
+            if kb_version is None or not _semantic_cache.enabled:
+                return await func(*args, **kwargs)
+            hit, vector = await asyncio.to_thread(lookup, symptoms_list, language, kb_version, filters)
+            if hit is not None:
+                report_hit(hit)
+                return hit
+            result = await func(*args, **kwargs)
+            await asyncio.to_thread(store, symptoms_list, language, kb_version, filters, result, vector)
+            return result
+
+        return async_wrapper
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        symptoms_list, language, kb_version, filters = cache_args(args, kwargs)
+        if kb_version is None or not _semantic_cache.enabled:
+            return func(*args, **kwargs)
+        hit, vector = lookup(symptoms_list, language, kb_version, filters)
+        if hit is not None:
+            report_hit(hit)
+            return hit
+        result = func(*args, **kwargs)
+        store(symptoms_list, language, kb_version, filters, result, vector)
+        return result
+
+    return wrapper
@@ -1,8 +1,11 @@
 # aidcare_pipeline/soap_generation.py
 # SOAP note generation via OpenAI GPT-4o-mini (replaces Gemini — better reliability)
+import asyncio
 import json
 import os
 import time
+from .llm_gateway import get_async_openai_client, get_openai_client
+from .streaming import JsonSectionTracker
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 OPENAI_MODEL_SOAP = os.getenv("OPENAI_MODEL_SOAP", "gpt-4o")
@@ -20,27 +23,7 @@ _FALLBACK_SOAP_RESPONSE = {
 }
 
 
-def generate_soap_note(transcript: str, language: str = "en") -> dict:
-    """
-    Generates a structured SOAP note from a consultation transcript using OpenAI.
-
-    Args:
-        transcript: Raw consultation transcript text (may contain Nigerian English,
-                    medical Pidgin, or clinical abbreviations).
-        language:   BCP-47 language hint (e.g. 'en', 'ha', 'yo', 'ig', 'pcm').
-
-    Returns:
-        dict with keys:
-            soap_note         -> {subjective, objective, assessment, plan}
-            patient_summary   -> one-line string
-            complexity_score  -> int 1-5
-            flags             -> list of strings
-        Falls back to empty-field dict on any error.
-    """
-    if not OPENAI_API_KEY:
-        print("ERROR (soap_generation): OPENAI_API_KEY not found in environment.")
-        return {**_FALLBACK_SOAP_RESPONSE, "error": "Configuration error: Missing OpenAI API Key."}
-
+def _soap_request(transcript: str, language: str) -> dict:
     system_instruction = (
         "You are an expert medical scribe for Nigerian doctors. "
         "Structure consultation transcripts into SOAP format. "
@@ -81,37 +64,114 @@ If a section has no information, use an empty string "".
 Return ONLY the JSON object. Do not include any text before or after it.
 """
 
+    return {
+        "model": OPENAI_MODEL_SOAP,
+        "messages": [
+            {"role": "system", "content": system_instruction},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.15,
+        "max_tokens": 2048,
+        "response_format": {"type": "json_object"},
+    }
+
+
+def _strip_fences(raw_json_str: str) -> str:
+    raw_json_str = raw_json_str.strip()
+    # Clean markdown fences (sometimes present)
+    if raw_json_str.startswith("```json"):
+        raw_json_str = raw_json_str[len("```json"):]
+    if raw_json_str.startswith("```"):
+        raw_json_str = raw_json_str[len("```"):]
+    if raw_json_str.endswith("```"):
+        raw_json_str = raw_json_str[:-len("```")]
+    return raw_json_str.strip()
+
+
+def _parse_soap(raw_json_str: str) -> dict:
+    parsed = json.loads(raw_json_str)
+
+    # Validate and fill missing top-level keys with defaults
+    expected_keys = ["soap_note", "patient_summary", "complexity_score", "flags"]
+    for key in expected_keys:
+        if key not in parsed:
+            if key == "soap_note":
+                parsed[key] = {"subjective": "", "objective": "", "assessment": "", "plan": ""}
+            elif key == "flags":
+                parsed[key] = []
+            elif key == "complexity_score":
+                parsed[key] = 1
+            else:
+                parsed[key] = ""
+
+    # Validate soap_note sub-keys
+    soap_sub_keys = ["subjective", "objective", "assessment", "plan"]
+    for sub_key in soap_sub_keys:
+        if sub_key not in parsed.get("soap_note", {}):
+            parsed.setdefault("soap_note", {})[sub_key] = ""
+
+    # Clamp complexity_score to 1-5
+    try:
+        parsed["complexity_score"] = max(1, min(5, int(parsed["complexity_score"])))
+    except (ValueError, TypeError):
+        parsed["complexity_score"] = 1
+
+    print("SOAP Gen - Generated successfully.")
+    return parsed
+
+
+def _retry_delay(error: Exception, attempt: int, max_retries: int):
+    """Seconds to wait before the next attempt, or None to give up and report the error."""
+    if isinstance(error, json.JSONDecodeError):
+        print(f"SOAP Gen - JSONDecodeError (Attempt {attempt + 1}): {error}")
+        return 2 * (attempt + 1) if attempt < max_retries - 1 else None
+    print(f"SOAP Gen - Exception (Attempt {attempt + 1}): {error}")
+    import traceback
+    traceback.print_exc()
+    if attempt >= max_retries - 1:
+        return None
+    if "rate_limit" in str(error).lower() or "429" in str(error).lower():
+        return 10 * (attempt + 1)
+    return 2 * (attempt + 1)
+
+
+def _failure(error: Exception) -> dict:
+    if isinstance(error, json.JSONDecodeError):
+        return {**_FALLBACK_SOAP_RESPONSE, "error": f"Failed to decode JSON for SOAP note. {str(error)}"}
+    return {**_FALLBACK_SOAP_RESPONSE, "error": f"Unhandled error during SOAP generation: {str(error)}"}
+
+
+def generate_soap_note(transcript: str, language: str = "en") -> dict:
+    """
+    Generates a structured SOAP note from a consultation transcript using OpenAI.
+
+    Args:
+        transcript: Raw consultation transcript text (may contain Nigerian English,
+                    medical Pidgin, or clinical abbreviations).
+        language:   BCP-47 language hint (e.g. 'en', 'ha', 'yo', 'ig', 'pcm').
+
+    Returns:
+        dict with keys:
+            soap_note         -> {subjective, objective, assessment, plan}
+            patient_summary   -> one-line string
+            complexity_score  -> int 1-5
+            flags             -> list of strings
+        Falls back to empty-field dict on any error.
+    """
+    if not OPENAI_API_KEY:
+        print("ERROR (soap_generation): OPENAI_API_KEY not found in environment.")
+        return {**_FALLBACK_SOAP_RESPONSE, "error": "Configuration error: Missing OpenAI API Key."}
+
+    request = _soap_request(transcript, language)
     max_retries = 2
-    raw_json_str = ""
 
     for attempt in range(max_retries):
         try:
             print(f"SOAP Gen - Attempt {attempt + 1} using model '{OPENAI_MODEL_SOAP}'...")
 
-            from openai import OpenAI
-            client = OpenAI(api_key=OPENAI_API_KEY)
-
-            response = client.chat.completions.create(
-                model=OPENAI_MODEL_SOAP,
-                messages=[
-                    {"role": "system", "content": system_instruction},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.15,
-                max_tokens=2048,
-                response_format={"type": "json_object"},
-            )
-
-            raw_json_str = (response.choices[0].message.content or "").strip()
-
-            # Clean markdown fences (sometimes present)
-            if raw_json_str.startswith("```json"):
-                raw_json_str = raw_json_str[len("```json"):]
-            if raw_json_str.startswith("```"):
-                raw_json_str = raw_json_str[len("```"):]
-            if raw_json_str.endswith("```"):
-                raw_json_str = raw_json_str[:-len("```")]
-            raw_json_str = raw_json_str.strip()
+            client = get_openai_client()
+            response = client.chat.completions.create(**request)
+            raw_json_str = _strip_fences(response.choices[0].message.content or "")
 
             print(f"SOAP Gen - Raw response snippet (Attempt {attempt + 1}): {raw_json_str[:300]}...")
 
@@ -121,56 +181,102 @@ Return ONLY the JSON object. Do not include any text before or after it.
                     continue
                 return {**_FALLBACK_SOAP_RESPONSE, "error": "OpenAI returned an empty response."}
 
-            parsed = json.loads(raw_json_str)
-
-            # Validate and fill missing top-level keys with defaults
-            expected_keys = ["soap_note", "patient_summary", "complexity_score", "flags"]
-            for key in expected_keys:
-                if key not in parsed:
-                    if key == "soap_note":
-                        parsed[key] = {"subjective": "", "objective": "", "assessment": "", "plan": ""}
-                    elif key == "flags":
-                        parsed[key] = []
-                    elif key == "complexity_score":
-                        parsed[key] = 1
-                    else:
-                        parsed[key] = ""
-
-            # Validate soap_note sub-keys
-            soap_sub_keys = ["subjective", "objective", "assessment", "plan"]
-            for sub_key in soap_sub_keys:
-                if sub_key not in parsed.get("soap_note", {}):
-                    parsed.setdefault("soap_note", {})[sub_key] = ""
-
-            # Clamp complexity_score to 1-5
-            try:
-                parsed["complexity_score"] = max(1, min(5, int(parsed["complexity_score"])))
-            except (ValueError, TypeError):
-                parsed["complexity_score"] = 1
-
-            print("SOAP Gen - Generated successfully.")
-            return parsed
-
-        except json.JSONDecodeError as e:
-            print(f"SOAP Gen - JSONDecodeError (Attempt {attempt + 1}): {e}")
-            if attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-                continue
-            return {
-                **_FALLBACK_SOAP_RESPONSE,
-                "error": f"Failed to decode JSON for SOAP note. {str(e)}",
-            }
+            return _parse_soap(raw_json_str)
+
         except Exception as e:
-            print(f"SOAP Gen - Exception (Attempt {attempt + 1}): {e}")
-            import traceback
-            traceback.print_exc()
-            if "rate_limit" in str(e).lower() or "429" in str(e).lower():
+            delay = _retry_delay(e, attempt, max_retries)
+            if delay is None:
+                return _failure(e)
+            time.sleep(delay)
+
+    return {**_FALLBACK_SOAP_RESPONSE, "error": "Failed SOAP generation after all retries."}
+
+
+async def generate_soap_note_async(transcript: str, language: str = "en") -> dict:
+    """Async variant of generate_soap_note for async endpoints."""
+    if not OPENAI_API_KEY:
+        print("ERROR (soap_generation): OPENAI_API_KEY not found in environment.")
+        return {**_FALLBACK_SOAP_RESPONSE, "error": "Configuration error: Missing OpenAI API Key."}
+
+    request = _soap_request(transcript, language)
+    max_retries = 2
+
+    for attempt in range(max_retries):
+        try:
+            print(f"SOAP Gen - Attempt {attempt + 1} using model '{OPENAI_MODEL_SOAP}'...")
+
+            client = get_async_openai_client()
+            response = await client.chat.completions.create(**request)
+            raw_json_str = _strip_fences(response.choices[0].message.content or "")
+
+            print(f"SOAP Gen - Raw response snippet (Attempt {attempt + 1}): {raw_json_str[:300]}...")
+
+            if not raw_json_str:
                 if attempt < max_retries - 1:
-                    time.sleep(10 * (attempt + 1))
+                    await asyncio.sleep(1 * (attempt + 1))
                     continue
-            elif attempt < max_retries - 1:
-                time.sleep(2 * (attempt + 1))
-                continue
-            return {**_FALLBACK_SOAP_RESPONSE, "error": f"Unhandled error during SOAP generation: {str(e)}"}
+                return {**_FALLBACK_SOAP_RESPONSE, "error": "OpenAI returned an empty response."}
+
+            return _parse_soap(raw_json_str)
+
+        except Exception as e:
+            delay = _retry_delay(e, attempt, max_retries)
+            if delay is None:
+                return _failure(e)
+            await asyncio.sleep(delay)
 
     return {**_FALLBACK_SOAP_RESPONSE, "error": "Failed SOAP generation after all retries."}
+
+
+async def stream_soap_note(transcript: str, language: str = "en"):
+    """
+    Streaming variant of generate_soap_note.
+
+    Yields:
+        ("section", {"key", "value"}) for each field as it completes (the SOAP
+        parts as "soap_note.subjective" etc.), then ("result", dict) with the
+        validated note, as returned by generate_soap_note
+    """
+    if not OPENAI_API_KEY:
+        print("ERROR (soap_generation): OPENAI_API_KEY not found in environment.")
+        yield "result", {**_FALLBACK_SOAP_RESPONSE, "error": "Configuration error: Missing OpenAI API Key."}
+        return
+
+    request = _soap_request(transcript, language)
+    max_retries = 2
+
+    for attempt in range(max_retries):
+        tracker = JsonSectionTracker(expand=("soap_note",))
+        sent = 0
+        try:
+            print(f"SOAP Gen - Streaming attempt {attempt + 1} using model '{OPENAI_MODEL_SOAP}'...")
+
+            client = get_async_openai_client()
+            stream = await client.chat.completions.create(**request, stream=True)
+            async for chunk in stream:
+                if not chunk.choices or not chunk.choices[0].delta.content:
+                    continue
+                for key, value in tracker.feed(chunk.choices[0].delta.content):
+                    sent += 1
+                    yield "section", {"key": key, "value": value}
+
+            raw_json_str = _strip_fences(tracker.text)
+            if not raw_json_str:
+                if attempt < max_retries - 1:
+                    await asyncio.sleep(1 * (attempt + 1))
+                    continue
+                yield "result", {**_FALLBACK_SOAP_RESPONSE, "error": "OpenAI returned an empty response."}
+                return
+
+            yield "result", _parse_soap(raw_json_str)
+            return
+
+        except Exception as e:
+            delay = _retry_delay(e, attempt, max_retries)
+            # Once sections have reached the client a retry would repeat them
+            if delay is None or sent:
+                yield "result", _failure(e)
+                return
+            await asyncio.sleep(delay)
+
+    yield "result", {**_FALLBACK_SOAP_RESPONSE, "error": "Failed SOAP generation after all retries."}
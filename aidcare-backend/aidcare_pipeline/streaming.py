@@ -0,0 +1,117 @@
+# aidcare_pipeline/streaming.py
+# Helpers for streaming generation results to the client as server-sent events.
+#
+# Streaming generators (stream_multilingual_response, stream_soap_note,
+# stream_handover_report) yield (event, data) pairs:
+#   "token"   {"text": ...}            text as it is generated (chat replies)
+#   "section" {"key": ..., "value": ...} a JSON field once its value is complete
+#   "result"  {...}                    the final validated result (always last,
+#                                      carries "error" on failure, like the
+#                                      non-streaming functions)
+# Routers wrap them with sse_response().
+
+import json
+from typing import Any, AsyncIterator, Iterable, List, Optional, Tuple
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",  # Stop nginx from buffering the stream
+}
+
+
+def sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+async def sse_stream(events: AsyncIterator[Tuple[str, Any]]) -> AsyncIterator[str]:
+    async for event, data in events:
+        yield sse_event(event, data)
+
+
+def sse_response(events: AsyncIterator[Tuple[str, Any]]):
+    from fastapi.responses import StreamingResponse
+    return StreamingResponse(sse_stream(events), media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+class JsonSectionTracker:
+    """
+    Incrementally scans a streamed JSON object and returns each top-level
+    member as soon as its value is complete, so a client can render e.g. the
+    patient summary before the model has written the flags. Members of the
+    objects named in `expand` are returned one by one as "parent.child"
+    (e.g. "soap_note.subjective") instead of as one section at the end.
+    """
+
+    def __init__(self, expand: Iterable[str] = ()):
+        self.expand = set(expand)
+        self.text = ""
+        self._pos = 0
+        self._in_string = False
+        self._escaped = False
+        # One [bracket, member start, key prefix] per open container; a prefix of
+        # None means the container's members are not reported on their own
+        self._stack: List[list] = []
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """
+        Args:
+            chunk: Next piece of the model output
+
+        Returns:
+            (key, value) pairs for the members completed by this chunk
+        """
+        self.text += chunk
+        completed = []
+        while self._pos < len(self.text):
+            ch = self.text[self._pos]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif ch == "\\":
+                    self._escaped = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._stack.append([ch, self._pos + 1, self._child_prefix(ch)])
+            elif ch in "}]":
+                if ch == "}":
+                    completed.extend(self._close_member())
+                if self._stack:
+                    self._stack.pop()
+            elif ch == "," and self._stack:
+                completed.extend(self._close_member())
+                self._stack[-1][1] = self._pos + 1
+            self._pos += 1
+        return completed
+
+    def _child_prefix(self, bracket: str) -> Optional[str]:
+        if not self._stack:
+            return "" if bracket == "{" else None
+        parent = self._stack[-1]
+        if bracket != "{" or parent[0] != "{" or parent[2] != "":
+            return None
+        # Opening the value of a top-level member: report its members if it is expanded
+        try:
+            key, _ = json.JSONDecoder().raw_decode(self.text[parent[1]:self._pos].lstrip())
+        except json.JSONDecodeError:
+            return None
+        return f"{key}." if key in self.expand else None
+
+    def _close_member(self) -> List[Tuple[str, Any]]:
+        if not self._stack:
+            return []
+        bracket, start, prefix = self._stack[-1]
+        member = self.text[start:self._pos].strip()
+        if bracket != "{" or prefix is None or not member:
+            return []
+        try:
+            items = json.loads("{" + member + "}").items()
+        except json.JSONDecodeError:
+            return []
+        return [
+            (prefix + key, value) for key, value in items
+            # An expanded object was already reported member by member
+            if not (prefix == "" and key in self.expand and isinstance(value, dict))
+        ]
@@ -5,6 +5,7 @@
 
 import json
 import os
+from .llm_gateway import get_async_openai_client, get_openai_client
 from .rate_limiter import cached_gemini_call, RateLimitExceeded
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
@@ -18,6 +19,43 @@ _SYSTEM_INSTRUCTION = (
 )
 
 
+def _extraction_request(transcript_text: str) -> dict:
+    prompt = (
+        f"Extract all medical symptoms from this patient description:\n\n"
+        f"{transcript_text}\n\n"
+        f"Return ONLY a JSON object: {{\"symptoms\": [\"symptom1\", \"symptom2\"]}}\n"
+        f"If no symptoms found, return: {{\"symptoms\": []}}\n"
+        f"All symptoms must be in English regardless of input language."
+    )
+    return {
+        "model": OPENAI_MODEL_EXTRACTION,
+        "messages": [
+            {"role": "system", "content": _SYSTEM_INSTRUCTION},
+            {"role": "user", "content": prompt},
+        ],
+        "temperature": 0.1,
+        "max_tokens": 512,
+        "response_format": {"type": "json_object"},  # Native JSON mode — zero parsing failures
+    }
+
+
+def _parse_symptoms(response) -> list:
+    raw = response.choices[0].message.content.strip()
+    data = json.loads(raw)
+
+    # Support both {"symptoms": [...]} and a bare list
+    if isinstance(data, list):
+        symptoms = data
+    elif isinstance(data, dict):
+        symptoms = data.get("symptoms", data.get("extracted_symptoms", []))
+    else:
+        symptoms = []
+
+    cleaned = [str(s).lower().strip() for s in symptoms if str(s).strip()]
+    print(f"Extracted {len(cleaned)} symptoms: {cleaned}")
+    return cleaned
+
+
 @cached_gemini_call(ttl=3600, rate_limit_id="symptom_extraction")
 def extract_symptoms_with_gemini(transcript_text: str) -> list:
     """
@@ -32,43 +70,29 @@ def extract_symptoms_with_gemini(transcript_text: str) -> list:
     if not OPENAI_API_KEY:
         raise ValueError("OPENAI_API_KEY not found in environment for symptom extraction.")
 
-    prompt = (
-        f"Extract all medical symptoms from this patient description:\n\n"
-        f"{transcript_text}\n\n"
-        f"Return ONLY a JSON object: {{\"symptoms\": [\"symptom1\", \"symptom2\"]}}\n"
-        f"If no symptoms found, return: {{\"symptoms\": []}}\n"
-        f"All symptoms must be in English regardless of input language."
-    )
+    try:
+        client = get_openai_client()
+        response = client.chat.completions.create(**_extraction_request(transcript_text))
+        return _parse_symptoms(response)
+
+    except json.JSONDecodeError as e:
+        print(f"JSON decode error in symptom extraction: {e}")
+        return []
+    except Exception as e:
+        print(f"Error in GPT-4o-mini symptom extraction: {e}")
+        return []
+
+
+@cached_gemini_call(ttl=3600, rate_limit_id="symptom_extraction", cache_name="extract_symptoms_with_gemini")
+async def extract_symptoms_async(transcript_text: str) -> list:
+    """Async variant of extract_symptoms_with_gemini for async endpoints."""
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY not found in environment for symptom extraction.")
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
-
-        response = client.chat.completions.create(
-            model=OPENAI_MODEL_EXTRACTION,
-            messages=[
-                {"role": "system", "content": _SYSTEM_INSTRUCTION},
-                {"role": "user", "content": prompt},
-            ],
-            temperature=0.1,
-            max_tokens=512,
-            response_format={"type": "json_object"},  # Native JSON mode — zero parsing failures
-        )
-
-        raw = response.choices[0].message.content.strip()
-        data = json.loads(raw)
-
-        # Support both {"symptoms": [...]} and a bare list
-        if isinstance(data, list):
-            symptoms = data
-        elif isinstance(data, dict):
-            symptoms = data.get("symptoms", data.get("extracted_symptoms", []))
-        else:
-            symptoms = []
-
-        cleaned = [str(s).lower().strip() for s in symptoms if str(s).strip()]
-        print(f"Extracted {len(cleaned)} symptoms: {cleaned}")
-        return cleaned
+        client = get_async_openai_client()
+        response = await client.chat.completions.create(**_extraction_request(transcript_text))
+        return _parse_symptoms(response)
 
     except json.JSONDecodeError as e:
         print(f"JSON decode error in symptom extraction: {e}")
@@ -4,8 +4,11 @@
 # Same function signature kept for full backward compatibility
 
 import os
+from .llm_gateway import get_async_openai_client, get_openai_client
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
+# Audio uploads take longer than chat calls; overrides the gateway's read timeout
+TRANSCRIPTION_TIMEOUT_SECONDS = float(os.getenv("TRANSCRIPTION_TIMEOUT_SECONDS", "120"))
 
 # OpenAI Whisper API supports limited languages; ha/yo/ig return 400 "unsupported"
 # Only pass language for English; for others use auto-detect (omit language param)
@@ -20,6 +23,44 @@ def load_whisper_model():
     print("Transcription: Using OpenAI Whisper API (no local model to load).")
 
 
+def _whisper_language(audio_file_path: str, language: str = None):
+    """Validate the inputs and return the language hint to send to Whisper (None = auto-detect)."""
+    if not OPENAI_API_KEY:
+        raise ValueError("OPENAI_API_KEY environment variable is not set.")
+
+    if not os.path.exists(audio_file_path):
+        raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
+
+    # Only pass language for English — ha/yo/ig cause Whisper 400 "unsupported"
+    whisper_language = None
+    if language and language in _WHISPER_SUPPORTED:
+        whisper_language = language
+    elif language == 'pcm':
+        whisper_language = 'en'  # Pidgin — English closest match
+
+    print(f"Transcribing via OpenAI Whisper API: {audio_file_path} "
+          f"(language hint: {whisper_language or 'auto-detect'})...")
+    return whisper_language
+
+
+def _transcription_request(audio_file, whisper_language) -> dict:
+    kwargs = {
+        "model": "whisper-1",
+        "file": audio_file,
+        "response_format": "text",
+    }
+    if whisper_language:
+        kwargs["language"] = whisper_language
+    return kwargs
+
+
+def _transcript_text(transcript) -> str:
+    # When response_format="text", the API returns a plain string
+    transcript_text = transcript.strip() if isinstance(transcript, str) else str(transcript).strip()
+    print(f"Transcription successful ({len(transcript_text)} chars).")
+    return transcript_text
+
+
 def transcribe_audio_local(audio_file_path: str, language: str = None) -> str:
     """
     Transcribe audio using the OpenAI Whisper API.
@@ -37,41 +78,32 @@ def transcribe_audio_local(audio_file_path: str, language: str = None) -> str:
         FileNotFoundError: If the audio file does not exist
         openai.OpenAIError: If the API call fails
     """
-    if not OPENAI_API_KEY:
-        raise ValueError("OPENAI_API_KEY environment variable is not set.")
+    whisper_language = _whisper_language(audio_file_path, language)
 
-    if not os.path.exists(audio_file_path):
-        raise FileNotFoundError(f"Audio file not found: {audio_file_path}")
+    try:
+        client = get_openai_client(timeout=TRANSCRIPTION_TIMEOUT_SECONDS)
 
-    # Only pass language for English — ha/yo/ig cause Whisper 400 "unsupported"
-    whisper_language = None
-    if language and language in _WHISPER_SUPPORTED:
-        whisper_language = language
-    elif language == 'pcm':
-        whisper_language = 'en'  # Pidgin — English closest match
+        with open(audio_file_path, "rb") as audio_file:
+            transcript = client.audio.transcriptions.create(**_transcription_request(audio_file, whisper_language))
+
+        return _transcript_text(transcript)
+
+    except Exception as e:
+        print(f"Error during OpenAI Whisper transcription for {audio_file_path}: {e}")
+        raise
 
-    print(f"Transcribing via OpenAI Whisper API: {audio_file_path} "
-          f"(language hint: {whisper_language or 'auto-detect'})...")
+
+async def transcribe_audio_async(audio_file_path: str, language: str = None) -> str:
+    """Async variant of transcribe_audio_local for async endpoints."""
+    whisper_language = _whisper_language(audio_file_path, language)
 
     try:
-        from openai import OpenAI
-        client = OpenAI(api_key=OPENAI_API_KEY)
+        client = get_async_openai_client(timeout=TRANSCRIPTION_TIMEOUT_SECONDS)
 
         with open(audio_file_path, "rb") as audio_file:
-            kwargs = {
-                "model": "whisper-1",
-                "file": audio_file,
-                "response_format": "text",
-            }
-            if whisper_language:
-                kwargs["language"] = whisper_language
-
-            transcript = client.audio.transcriptions.create(**kwargs)
-
-        # When response_format="text", the API returns a plain string
-        transcript_text = transcript.strip() if isinstance(transcript, str) else str(transcript).strip()
-        print(f"Transcription successful ({len(transcript_text)} chars).")
-        return transcript_text
+            transcript = await client.audio.transcriptions.create(**_transcription_request(audio_file, whisper_language))
+
+        return _transcript_text(transcript)
 
     except Exception as e:
         print(f"Error during OpenAI Whisper transcription for {audio_file_path}: {e}")
@@ -4,11 +4,15 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 
 from sqlalchemy import text
 from aidcare_pipeline import copilot_models
 from aidcare_pipeline.database import SessionLocal
+from aidcare_pipeline.embedding_registry import print_registry_report
+from aidcare_pipeline.llm_gateway import close_async_clients, close_clients, get_gateway_stats
+from aidcare_pipeline.preload import get_readiness, start_preload
 
 # --- Routers ---
 from routers.auth import router as auth_router
@@ -19,6 +23,7 @@ from routers.scribe import router as scribe_router
 from routers.handover import router as handover_router
 from routers.burnout import router as burnout_router
 from routers.triage import router as triage_router
+from routers.knowledge_base import router as knowledge_base_router
 
 # --- App ---
 app = FastAPI(title="AidCare AI Assistant API", version="2.0.0")
@@ -51,6 +56,7 @@ app.include_router(scribe_router)
 app.include_router(handover_router)
 app.include_router(burnout_router)
 app.include_router(triage_router)
+app.include_router(knowledge_base_router)
 
 
 # --- Lifecycle Events ---
@@ -62,12 +68,17 @@ async def startup_event():
         print("Database tables checked/created.")
     except Exception as e:
         print(f"WARNING: Table creation failed: {e}")
+    print_registry_report()
+    # Retrievers and models load in the background; /ready reports when they are warm
+    start_preload()
     print("AidCare API v2 startup complete.")
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     print("AidCare API v2 shutting down.")
+    close_clients()
+    await close_async_clients()
 
 
 # --- Health ---
@@ -82,6 +93,13 @@ async def health_check():
         db = SessionLocal()
         db.execute(text("SELECT 1"))
         db.close()
-        return {"status": "healthy", "version": "2.0.0", "database": "connected"}
+        return {"status": "healthy", "version": "2.0.0", "database": "connected", "llm_gateway": get_gateway_stats()}
     except Exception as e:
         return {"status": "unhealthy", "version": "2.0.0", "database": f"error: {e}"}
+
+
+@app.get("/ready")
+async def readiness_check():
+    """Readiness of the preloaded models and knowledge bases; 503 until they are warm."""
+    readiness = get_readiness()
+    return JSONResponse(status_code=200 if readiness["ready"] else 503, content=readiness)
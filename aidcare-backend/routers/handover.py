@@ -8,6 +8,8 @@ from sqlalchemy.orm import Session
 from aidcare_pipeline.database import get_db
 from aidcare_pipeline import copilot_models as models
 from aidcare_pipeline.auth import get_current_user
+from aidcare_pipeline.handover_generation import generate_plain_text_report, stream_handover_report
+from aidcare_pipeline.streaming import sse_response
 
 router = APIRouter(prefix="/doctor/handover", tags=["handover"])
 
@@ -22,12 +24,8 @@ def _to_iso(dt):
     return dt.isoformat() if dt else None
 
 
-@router.post("/")
-def generate_handover(
-    payload: HandoverRequest,
-    db: Session = Depends(get_db),
-    current_user: models.Doctor = Depends(get_current_user),
-):
+def _shift_and_consultations(payload: HandoverRequest, db: Session, current_user: models.Doctor):
+    """The shift to hand over, the ward it covers, and the consultations to include."""
     shift = db.query(models.Shift).filter(models.Shift.shift_uuid == payload.shift_uuid).first()
     if not shift or shift.doctor_id != current_user.id:
         raise HTTPException(status_code=404, detail="Shift not found")
@@ -60,18 +58,36 @@ def generate_handover(
             .order_by(models.Consultation.created_at.asc())
             .all()
         )
+    return shift, ward_id, consultations
 
-    critical = []
-    stable = []
-    discharged = []
 
+def _unique_patient_consultations(consultations: list) -> list:
+    """One consultation per patient (the first in the given order)."""
     seen_patients = set()
+    unique = []
     for c in consultations:
         patient_key = c.patient_id or c.patient_ref or c.consultation_uuid
         if patient_key in seen_patients:
             continue
         seen_patients.add(patient_key)
+        unique.append(c)
+    return unique
+
+
+@router.post("/")
+def generate_handover(
+    payload: HandoverRequest,
+    db: Session = Depends(get_db),
+    current_user: models.Doctor = Depends(get_current_user),
+):
+    shift, ward_id, consultations = _shift_and_consultations(payload, db, current_user)
 
+    critical = []
+    stable = []
+    discharged = []
+
+    unique_consultations = _unique_patient_consultations(consultations)
+    for c in unique_consultations:
         summary = c.patient_summary or c.transcript_text or "No summary available"
         entry = {
             "patient_ref": c.patient_ref or "Unknown",
@@ -109,7 +125,7 @@ def generate_handover(
         "shift_summary": {
             "start": _to_iso(shift.shift_start),
             "end": _to_iso(shift.shift_end),
-            "patients_seen": len(seen_patients),
+            "patients_seen": len(unique_consultations),
             "avg_complexity": round(avg_complexity, 2),
         },
         "critical_patients": critical,
@@ -120,7 +136,7 @@ def generate_handover(
     report_payload["plain_text_report"] = (
         f"Handover for {current_user.full_name}. "
         f"Ward: {ward_obj.name if ward_obj else 'N/A'}. "
-        f"Patients: {len(seen_patients)}. "
+        f"Patients: {len(unique_consultations)}. "
         f"Critical: {len(critical)}. Stable: {len(stable)}. Discharged: {len(discharged)}."
     )
 
@@ -140,6 +156,54 @@ def generate_handover(
     return report_payload
 
 
+@router.post("/stream")
+def generate_handover_stream(
+    payload: HandoverRequest,
+    db: Session = Depends(get_db),
+    current_user: models.Doctor = Depends(get_current_user),
+):
+    """
+    AI-written handover report streamed as server-sent events: a "section"
+    event per report section (critical_patients, stable_patients, ...) as the
+    model completes it, then a "result" event with the validated report and
+    its plain-text version. The report is not saved; POST / records the handover.
+    """
+    shift, ward_id, consultations = _shift_and_consultations(payload, db, current_user)
+    unique_consultations = _unique_patient_consultations(consultations)
+    ward_obj = db.query(models.Ward).filter(models.Ward.id == ward_id).first() if ward_id else None
+
+    # Everything the stream needs is read here: the DB session closes before the body is sent
+    records = [
+        {
+            "patient_ref": c.patient_ref or "Unknown",
+            "soap_note": {
+                "subjective": c.soap_subjective or "",
+                "objective": c.soap_objective or "",
+                "assessment": c.soap_assessment or "",
+                "plan": c.soap_plan or "",
+            },
+            "patient_summary": c.patient_summary or "",
+            "complexity_score": c.complexity_score or 1,
+            "flags": c.flags or [],
+        }
+        for c in unique_consultations
+    ]
+    doctor_name = current_user.full_name
+    ward_name = ward_obj.name if ward_obj else "N/A"
+    shift_start = _to_iso(shift.shift_start) or ""
+    shift_end = _to_iso(shift.shift_end) or datetime.now(timezone.utc).isoformat()
+
+    async def events():
+        async for event, data in stream_handover_report(records, doctor_name, ward_name, shift_start, shift_end):
+            if event == "result":
+                data["plain_text_report"] = generate_plain_text_report(
+                    data, doctor_name, ward_name, shift_start, shift_end, len(records),
+                )
+            yield event, data
+
+    return sse_response(events())
+
+
 @router.get("/consultations")
 def get_shift_consultations(
     shift_uuid: str,
@@ -0,0 +1,49 @@
+# routers/knowledge_base.py
+# Admin endpoints for the FAISS knowledge bases: loaded versions, result cache stats and hot-swap reload
+from fastapi import APIRouter, Depends, HTTPException
+
+from aidcare_pipeline import copilot_models as models
+from aidcare_pipeline.auth import require_role
+from aidcare_pipeline.rag_retrieval import get_retrieval_cache_stats, get_retriever_status, reload_retriever
+from aidcare_pipeline.semantic_cache import get_semantic_cache
+
+router = APIRouter(prefix="/kb", tags=["knowledge-base"])
+
+
+@router.get("/status")
+def kb_status(
+    current_user: models.Doctor = Depends(require_role("super_admin")),
+):
+    return get_retriever_status()
+
+
+@router.get("/cache")
+def kb_cache_stats(
+    current_user: models.Doctor = Depends(require_role("super_admin")),
+):
+    """Hit rate and size of the retrieval result cache."""
+    return get_retrieval_cache_stats()
+
+
+@router.get("/cache/recommendations")
+def kb_recommendation_cache_stats(
+    current_user: models.Doctor = Depends(require_role("super_admin")),
+):
+    """Hit rate and size of the semantic triage recommendation cache."""
+    return get_semantic_cache().get_stats()
+
+
+@router.post("/reload/{kind}", status_code=202)
+def kb_reload(
+    kind: str,
+    current_user: models.Doctor = Depends(require_role("super_admin")),
+):
+    """
+    Reload a rebuilt index and its metadata in the background. The running
+    index keeps serving until the new one is validated, then is swapped out.
+    Poll /kb/status for the outcome.
+    """
+    try:
+        return reload_retriever(kind)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
@@ -11,6 +11,7 @@ from sqlalchemy.orm import Session, joinedload
 from aidcare_pipeline.database import get_db
 from aidcare_pipeline import copilot_models as models
 from aidcare_pipeline.auth import get_current_user
+from aidcare_pipeline.llm_gateway import get_openai_client
 
 router = APIRouter(prefix="/patients", tags=["patients"])
 
@@ -372,12 +373,7 @@ def get_patient_ai_summary(
     )
 
     try:
-        from openai import OpenAI
-        api_key = os.environ.get("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY not set")
-
-        client = OpenAI(api_key=api_key)
+        client = get_openai_client()
         model = os.getenv("OPENAI_MODEL_AI_SUMMARY", "gpt-4o")
 
         prompt = (
@@ -12,14 +12,20 @@ from sqlalchemy.orm import Session
 from aidcare_pipeline.database import get_db
 from aidcare_pipeline import copilot_models as models
 from aidcare_pipeline.auth import get_current_user
-from aidcare_pipeline.transcription import transcribe_audio_local
-from aidcare_pipeline.soap_generation import generate_soap_note
+from aidcare_pipeline.transcription import transcribe_audio_async
+from aidcare_pipeline.pipeline_dag import PipelineDAG, StageTimeoutError
+from aidcare_pipeline.soap_generation import generate_soap_note_async, stream_soap_note
+from aidcare_pipeline.streaming import sse_response
 
 router = APIRouter(prefix="/doctor/scribe", tags=["scribe"])
 
 TEMP_AUDIO_DIR = "temp_audio"
 os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
 
+# Per-stage timeouts of the scribe pipeline (seconds)
+SCRIBE_TRANSCRIPTION_TIMEOUT_SECONDS = float(os.getenv("SCRIBE_TRANSCRIPTION_TIMEOUT_SECONDS", "150"))
+SCRIBE_SOAP_TIMEOUT_SECONDS = float(os.getenv("SCRIBE_SOAP_TIMEOUT_SECONDS", "90"))
+
 PIDGIN_MARKERS = [
     "dey", "no be", "wetin", "wahala", "abeg", "abi", "sha", "sef",
     "na", "chop", "pikin", "wey", "dem", "e don", "e dey", "jara",
@@ -53,7 +59,32 @@ async def regenerate_soap(
     transcript = (body.transcript or "").strip()
     if not transcript:
         raise HTTPException(status_code=400, detail="Transcript is required.")
-    soap_result = generate_soap_note(transcript=transcript, language=body.language)
+    soap_result = await generate_soap_note_async(transcript=transcript, language=body.language)
+    return _regenerate_response(soap_result)
+
+
+@router.post("/regenerate/stream")
+async def regenerate_soap_stream(
+    body: RegenerateSoapBody = Body(...),
+    current_user: models.Doctor = Depends(get_current_user),
+):
+    """
+    Server-sent-event variant of /regenerate: a "section" event per SOAP field
+    as it is written ("soap_note.subjective", ..., "patient_summary", "flags"),
+    then a "result" event with the same body as /regenerate.
+    """
+    transcript = (body.transcript or "").strip()
+    if not transcript:
+        raise HTTPException(status_code=400, detail="Transcript is required.")
+
+    async def events():
+        async for event, data in stream_soap_note(transcript=transcript, language=body.language):
+            yield event, (_regenerate_response(data) if event == "result" else data)
+
+    return sse_response(events())
+
+
+def _regenerate_response(soap_result: dict) -> dict:
     soap_note = soap_result.get(
         "soap_note",
         {"subjective": "", "objective": "", "assessment": "", "plan": ""},
@@ -77,6 +108,30 @@ def _detect_pidgin(text: str) -> bool:
     return word_hits >= 2
 
 
+async def _transcribe_or_500(file_path: str, language: str) -> str:
+    transcript = await transcribe_audio_async(file_path, language=language if language != "pcm" else None)
+    transcript = (transcript or "").strip()
+    if not transcript:
+        raise HTTPException(status_code=500, detail="Transcription failed or returned empty.")
+    return transcript
+
+
+def _patient_context(db: Session, doctor_id: int, patient_uuid: str):
+    """Returns (patient id or None, the doctor's active shift or None)."""
+    patient_id = None
+    if patient_uuid:
+        patient = db.query(models.Patient).filter(models.Patient.patient_uuid == patient_uuid).first()
+        if patient:
+            patient_id = patient.id
+
+    shift = (
+        db.query(models.Shift)
+        .filter(models.Shift.doctor_id == doctor_id, models.Shift.is_active == True)
+        .first()
+    )
+    return patient_id, shift
+
+
 def _compute_cls(consultations_count: int, hours_active: float, avg_complexity: float):
     volume = min(40, consultations_count * 8)
     complexity = min(30, int(round(avg_complexity * 6)))
@@ -111,13 +166,24 @@ async def doctor_scribe(
         with open(file_path, "wb") as buffer:
             shutil.copyfileobj(audio_file.file, buffer)
 
-        transcript = transcribe_audio_local(file_path, language=language if language != "pcm" else None)
-        transcript = (transcript or "").strip()
-        if not transcript:
-            raise HTTPException(status_code=500, detail="Transcription failed or returned empty.")
+        dag = PipelineDAG("scribe")
+        # The patient/shift lookup does not need the transcript, so it overlaps transcription
+        dag.add("patient_context", lambda r: _patient_context(db, current_user.id, patient_uuid), blocking=True)
+        dag.add("transcript", lambda r: _transcribe_or_500(file_path, language),
+                timeout=SCRIBE_TRANSCRIPTION_TIMEOUT_SECONDS)
+        dag.add("pidgin_detected", lambda r: _detect_pidgin(r["transcript"]),
+                deps=("transcript",), required=False, default=False)
+        dag.add("soap", lambda r: generate_soap_note_async(transcript=r["transcript"], language=language),
+                deps=("transcript",), timeout=SCRIBE_SOAP_TIMEOUT_SECONDS)
+        try:
+            run = await dag.run()
+        except StageTimeoutError as e:
+            raise HTTPException(status_code=504, detail=f"Scribe timed out: {e}")
 
-        pidgin_detected = _detect_pidgin(transcript)
-        soap_result = generate_soap_note(transcript=transcript, language=language)
+        transcript = run.results["transcript"]
+        pidgin_detected = run.results["pidgin_detected"]
+        soap_result = run.results["soap"]
+        patient_id, shift = run.results["patient_context"]
 
         soap_note = soap_result.get(
             "soap_note",
@@ -128,18 +194,6 @@ async def doctor_scribe(
         flags = soap_result.get("flags", [])
         medication_changes = soap_result.get("medication_changes", [])
 
-        patient_id = None
-        if patient_uuid:
-            patient = db.query(models.Patient).filter(models.Patient.patient_uuid == patient_uuid).first()
-            if patient:
-                patient_id = patient.id
-
-        shift = (
-            db.query(models.Shift)
-            .filter(models.Shift.doctor_id == current_user.id, models.Shift.is_active == True)
-            .first()
-        )
-
         consultation = None
         burnout_data = None
         if shift:
@@ -220,6 +274,7 @@ async def doctor_scribe(
             "medication_changes": medication_changes,
             "burnout_score": burnout_data,
             "soap_error": soap_result.get("error"),
+            "pipeline": run.report(),
         }
     except HTTPException:
         raise
@@ -5,7 +5,6 @@ import time
 import uuid
 import shutil
 from datetime import datetime, timezone
-from threading import Lock
 
 from fastapi import APIRouter, Depends, File, Form, HTTPException, UploadFile
 from fastapi.responses import Response
@@ -15,43 +14,57 @@ from sqlalchemy.orm import Session
 from aidcare_pipeline.database import get_db
 from aidcare_pipeline import copilot_models as models
 from aidcare_pipeline.auth import get_optional_user, get_current_user
-from aidcare_pipeline.transcription import transcribe_audio_local
-from aidcare_pipeline.symptom_extraction import extract_symptoms_with_gemini
-from aidcare_pipeline.recommendation import generate_triage_recommendation
-from aidcare_pipeline.multilingual import generate_multilingual_response, translate_to_english, URGENT_KEYWORDS
+from aidcare_pipeline.transcription import transcribe_audio_async
+from aidcare_pipeline.symptom_extraction import extract_symptoms_async
+from aidcare_pipeline.recommendation import generate_triage_recommendation_async
+from aidcare_pipeline.multilingual import (
+    generate_multilingual_response_async, stream_multilingual_response, translate_batch_to_english_async,
+    translate_to_english_async, URGENT_KEYWORDS,
+)
 from aidcare_pipeline.tts_service import generate_speech, get_voice_id
 from aidcare_pipeline.rag_retrieval import get_chw_retriever, GuidelineRetriever
+from aidcare_pipeline.retrieval_batcher import RetrievalBatcher
+from aidcare_pipeline.kb_partitions import normalize_filters, populations_for_age
+from aidcare_pipeline.llm_gateway import begin_llm_scope, scope_report
+from aidcare_pipeline.pipeline_dag import PipelineDAG, StageTimeoutError
+from aidcare_pipeline.streaming import sse_response
 
 router = APIRouter(prefix="/triage", tags=["triage"])
 
 TEMP_AUDIO_DIR = "temp_audio"
 os.makedirs(TEMP_AUDIO_DIR, exist_ok=True)
 
-_retriever_lock = Lock()
-_retriever_cache: dict = {}
+# Per-stage timeouts of the triage pipeline (seconds); other stages use PIPELINE_STAGE_TIMEOUT_SECONDS
+TRIAGE_TRANSCRIPTION_TIMEOUT_SECONDS = float(os.getenv("TRIAGE_TRANSCRIPTION_TIMEOUT_SECONDS", "150"))
+TRIAGE_RETRIEVAL_TIMEOUT_SECONDS = float(os.getenv("TRIAGE_RETRIEVAL_TIMEOUT_SECONDS", "20"))
+TRIAGE_TRANSLATION_TIMEOUT_SECONDS = float(os.getenv("TRIAGE_TRANSLATION_TIMEOUT_SECONDS", "30"))
 
-
-def _get_chw_retriever() -> GuidelineRetriever:
-    if "chw" in _retriever_cache:
-        return _retriever_cache["chw"]
-    with _retriever_lock:
-        if "chw" in _retriever_cache:
-            return _retriever_cache["chw"]
-        retriever = get_chw_retriever()
-        _retriever_cache["chw"] = retriever
-        return retriever
+# Concurrent triages share one batched encode + FAISS search, run off the event loop.
+# The getter is called per batch, so a hot-swapped index is picked up without a restart.
+_retrieval_batcher = RetrievalBatcher(get_chw_retriever)
 
 
 def _get_retriever_or_503() -> GuidelineRetriever:
     try:
-        r = _get_chw_retriever()
+        r = get_chw_retriever()
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Triage knowledge base not available: {e}")
-    if r.index.ntotal == 0:
+    if r.ntotal == 0:
         raise HTTPException(status_code=503, detail="Triage knowledge base is empty.")
     return r
 
 
+def _guideline_filters(guideline_filters: dict | None, patient_age_years: float | None) -> dict | None:
+    filters = dict(guideline_filters or {})
+    if patient_age_years is not None and "population" not in filters:
+        filters["population"] = populations_for_age(patient_age_years)
+    try:
+        normalize_filters(filters)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return filters or None
+
+
 # --- Schemas ---
 
 class ConversationInput(BaseModel):
@@ -65,6 +78,11 @@ class TriageTextInput(BaseModel):
     transcript_text: str
     staff_notes: str = ""
     language: str = "en"
+    # Restricts guideline retrieval to matching KB entries, e.g. under-5s only see newborn/child guidance
+    patient_age_years: float | None = None
+    guideline_filters: dict | None = None  # e.g. {"cadre": "CHEW"}; see aidcare_pipeline/kb_partitions.py
+    # Opt-in: adds a translation call; clients can also call /translate on demand
+    translate_transcript: bool = False
 
 
 class TTSRequest(BaseModel):
@@ -87,31 +105,34 @@ class CreatePatientFromTriageRequest(BaseModel):
 
 # --- Conversation continue (dual-input) ---
 
+def _augmented_history(payload: ConversationInput) -> str:
+    augmented_history = payload.conversation_history
+    if payload.staff_notes and payload.staff_notes.strip():
+        augmented_history += (
+            f"\n\n--- STAFF CLINICAL OBSERVATIONS (English, for AI context only) ---\n"
+            f"The attending nurse/CHW has recorded: {payload.staff_notes.strip()}\n"
+            f"Use these observations to inform your next question, but do NOT mention "
+            f"them directly to the patient. Do NOT say 'according to the nurse' or "
+            f"similar. Just use the clinical data to ask smarter follow-up questions.\n"
+            f"---"
+        )
+    return augmented_history
+
+
 @router.post("/conversation/continue")
 async def continue_conversation(payload: ConversationInput):
     if not payload.patient_message or not payload.patient_message.strip():
         raise HTTPException(status_code=400, detail="Patient message cannot be empty.")
 
     try:
-        augmented_history = payload.conversation_history
-        if payload.staff_notes and payload.staff_notes.strip():
-            augmented_history += (
-                f"\n\n--- STAFF CLINICAL OBSERVATIONS (English, for AI context only) ---\n"
-                f"The attending nurse/CHW has recorded: {payload.staff_notes.strip()}\n"
-                f"Use these observations to inform your next question, but do NOT mention "
-                f"them directly to the patient. Do NOT say 'according to the nurse' or "
-                f"similar. Just use the clinical data to ask smarter follow-up questions.\n"
-                f"---"
-            )
-
-        result = generate_multilingual_response(
-            conversation_history=augmented_history,
+        result = await generate_multilingual_response_async(
+            conversation_history=_augmented_history(payload),
             latest_message=payload.patient_message,
             language=payload.language,
         )
         # Add English translation for transparency when using local languages
         if payload.language and payload.language != "en" and result.get("response"):
-            result["response_english"] = translate_to_english(result["response"], payload.language)
+            result["response_english"] = await translate_to_english_async(result["response"], payload.language)
         else:
             result["response_english"] = None
         return result
@@ -121,61 +142,175 @@ async def continue_conversation(payload: ConversationInput):
         raise HTTPException(status_code=500, detail=f"Conversation error: {str(e)}")
 
 
+@router.post("/conversation/continue/stream")
+async def continue_conversation_stream(payload: ConversationInput):
+    """
+    Server-sent-event variant of /conversation/continue: "token" events carry the
+    reply as it is generated, then a "result" event carries the same body as
+    /conversation/continue.
+    """
+    if not payload.patient_message or not payload.patient_message.strip():
+        raise HTTPException(status_code=400, detail="Patient message cannot be empty.")
+
+    async def events():
+        async for event, data in stream_multilingual_response(
+            conversation_history=_augmented_history(payload),
+            latest_message=payload.patient_message,
+            language=payload.language,
+        ):
+            if event == "result":
+                if payload.language and payload.language != "en" and data.get("response"):
+                    data["response_english"] = await translate_to_english_async(data["response"], payload.language)
+                else:
+                    data["response_english"] = None
+            yield event, data
+
+    return sse_response(events())
+
+
 # --- Full triage from text ---
 
-@router.post("/process_text")
-async def process_text(payload: TriageTextInput):
-    transcript = payload.transcript_text
-    language = payload.language
+def _urgent_keywords(text: str) -> list:
+    lowered = text.lower()
+    return [kw for kw in URGENT_KEYWORDS if kw.lower() in lowered]
 
-    if not transcript or not transcript.strip():
-        raise HTTPException(status_code=400, detail="Transcript cannot be empty.")
 
-    retriever = _get_retriever_or_503()
+async def _transcribe_or_500(file_path: str, language: str) -> str:
+    transcript = await transcribe_audio_async(file_path, language=language if language != "pcm" else None)
+    if not transcript:
+        raise HTTPException(status_code=500, detail="Transcription failed or returned empty.")
+    return transcript
+
+
+async def _extract_symptoms_or_500(full_text: str) -> list:
+    symptoms = await extract_symptoms_async(full_text)
+    if isinstance(symptoms, dict) and "error" in symptoms:
+        raise HTTPException(status_code=500, detail=f"Symptom extraction failed: {symptoms.get('error')}")
+    return symptoms if isinstance(symptoms, list) else symptoms.get("symptoms", [])
+
 
+async def _recommend_or_500(symptom_list: list, retrieved_docs: list, language: str,
+                           kb_version: str | None, guideline_filters: dict | None) -> dict:
+    recommendation = await generate_triage_recommendation_async(
+        symptom_list, retrieved_docs, language=language,
+        kb_version=kb_version, guideline_filters=guideline_filters,
+    )
+    if not recommendation or (isinstance(recommendation, dict) and "error" in recommendation):
+        detail = recommendation.get("error") if isinstance(recommendation, dict) else "Unknown"
+        raise HTTPException(status_code=500, detail=f"Recommendation failed: {detail}")
+    return recommendation
+
+
+_NO_RECOMMENDATION_TRANSLATION = {"summary_english": None, "recommended_actions_english": None}
+
+
+async def _translate_recommendation(recommendation: dict, language: str) -> dict:
+    """English versions of the summary and actions, for transparency when using local languages."""
+    if not language or language == "en":
+        return dict(_NO_RECOMMENDATION_TRANSLATION)
+    summary = recommendation.get("summary_of_findings", "")
+    actions = recommendation.get("recommended_actions_for_chw", [])
+    # Summary and actions are translated in one call
+    translations = await translate_batch_to_english_async([summary] + list(actions), language)
+    translated = dict(_NO_RECOMMENDATION_TRANSLATION)
+    if summary:
+        translated["summary_english"] = translations[0]
+    if actions:
+        translated["recommended_actions_english"] = [
+            english or a for a, english in zip(actions, translations[1:])
+        ]
+    return translated
+
+
+def _triage_pipeline(language: str, staff_notes: str, guideline_filters: dict | None,
+                     audio_path: str | None = None, translate_transcript: bool = False) -> PipelineDAG:
+    """
+    Stages of one triage. Urgency scanning (and transcript translation, when
+    requested) run alongside symptom extraction; retrieval and the
+    recommendation follow it.
+    """
+    staff_notes = (staff_notes or "").strip()
+    dag = PipelineDAG("triage", inputs=() if audio_path else ("transcript",))
+    if audio_path:
+        dag.add("transcript", lambda r: _transcribe_or_500(audio_path, language),
+                timeout=TRIAGE_TRANSCRIPTION_TIMEOUT_SECONDS)
+    dag.add(
+        "symptoms",
+        lambda r: _extract_symptoms_or_500(
+            r["transcript"] + (f"\n\nClinical observations by staff: {staff_notes}" if staff_notes else "")
+        ),
+        deps=("transcript",),
+    )
+    if translate_transcript and language != "en":
+        dag.add("transcript_english", lambda r: translate_to_english_async(r["transcript"], language),
+                deps=("transcript",), timeout=TRIAGE_TRANSLATION_TIMEOUT_SECONDS, required=False)
+    dag.add("urgent_keywords", lambda r: _urgent_keywords(f"{r['transcript']} {staff_notes}"),
+            deps=("transcript",), required=False, default=[])
+    dag.add("retrieval",
+            lambda r: _retrieval_batcher.retrieve_with_version(r["symptoms"], top_k=3, filters=guideline_filters),
+            deps=("symptoms",), timeout=TRIAGE_RETRIEVAL_TIMEOUT_SECONDS)
+    dag.add("recommendation",
+            lambda r: _recommend_or_500(r["symptoms"], r["retrieval"][0], language,
+                                        kb_version=r["retrieval"][1], guideline_filters=guideline_filters),
+            deps=("retrieval",))
+    dag.add("recommendation_english", lambda r: _translate_recommendation(r["recommendation"], language),
+            deps=("recommendation",), timeout=TRIAGE_TRANSLATION_TIMEOUT_SECONDS, required=False,
+            default=_NO_RECOMMENDATION_TRANSLATION)
+    return dag
+
+
+async def _run_triage(language: str, staff_notes: str, guideline_filters: dict | None,
+                      transcript: str | None = None, audio_path: str | None = None,
+                      translate_transcript: bool = False) -> dict:
+    llm_stats = begin_llm_scope()
+    dag = _triage_pipeline(language, staff_notes, guideline_filters, audio_path=audio_path,
+                           translate_transcript=translate_transcript)
     try:
-        full_text = transcript
-        if payload.staff_notes and payload.staff_notes.strip():
-            full_text += f"\n\nClinical observations by staff: {payload.staff_notes.strip()}"
+        run = await dag.run({} if audio_path else {"transcript": transcript})
+    except StageTimeoutError as e:
+        raise HTTPException(status_code=504, detail=f"Triage timed out: {e}")
+    results = run.results
+
+    recommendation = results["recommendation"]
+    recommendation.update(results["recommendation_english"])
+    symptom_list = results["symptoms"]
+    retrieved_docs, kb_version = results["retrieval"]
+    risk_level = _derive_risk_level(recommendation.get("urgency_level", ""))
+
+    llm_connections = scope_report(llm_stats)
+    print(f"Triage LLM calls: {llm_connections['requests']} requests, "
+          f"{llm_connections['new_connections']} new connections, "
+          f"~{llm_connections['saved_connect_ms_estimate'] or 0:.0f}ms connection setup saved")
 
-        symptoms = extract_symptoms_with_gemini(full_text)
-        if isinstance(symptoms, dict) and "error" in symptoms:
-            raise HTTPException(status_code=500, detail=f"Symptom extraction failed: {symptoms.get('error')}")
+    return {
+        "language": language,
+        "transcript": results["transcript"],
+        "transcript_english": results.get("transcript_english"),
+        "extracted_symptoms": symptom_list,
+        "staff_notes": staff_notes or "",
+        "urgent_keywords_detected": results["urgent_keywords"],
+        "triage_recommendation": recommendation,
+        "risk_level": risk_level,
+        "kb_version": kb_version,
+        "guideline_filters": guideline_filters,
+        "llm_connections": llm_connections,
+        "pipeline": run.report(),
+    }
 
-        symptom_list = symptoms if isinstance(symptoms, list) else symptoms.get("symptoms", [])
-        retrieved_docs = retriever.retrieve_relevant_guidelines(symptom_list, top_k=3)
 
-        recommendation = generate_triage_recommendation(
-            symptom_list, retrieved_docs, language=language,
-        )
-        if not recommendation or (isinstance(recommendation, dict) and "error" in recommendation):
-            detail = recommendation.get("error") if isinstance(recommendation, dict) else "Unknown"
-            raise HTTPException(status_code=500, detail=f"Recommendation failed: {detail}")
+@router.post("/process_text")
+async def process_text(payload: TriageTextInput):
+    transcript = payload.transcript_text
 
-        # Add English translations for transparency when using local languages
-        if language and language != "en":
-            summary = recommendation.get("summary_of_findings", "")
-            if summary:
-                recommendation["summary_english"] = translate_to_english(summary, language)
-            actions = recommendation.get("recommended_actions_for_chw", [])
-            if actions:
-                recommendation["recommended_actions_english"] = [
-                    translate_to_english(a, language) or a for a in actions
-                ]
-        else:
-            recommendation["summary_english"] = None
-            recommendation["recommended_actions_english"] = None
+    if not transcript or not transcript.strip():
+        raise HTTPException(status_code=400, detail="Transcript cannot be empty.")
 
-        urgency = recommendation.get("urgency_level", "")
-        risk_level = _derive_risk_level(urgency)
+    _get_retriever_or_503()
+    guideline_filters = _guideline_filters(payload.guideline_filters, payload.patient_age_years)
 
-        return {
-            "language": language,
-            "extracted_symptoms": symptom_list,
-            "staff_notes": payload.staff_notes or "",
-            "triage_recommendation": recommendation,
-            "risk_level": risk_level,
-        }
+    try:
+        return await _run_triage(payload.language, payload.staff_notes, guideline_filters, transcript=transcript,
+                                 translate_transcript=payload.translate_transcript)
     except HTTPException:
         raise
     except Exception as e:
@@ -198,7 +333,7 @@ async def translate_to_english_endpoint(payload: TranslateInput):
         raise HTTPException(status_code=400, detail="Text cannot be empty.")
     if payload.source_language == "en":
         return {"transcript_english": None, "language": "en"}
-    result = translate_to_english(payload.text.strip(), payload.source_language)
+    result = await translate_to_english_async(payload.text.strip(), payload.source_language)
     return {"transcript_english": result, "language": payload.source_language}
 
 
@@ -217,13 +352,13 @@ async def transcribe_audio(
         with open(file_path, "wb") as buf:
             shutil.copyfileobj(audio_file.file, buf)
 
-        transcript = transcribe_audio_local(file_path, language=language if language != "pcm" else None)
+        transcript = await transcribe_audio_async(file_path, language=language if language != "pcm" else None)
         if not transcript:
             raise HTTPException(status_code=500, detail="Transcription failed or returned empty.")
 
         transcript_english = None
         if language and language != "en":
-            transcript_english = translate_to_english(transcript, language)
+            transcript_english = await translate_to_english_async(transcript, language)
 
         return {
             "transcript": transcript,
@@ -251,26 +386,22 @@ async def process_audio(
     audio_file: UploadFile = File(...),
     language: str = Form("en"),
     staff_notes: str = Form(""),
+    patient_age_years: float | None = Form(None),
+    translate_transcript: bool = Form(False),
 ):
     unique_suffix = f"{int(time.time() * 1000)}_triage_{audio_file.filename}"
     file_path = os.path.join(TEMP_AUDIO_DIR, unique_suffix)
 
+    _get_retriever_or_503()
+    guideline_filters = _guideline_filters(None, patient_age_years)
+
     try:
         with open(file_path, "wb") as buf:
             shutil.copyfileobj(audio_file.file, buf)
 
-        transcript = transcribe_audio_local(file_path, language=language if language != "pcm" else None)
-        if not transcript:
-            raise HTTPException(status_code=500, detail="Transcription failed or returned empty.")
-
-        text_input = TriageTextInput(
-            transcript_text=transcript,
-            staff_notes=staff_notes,
-            language=language,
-        )
-        result = await process_text(text_input)
-        result["transcript"] = transcript
-        return result
+        # Transcription is the first stage; the rest of the triage follows as for /process_text
+        return await _run_triage(language, staff_notes, guideline_filters, audio_path=file_path,
+                                 translate_transcript=translate_transcript)
     except HTTPException:
         raise
     except Exception as e:
@@ -0,0 +1,128 @@
+# benchmark_encoder_backends.py
+# Parity and latency check for the embedding backends (torch vs int8 ONNX):
+# cosine similarity between the two backends' vectors for the KB chunk texts and
+# triage-style queries, top-k overlap against the KB index, load time, and
+# p50/p99 single-query encode latency.
+#
+# Exits non-zero if the minimum cosine falls below --min-cosine.
+#
+# Usage:
+#   python scripts/benchmark_encoder_backends.py --kb chw
+#   python scripts/benchmark_encoder_backends.py --kb clinical --min-cosine 0.98 --json results.json
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_SCRIPT_DIR) # aidcare-backend
+sys.path.insert(0, _PROJECT_ROOT)
+from aidcare_pipeline.embedding_registry import EMBEDDING_MODEL_NAME, get_encoder
+from aidcare_pipeline.kb_store import load_metadata, resolve_metadata_path
+from aidcare_pipeline.rag_retrieval import (
+    DEFAULT_CHW_INDEX_PATH,
+    DEFAULT_CHW_METADATA_PATH,
+    DEFAULT_CLINICAL_INDEX_PATH,
+    DEFAULT_CLINICAL_METADATA_PATH,
+    GuidelineRetriever,
+)
+from benchmark_index_factory import DEFAULT_QUERIES, percentile_ms
+
+KB_PATHS = {
+    "chw": (DEFAULT_CHW_INDEX_PATH, DEFAULT_CHW_METADATA_PATH),
+    "clinical": (DEFAULT_CLINICAL_INDEX_PATH, DEFAULT_CLINICAL_METADATA_PATH),
+}
+
+
+def timed_load(backend: str):
+    start = time.perf_counter()
+    encoder = get_encoder(EMBEDDING_MODEL_NAME, backend=backend)
+    return encoder, time.perf_counter() - start
+
+
+def encode(encoder, texts: list) -> np.ndarray:
+    return np.ascontiguousarray(encoder.encode(texts, convert_to_numpy=True), dtype="float32")
+
+
+def query_latencies(encoder, query_texts: list, repeats: int) -> list:
+    encoder.encode(query_texts[:1], convert_to_numpy=True)  # warm-up
+    latencies = []
+    for _ in range(repeats):
+        for text in query_texts:
+            start = time.perf_counter()
+            encoder.encode([text], convert_to_numpy=True)
+            latencies.append(time.perf_counter() - start)
+    return latencies
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare torch and ONNX int8 encoder backends.")
+    parser.add_argument("--kb", choices=sorted(KB_PATHS), default="chw")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=20, help="Latency passes over the query set")
+    parser.add_argument("--min-cosine", type=float, default=0.98)
+    parser.add_argument("--json", dest="json_out", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    index_path, metadata_path = KB_PATHS[args.kb]
+    metadata = load_metadata(resolve_metadata_path(metadata_path))
+    chunk_texts = [entry.get("original_text_chunk", "") for entry in metadata]
+    query_texts = [GuidelineRetriever.build_query_text(q) for q in DEFAULT_QUERIES]
+    print(f"{len(chunk_texts)} chunk texts from {args.kb} KB, {len(query_texts)} queries")
+
+    torch_encoder, torch_load = timed_load("torch")
+    onnx_encoder, onnx_load = timed_load("onnx")
+
+    chunk_cos = cosine_rows(encode(torch_encoder, chunk_texts), encode(onnx_encoder, chunk_texts))
+    torch_queries, onnx_queries = encode(torch_encoder, query_texts), encode(onnx_encoder, query_texts)
+    query_cos = cosine_rows(torch_queries, onnx_queries)
+
+    # Retrieval parity: ONNX queries against the existing (torch-built) index
+    index = faiss.read_index(index_path)
+    k = min(args.k, index.ntotal)
+    _, torch_ids = index.search(torch_queries, k)
+    _, onnx_ids = index.search(onnx_queries, k)
+    overlap = sum(len(set(t) & set(o)) for t, o in zip(torch_ids, onnx_ids)) / (k * len(query_texts))
+
+    results = {"kb": args.kb, "k": k, f"top{k}_overlap": round(overlap, 4), "backends": {}}
+    for name, encoder, load_seconds in (("torch", torch_encoder, torch_load), ("onnx", onnx_encoder, onnx_load)):
+        latencies = query_latencies(encoder, query_texts, args.repeats)
+        results["backends"][name] = {
+            "load_seconds": round(load_seconds, 3),
+            "p50_ms": round(percentile_ms(latencies, 50), 3),
+            "p99_ms": round(percentile_ms(latencies, 99), 3),
+        }
+    results["chunk_cosine"] = {"mean": round(float(chunk_cos.mean()), 5), "min": round(float(chunk_cos.min()), 5)}
+    results["query_cosine"] = {"mean": round(float(query_cos.mean()), 5), "min": round(float(query_cos.min()), 5)}
+
+    print(f"\n{'backend':<8} {'load s':>8} {'p50 ms':>8} {'p99 ms':>8}")
+    for name, r in results["backends"].items():
+        print(f"{name:<8} {r['load_seconds']:>8.3f} {r['p50_ms']:>8.3f} {r['p99_ms']:>8.3f}")
+    print(f"\nCosine (torch vs onnx)  chunks: mean {results['chunk_cosine']['mean']}, min {results['chunk_cosine']['min']}"
+          f"  queries: mean {results['query_cosine']['mean']}, min {results['query_cosine']['min']}")
+    print(f"Top-{k} retrieval overlap: {overlap:.3f}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+
+    worst = min(results["chunk_cosine"]["min"], results["query_cosine"]["min"])
+    if worst < args.min_cosine:
+        print(f"\nFAIL: minimum cosine {worst} is below {args.min_cosine}")
+        sys.exit(1)
+    print(f"\nOK: minimum cosine {worst} >= {args.min_cosine}")
+
+
+if __name__ == "__main__":
+    main()
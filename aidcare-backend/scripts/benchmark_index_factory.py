@@ -0,0 +1,151 @@
+# benchmark_index_factory.py
+# Compares FAISS index-factory configurations against the exhaustive flat index
+# of an existing knowledge base: recall@k, p50/p99 single-query latency and
+# serialized index size.
+#
+# Usage:
+#   python scripts/benchmark_index_factory.py --kb clinical
+#   python scripts/benchmark_index_factory.py --kb chw --config "HNSW32:efSearch=32" --config "IVF8,Flat:nprobe=2"
+import argparse
+import json
+import os
+import sys
+import time
+
+import faiss
+import numpy as np
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_SCRIPT_DIR) # aidcare-backend
+sys.path.insert(0, _PROJECT_ROOT)
+from aidcare_pipeline.embedding_registry import EMBEDDING_MODEL_NAME, get_encoder
+from aidcare_pipeline.kb_builder import build_faiss_index
+from aidcare_pipeline.rag_retrieval import (
+    DEFAULT_CHW_INDEX_PATH,
+    DEFAULT_CLINICAL_INDEX_PATH,
+    GuidelineRetriever,
+)
+
+KB_INDEX_PATHS = {
+    "chw": DEFAULT_CHW_INDEX_PATH,
+    "clinical": DEFAULT_CLINICAL_INDEX_PATH,
+}
+
+# "factory:search_params" — IVF lists and PQ bits are sized for the current
+# few-hundred-entry KBs; scale nlist (~sqrt(N)) as the corpus grows.
+DEFAULT_CONFIGS = [
+    "Flat",
+    "HNSW32:efSearch=16",
+    "HNSW32:efSearch=64",
+    "IVF8,Flat:nprobe=2",
+    "IVF8,Flat:nprobe=4",
+    "IVF8,PQ16x4:nprobe=4",
+    "SQ8",
+    "HNSW32,SQ8:efSearch=64",
+]
+
+DEFAULT_QUERIES = [
+    ["fever", "cough"],
+    ["diarrhoea", "vomiting"],
+    ["fever", "headache", "joint pain"],
+    ["difficulty breathing", "fast breathing", "chest indrawing"],
+    ["convulsions", "fever", "stiff neck"],
+    ["bleeding in pregnancy", "abdominal pain"],
+    ["yellow eyes", "dark urine", "fatigue"],
+    ["rash", "fever", "red eyes"],
+    ["weight loss", "night sweats", "chronic cough"],
+    ["swollen feet", "headache", "blurred vision", "pregnancy"],
+    ["painful urination", "lower abdominal pain"],
+    ["burns", "blisters"],
+    ["dog bite", "wound"],
+    ["pallor", "fatigue", "dizziness"],
+    ["ear discharge", "ear pain"],
+    ["bloody diarrhoea", "fever", "abdominal cramps"],
+]
+
+
+def load_corpus_vectors(index_path: str) -> np.ndarray:
+    index = faiss.read_index(index_path)
+    if index.ntotal == 0:
+        raise ValueError(f"Index at {index_path} is empty.")
+    try:
+        return index.reconstruct_n(0, index.ntotal)
+    except RuntimeError as e:
+        raise ValueError(f"Index at {index_path} cannot reconstruct vectors (rebuild it as 'Flat' first): {e}")
+
+
+def percentile_ms(samples: list, pct: float) -> float:
+    return float(np.percentile(np.asarray(samples) * 1000.0, pct))
+
+
+def benchmark_config(config: str, corpus: np.ndarray, queries: np.ndarray, exact_ids: np.ndarray, k: int, repeats: int) -> dict:
+    factory, _, search_params = config.partition(":")
+    result = {"config": config, "index_factory": factory, "search_params": search_params}
+    try:
+        build_start = time.perf_counter()
+        index = build_faiss_index(corpus, index_factory=factory, search_params=search_params)
+        result["build_seconds"] = round(time.perf_counter() - build_start, 3)
+    except ValueError as e:
+        result["error"] = str(e)
+        return result
+
+    _, approx_ids = index.search(queries, k)
+    hits = [len(set(approx_ids[i]) & set(exact_ids[i])) for i in range(len(queries))]
+    result["recall_at_k"] = round(sum(hits) / (k * len(queries)), 4)
+
+    latencies = []
+    for _ in range(repeats):
+        for q in queries:
+            start = time.perf_counter()
+            index.search(q.reshape(1, -1), k)
+            latencies.append(time.perf_counter() - start)
+    result["p50_ms"] = round(percentile_ms(latencies, 50), 4)
+    result["p99_ms"] = round(percentile_ms(latencies, 99), 4)
+    result["index_bytes"] = int(faiss.serialize_index(index).nbytes)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark FAISS index-factory configurations for a KB.")
+    parser.add_argument("--kb", choices=sorted(KB_INDEX_PATHS), default="clinical")
+    parser.add_argument("--index-path", help="Flat index to benchmark against (overrides --kb)")
+    parser.add_argument("--config", action="append", help="'factory[:search_params]'; repeatable")
+    parser.add_argument("--k", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=20, help="Latency passes over the query set")
+    parser.add_argument("--json", dest="json_out", help="Also write results to this JSON file")
+    args = parser.parse_args()
+
+    index_path = args.index_path or KB_INDEX_PATHS[args.kb]
+    corpus = load_corpus_vectors(index_path)
+    print(f"Loaded {corpus.shape[0]} vectors (dim {corpus.shape[1]}) from {index_path}")
+
+    encoder = get_encoder(EMBEDDING_MODEL_NAME)
+    query_texts = [GuidelineRetriever.build_query_text(q) for q in DEFAULT_QUERIES]
+    queries = np.ascontiguousarray(encoder.encode(query_texts, convert_to_numpy=True), dtype="float32")
+
+    k = min(args.k, corpus.shape[0])
+    exact = faiss.IndexFlatL2(corpus.shape[1])
+    exact.add(corpus)
+    _, exact_ids = exact.search(queries, k)
+
+    results = [
+        benchmark_config(config, corpus, queries, exact_ids, k, args.repeats)
+        for config in (args.config or DEFAULT_CONFIGS)
+    ]
+
+    print(f"\n{'config':<28} {'recall@' + str(k):>9} {'p50 ms':>9} {'p99 ms':>9} {'size KB':>9}")
+    for r in results:
+        if "error" in r:
+            print(f"{r['config']:<28} ERROR: {r['error']}")
+            continue
+        print(f"{r['config']:<28} {r['recall_at_k']:>9.3f} {r['p50_ms']:>9.3f} "
+              f"{r['p99_ms']:>9.3f} {r['index_bytes'] / 1024:>9.1f}")
+
+    if args.json_out:
+        with open(args.json_out, 'w', encoding='utf-8') as f:
+            json.dump({"index_path": index_path, "k": k, "results": results}, f, indent=2)
+        print(f"\nResults written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+# export_onnx_encoder.py
+# Exports the sentence-transformer used for retrieval to ONNX and quantizes it to
+# int8 for the onnxruntime encoder backend (EMBEDDING_BACKEND=onnx).
+#
+# Needs the full torch/transformers stack plus onnxruntime; run it once at build
+# time. The API itself then only needs onnxruntime and tokenizers.
+#
+# Usage:
+#   python scripts/export_onnx_encoder.py
+#   python scripts/export_onnx_encoder.py --model all-MiniLM-L6-v2 --output-dir data/models/all-MiniLM-L6-v2-onnx
+import argparse
+import os
+import sys
+
+_SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+_PROJECT_ROOT = os.path.dirname(_SCRIPT_DIR) # aidcare-backend
+sys.path.insert(0, _PROJECT_ROOT)
+from aidcare_pipeline.embedding_registry import EMBEDDING_MODEL_NAME
+from aidcare_pipeline.onnx_encoder import ONNX_MODEL_FILE, onnx_model_dir_for
+
+ONNX_OPSET = 14
+
+
+def export_encoder(model_name: str, output_dir: str, opset: int = ONNX_OPSET) -> str:
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    print(f"Loading '{model_name}' for export...")
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    # The tokenizer.json read by tokenizers.Tokenizer at runtime
+    tokenizer.save_pretrained(output_dir)
+
+    sample = tokenizer(["Patient symptoms: fever, cough."], return_tensors="pt")
+    input_names = [name for name in ("input_ids", "attention_mask", "token_type_ids") if name in sample]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["token_embeddings"] = {0: "batch", 1: "sequence"}
+
+    fp32_path = os.path.join(output_dir, "model.onnx")
+    print(f"Exporting to {fp32_path} (opset {opset})...")
+    with torch.no_grad():
+        torch.onnx.export(
+            transformer,
+            tuple(sample[name] for name in input_names),
+            fp32_path,
+            input_names=input_names,
+            output_names=["token_embeddings"],
+            dynamic_axes=dynamic_axes,
+            opset_version=opset,
+            do_constant_folding=True,
+        )
+
+    quantized_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    print(f"Quantizing weights to int8: {quantized_path}")
+    quantize_dynamic(fp32_path, quantized_path, weight_type=QuantType.QInt8)
+
+    fp32_mb = os.path.getsize(fp32_path) / (1024 * 1024)
+    int8_mb = os.path.getsize(quantized_path) / (1024 * 1024)
+    print(f"Done. fp32: {fp32_mb:.1f} MB, int8: {int8_mb:.1f} MB")
+    return quantized_path
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export and int8-quantize the retrieval encoder for onnxruntime.")
+    parser.add_argument("--model", default=EMBEDDING_MODEL_NAME)
+    parser.add_argument("--output-dir", help="Defaults to data/models/<model>-onnx (or ONNX_MODEL_DIR)")
+    parser.add_argument("--opset", type=int, default=ONNX_OPSET)
+    args = parser.parse_args()
+    export_encoder(args.model, args.output_dir or onnx_model_dir_for(args.model), opset=args.opset)
+    print("Verify with: python scripts/benchmark_encoder_backends.py")
@@ -1,13 +1,19 @@
 # prepare_chw_kb.py
+import argparse
 import json
 import os
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+import sys
 
 # --- Configuration ---
 _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 _PROJECT_ROOT = os.path.dirname(_SCRIPT_DIR) # aidcare-backend
+sys.path.insert(0, _PROJECT_ROOT) # so the shared aidcare_pipeline encoder registry is importable
+from aidcare_pipeline.embedding_cache import DEFAULT_EMBEDDING_CACHE_PATH, add_embedding_cache_arguments
+from aidcare_pipeline.embedding_registry import EMBEDDING_BACKEND
+from aidcare_pipeline.kb_builder import (
+    DEFAULT_BATCH_SIZE, DEFAULT_DEDUP_THRESHOLD, DEFAULT_INDEX_FACTORY, DEFAULT_SEARCH_PARAMS, DEFAULT_WORKERS,
+    StreamingKBBuilder, add_index_arguments,
+)
 DATA_SOURCE_DIR = os.path.join(_PROJECT_ROOT, "data", "source_documents")
 
 CHO_FILEPATH = os.path.join(DATA_SOURCE_DIR, "national_standing_orders_cho.json")
@@ -55,71 +61,53 @@ def create_chunks_from_guideline_entry(entry, subsection, section, source_doc_na
         "notes": entry.get("notes", []), "original_text_chunk": chunk_text
     }
     return chunk_text, metadata
-# --- End Helper Functions ---
-
-def build_chw_knowledge_base():
-    print("--- Starting CHW Knowledge Base Preparation ---")
-    all_chunks = []
-    all_metadata = []
 
-    # 1. Process CHO Guidelines
-    print(f"\nProcessing CHO Guidelines from {CHO_FILEPATH}...")
-    cho_data = load_json_file(CHO_FILEPATH)
-    if cho_data and "sections" in cho_data:
-        for section in cho_data["sections"]:
-            for subsection in section.get("subsections", []):
-                for entry in subsection.get("entries", []):
-                    chunk, meta = create_chunks_from_guideline_entry(entry, subsection, section, "CHO Guidelines")
-                    all_chunks.append(chunk)
-                    all_metadata.append(meta)
-    else:
-        print(f"Could not process CHO data from {CHO_FILEPATH}")
-
-    # 2. Process CHEW Guidelines
-    print(f"\nProcessing CHEW Guidelines from {CHEW_FILEPATH}...")
-    chew_data = load_json_file(CHEW_FILEPATH)
-    if chew_data and "sections" in chew_data:
-        for section in chew_data["sections"]:
-            for subsection in section.get("subsections", []):
-                for entry in subsection.get("entries", []):
-                    chunk, meta = create_chunks_from_guideline_entry(entry, subsection, section, "CHEW Guidelines")
-                    all_chunks.append(chunk)
-                    all_metadata.append(meta)
-    else:
-        print(f"Could not process CHEW data from {CHEW_FILEPATH}")
-
-    if not all_chunks:
-        print("No text chunks created for CHW KB. Exiting.")
+def iter_guideline_chunks(filepath, source_doc_name):
+    """Yield (chunk_text, metadata) for every entry of a standing-orders file, one at a time."""
+    print(f"\nProcessing {source_doc_name} from {filepath}...")
+    data = load_json_file(filepath)
+    if not data or "sections" not in data:
+        print(f"Could not process {source_doc_name} data from {filepath}")
         return
+    for section in data["sections"]:
+        for subsection in section.get("subsections", []):
+            for entry in subsection.get("entries", []):
+                yield create_chunks_from_guideline_entry(entry, subsection, section, source_doc_name)
+# --- End Helper Functions ---
 
-    print(f"\nTotal CHW text chunks created: {len(all_chunks)}")
-
-    # 3. Load Model, Generate Embeddings, Create Index
-    print(f"\nLoading sentence transformer model: {EMBEDDING_MODEL_NAME}...")
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-    print("Model loaded.")
-
-    print("Generating CHW embeddings... (This may take a while)")
-    chunk_embeddings = model.encode(all_chunks, show_progress_bar=True, convert_to_numpy=True)
-    
-    dimension = chunk_embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(chunk_embeddings)
-    print(f"CHW FAISS index created. Total vectors: {index.ntotal}")
+def iter_chw_chunks():
+    yield from iter_guideline_chunks(CHO_FILEPATH, "CHO Guidelines")
+    yield from iter_guideline_chunks(CHEW_FILEPATH, "CHEW Guidelines")
 
-    # 4. Save output files
-    output_dir = os.path.dirname(OUTPUT_INDEX_PATH)
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print(f"Created output directory for CHW KB: {output_dir}")
+def build_chw_knowledge_base(index_factory=DEFAULT_INDEX_FACTORY, search_params=DEFAULT_SEARCH_PARAMS,
+                             embedding_cache_path=DEFAULT_EMBEDDING_CACHE_PATH,
+                             workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                             encoder_backend=EMBEDDING_BACKEND, dedup_threshold=DEFAULT_DEDUP_THRESHOLD):
+    print("--- Starting CHW Knowledge Base Preparation ---")
 
-    print(f"\nSaving CHW FAISS index to: {OUTPUT_INDEX_PATH}")
-    faiss.write_index(index, OUTPUT_INDEX_PATH)
-    print(f"Saving CHW metadata to: {OUTPUT_METADATA_PATH}")
-    with open(OUTPUT_METADATA_PATH, 'w', encoding='utf-8') as f:
-        json.dump(all_metadata, f, indent=2)
+    # Chunks are embedded and indexed batch by batch as the guidelines are read;
+    # unchanged chunks come from the embedding cache
+    builder = StreamingKBBuilder(
+        index_path=OUTPUT_INDEX_PATH, metadata_path=OUTPUT_METADATA_PATH,
+        model_name=EMBEDDING_MODEL_NAME, index_factory=index_factory,
+        search_params=search_params, batch_size=batch_size, workers=workers,
+        embedding_cache_path=embedding_cache_path, backend=encoder_backend,
+        dedup_threshold=dedup_threshold, label="CHW",
+    )
+    if builder.build(iter_chw_chunks()) is None:
+        return
 
     print("\n--- CHW Knowledge Base Preparation Complete! ---")
 
 if __name__ == "__main__":
-    build_chw_knowledge_base()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Build the CHW guideline knowledge base.")
+    add_index_arguments(parser)
+    add_embedding_cache_arguments(parser)
+    args = parser.parse_args()
+    embedding_cache_path = None if args.no_embedding_cache else args.embedding_cache
+    build_chw_knowledge_base(
+        index_factory=args.index_factory, search_params=args.search_params,
+        embedding_cache_path=embedding_cache_path,
+        workers=args.workers, batch_size=args.batch_size,
+        encoder_backend=args.encoder_backend, dedup_threshold=args.dedup_threshold,
+    )
@@ -1,14 +1,20 @@
 # prepare_clinical_kb.py
+import argparse
 import json
 import os
-import numpy as np
-from sentence_transformers import SentenceTransformer
-import faiss
+import sys
 
 # --- Configuration ---
 # _PROJECT_ROOT determination was duplicated, let's fix and use the one from your scripts/ dir assumption
 _SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__)) # This is scripts/
 _PROJECT_ROOT = os.path.dirname(_SCRIPT_DIR) # This is aidcare-backend/
+sys.path.insert(0, _PROJECT_ROOT) # so the shared aidcare_pipeline encoder registry is importable
+from aidcare_pipeline.embedding_cache import DEFAULT_EMBEDDING_CACHE_PATH, add_embedding_cache_arguments
+from aidcare_pipeline.embedding_registry import EMBEDDING_BACKEND
+from aidcare_pipeline.kb_builder import (
+    DEFAULT_BATCH_SIZE, DEFAULT_DEDUP_THRESHOLD, DEFAULT_INDEX_FACTORY, DEFAULT_SEARCH_PARAMS, DEFAULT_WORKERS,
+    StreamingKBBuilder, add_index_arguments,
+)
 DATA_SOURCE_DIR = os.path.join(_PROJECT_ROOT, "data", "source_documents")
 
 
@@ -88,97 +94,71 @@ def create_chunks_from_textbook_disease(disease_entry, textbook_name="Medical Te
     }
     return chunk_text, metadata
 
-# --- End Helper Functions ---
+def iter_guideline_chunks(filepath, source_doc_name):
+    """Yield (chunk_text, metadata) for every entry of a standing-orders file, one at a time."""
+    print(f"\nProcessing {source_doc_name} from {filepath} for Clinical KB...")
+    data = load_json_file(filepath)
+    if not data or "sections" not in data:
+        print(f"Could not process {source_doc_name} data from {filepath}")
+        return
+    for section in data["sections"]:
+        for subsection in section.get("subsections", []):
+            for entry in subsection.get("entries", []):
+                yield create_chunks_from_guideline_entry(entry, subsection, section, source_doc_name)
 
-def build_clinical_knowledge_base():
-    print("--- Starting Clinical Support Knowledge Base Preparation ---")
-    all_chunks = []
-    all_metadata = []
 
-    # 1. Optionally Process CHO Guidelines
+def iter_textbook_chunks(tb_path):
+    """Yield (chunk_text, metadata) for every disease entry of a textbook file, one at a time."""
+    if not os.path.exists(tb_path):
+        print(f"Textbook file not found, skipping: {tb_path}")
+        return
+    textbook_name_from_file = os.path.splitext(os.path.basename(tb_path))[0].replace('_', ' ').title()
+    print(f"\nProcessing Textbook '{textbook_name_from_file}' from {tb_path}...")
+    textbook_data = load_json_file(tb_path)
+    if textbook_data and isinstance(textbook_data, list):
+        for disease_entry in textbook_data:
+            yield create_chunks_from_textbook_disease(disease_entry, textbook_name=textbook_name_from_file)
+    elif textbook_data:
+        print(f"Textbook data from {tb_path} is not in the expected list format.")
+
+# --- End Helper Functions ---
+
+def iter_clinical_chunks():
     if INCLUDE_CHO_IN_CLINICAL:
-        # ... (rest of CHO processing logic) ...
-        print(f"\nProcessing CHO Guidelines from {CHO_FILEPATH} for Clinical KB...")
-        cho_data = load_json_file(CHO_FILEPATH)
-        if cho_data and "sections" in cho_data:
-            for section in cho_data["sections"]:
-                for subsection in section.get("subsections", []):
-                    for entry in subsection.get("entries", []):
-                        chunk, meta = create_chunks_from_guideline_entry(entry, subsection, section, "CHO Guidelines")
-                        all_chunks.append(chunk)
-                        all_metadata.append(meta)
-        else:
-            print(f"Could not process CHO data from {CHO_FILEPATH}")
-
-
-    # 2. Optionally Process CHEW Guidelines
+        yield from iter_guideline_chunks(CHO_FILEPATH, "CHO Guidelines")
     if INCLUDE_CHEW_IN_CLINICAL:
-        # ... (rest of CHEW processing logic) ...
-        print(f"\nProcessing CHEW Guidelines from {CHEW_FILEPATH} for Clinical KB...")
-        chew_data = load_json_file(CHEW_FILEPATH)
-        if chew_data and "sections" in chew_data:
-            for section in chew_data["sections"]:
-                for subsection in section.get("subsections", []):
-                    for entry in subsection.get("entries", []):
-                        chunk, meta = create_chunks_from_guideline_entry(entry, subsection, section, "CHEW Guidelines")
-                        all_chunks.append(chunk)
-                        all_metadata.append(meta)
-        else:
-            print(f"Could not process CHEW data from {CHEW_FILEPATH}")
-
-    # 3. Process Medical Textbook Data
+        yield from iter_guideline_chunks(CHEW_FILEPATH, "CHEW Guidelines")
     for tb_path in TEXTBOOK_FILE_PATHS:
-        # ... (rest of textbook processing logic) ...
-        if os.path.exists(tb_path):
-            textbook_name_from_file = os.path.splitext(os.path.basename(tb_path))[0].replace('_', ' ').title()
-            print(f"\nProcessing Textbook '{textbook_name_from_file}' from {tb_path}...")
-            textbook_data = load_json_file(tb_path)
-            if textbook_data and isinstance(textbook_data, list):
-                for disease_entry in textbook_data:
-                    chunk, meta = create_chunks_from_textbook_disease(disease_entry, textbook_name=textbook_name_from_file)
-                    all_chunks.append(chunk)
-                    all_metadata.append(meta)
-            elif textbook_data:
-                print(f"Textbook data from {tb_path} is not in the expected list format.")
-        else:
-            print(f"Textbook file not found, skipping: {tb_path}")
-
-
-    if not all_chunks: # ... (rest of the script is the same) ...
-        print("No text chunks created for Clinical KB. Exiting.")
-        return
+        yield from iter_textbook_chunks(tb_path)
+
+
+def build_clinical_knowledge_base(index_factory=DEFAULT_INDEX_FACTORY, search_params=DEFAULT_SEARCH_PARAMS,
+                                  embedding_cache_path=DEFAULT_EMBEDDING_CACHE_PATH,
+                                  workers=DEFAULT_WORKERS, batch_size=DEFAULT_BATCH_SIZE,
+                                  encoder_backend=EMBEDDING_BACKEND, dedup_threshold=DEFAULT_DEDUP_THRESHOLD):
+    print("--- Starting Clinical Support Knowledge Base Preparation ---")
 
-    print(f"\nTotal Clinical Support text chunks created: {len(all_chunks)}")
-
-    print(f"\nLoading sentence transformer model: {EMBEDDING_MODEL_NAME}...")
-    model = SentenceTransformer(EMBEDDING_MODEL_NAME)
-    print("Model loaded.")
-
-    print("Generating Clinical KB embeddings... (This may take a while)")
-    chunk_embeddings = model.encode(all_chunks, show_progress_bar=True, convert_to_numpy=True)
-    
-    dimension = chunk_embeddings.shape[1]
-    index = faiss.IndexFlatL2(dimension)
-    index.add(chunk_embeddings)
-    print(f"Clinical KB FAISS index created. Total vectors: {index.ntotal}")
-
-    # *** Ensure this uses OUTPUT_KB_DIR_CLINICAL if you defined it ***
-    # Or just ensure OUTPUT_INDEX_PATH and OUTPUT_METADATA_PATH are correct for clinical
-    output_dir = os.path.dirname(OUTPUT_INDEX_PATH) # This uses the global OUTPUT_INDEX_PATH
-    if output_dir and not os.path.exists(output_dir):
-        os.makedirs(output_dir)
-        print(f"Created output directory for Clinical KB: {output_dir}")
-        
-    print(f"\nSaving Clinical KB FAISS index to: {OUTPUT_INDEX_PATH}")
-    faiss.write_index(index, OUTPUT_INDEX_PATH)
-    print(f"Saving Clinical KB metadata to: {OUTPUT_METADATA_PATH}")
-    with open(OUTPUT_METADATA_PATH, 'w', encoding='utf-8') as f:
-        json.dump(all_metadata, f, indent=2)
+    # Chunks are embedded and indexed batch by batch as the sources are read;
+    # unchanged chunks come from the embedding cache
+    builder = StreamingKBBuilder(
+        index_path=OUTPUT_INDEX_PATH, metadata_path=OUTPUT_METADATA_PATH,
+        model_name=EMBEDDING_MODEL_NAME, index_factory=index_factory,
+        search_params=search_params, batch_size=batch_size, workers=workers,
+        embedding_cache_path=embedding_cache_path, backend=encoder_backend,
+        dedup_threshold=dedup_threshold, label="Clinical KB",
+    )
+    if builder.build(iter_clinical_chunks()) is None:
+        return
 
     print("\n--- Clinical Support Knowledge Base Preparation Complete! ---")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the clinical support knowledge base.")
+    add_index_arguments(parser)
+    add_embedding_cache_arguments(parser)
+    args = parser.parse_args()
+    embedding_cache_path = None if args.no_embedding_cache else args.embedding_cache
 
     # To make sure the script uses its intended output paths without relying on external changes:
     # global OUTPUT_INDEX_PATH, OUTPUT_METADATA_PATH # Allow modification of globals for this run
@@ -186,4 +166,9 @@ if __name__ == "__main__":
     OUTPUT_INDEX_PATH = os.path.join(OUTPUT_KB_DIR_CLINICAL, "clinical_kb_index.faiss")
     OUTPUT_METADATA_PATH = os.path.join(OUTPUT_KB_DIR_CLINICAL, "clinical_kb_metadata.json")
 
-    build_clinical_knowledge_base()
\ No newline at end of file
+    build_clinical_knowledge_base(
+        index_factory=args.index_factory, search_params=args.search_params,
+        embedding_cache_path=embedding_cache_path,
+        workers=args.workers, batch_size=args.batch_size,
+        encoder_backend=args.encoder_backend, dedup_threshold=args.dedup_threshold,
+    )
\ No newline at end of file
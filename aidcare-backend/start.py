@@ -25,6 +25,55 @@ if __name__ == "__main__":
         except Exception as e:
             print(f"WARNING: Migration skipped or failed: {e}")
 
+    # Optional embedding service (opt-in via EMBEDDING_SERVICE_SOCKET): one process
+    # holds the model and FAISS indexes, so API workers stay small and
+    # WEB_CONCURRENCY can be raised cheaply. Without it the API runs one worker:
+    # a /kb/reload handled by one of several workers would swap that worker's
+    # index only.
+    socket_path = os.environ.get("EMBEDDING_SERVICE_SOCKET")
+    workers = 1
+    service = None
+    stopping = None
+    if socket_path:
+        import signal
+        import subprocess
+        import threading
+        from aidcare_pipeline.embedding_service import wait_for_service
+
+        workers = int(os.environ.get("WEB_CONCURRENCY", 1))
+        print(f"Starting embedding service on {socket_path}")
+        service = subprocess.Popen([sys.executable, "-m", "aidcare_pipeline.embedding_service"])
+        stopping = threading.Event()
+        if not wait_for_service(socket_path, timeout=float(os.environ.get("EMBEDDING_SERVICE_START_TIMEOUT", 300))):
+            if service.poll() is not None:
+                print(f"ERROR: Embedding service exited with code {service.returncode}; not starting the API.")
+                sys.exit(1)
+            print("WARNING: Embedding service did not answer in time; triage will return 503 until it does.")
+
+        def _watch_service():
+            # Every worker's retrieval goes through the service: stop the API
+            # (and let the platform restart the container) if it dies
+            code = service.wait()
+            if stopping.is_set():
+                return
+            print(f"ERROR: Embedding service exited with code {code}; shutting down the API.")
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        threading.Thread(target=_watch_service, daemon=True).start()
+    elif int(os.environ.get("WEB_CONCURRENCY", 1)) > 1:
+        print("WARNING: WEB_CONCURRENCY is ignored without EMBEDDING_SERVICE_SOCKET; running one worker.")
+
     # Import uvicorn and run
     import uvicorn
-    uvicorn.run("main:app", host=host, port=port, log_level="info")
+    try:
+        uvicorn.run("main:app", host=host, port=port, log_level="info", workers=workers)
+    finally:
+        if service is not None and service.poll() is None:
+            stopping.set()
+            service.terminate()
+            try:
+                service.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                service.kill()
+    if service is not None and not stopping.is_set():
+        sys.exit(1)  # the embedding service died first; a non-zero exit gets the container restarted